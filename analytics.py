@@ -0,0 +1,217 @@
+"""Season-wide standings and tiebreaks computed with NumPy.
+Match rows are bulk-loaded into arrays once, then every entrant's wins,
+matches, opponent match wins and opponents match-win percentage, in every
+tournament, are computed with vectorized group-bys rather than a query per
+player. Results agree with tournament.py: standings rank like
+tournament.ranked_standings and tiebreaks match the ones kept in entrant.
+Requires NumPy.
+"""
+
+from __future__ import division
+
+import itertools
+
+import numpy
+
+import queries
+import tournament
+from queries import BYE, LOSS, POINTS, TIE, WIN
+
+# Wins and points by result id; ties count as a win for both players
+_RESULT_WINS = numpy.zeros(max(WIN, LOSS, TIE, BYE) + 1, dtype=numpy.int64)
+_RESULT_WINS[[WIN, TIE, BYE]] = 1
+_RESULT_POINTS = numpy.array(
+    [POINTS.get(result, 0) for result in range(len(_RESULT_WINS))],
+    dtype=numpy.int64)
+
+
+def _to_array(rows, columns, fetch_size):
+    """Copy rows of integers into a 2-d array, a batch at a time.
+    :param iterable rows: tuples of columns integers
+    :param int columns: count of columns per row
+    :param int fetch_size: count of rows converted at once
+    :rtype: numpy.ndarray
+    """
+    rows = iter(rows)
+    batches = []
+    while True:
+        batch = list(itertools.islice(rows, fetch_size))
+        if not batch:
+            break
+        batches.append(numpy.array(batch, dtype=numpy.int64))
+    if not batches:
+        return numpy.zeros((0, columns), dtype=numpy.int64)
+    return numpy.concatenate(batches)
+
+
+class Standings(object):
+
+    """Records and tiebreaks of every entrant of many tournaments.
+    Each array holds one value per entrant, entrants sorted by tournament
+    and player id: tournaments, players, names, wins, matches, points,
+    omw (opponent match wins) and omwp (opponents match-win percentage,
+    each opponent's percentage floored at a third).
+    """
+
+    def __init__(self, entrants, matches):
+        """Compute standings from entrants and match rows.
+        :param iterable entrants: (tournament id, player id, name) tuples
+        :param matches: (match id, tournament id, player id, result id)
+            rows, as a list or an array of four columns; rows of players
+            missing from entrants are ignored
+        """
+        entrants = sorted(entrants)
+        self.tournaments = numpy.array(
+            [row[0] for row in entrants], dtype=numpy.int64)
+        self.players = numpy.array(
+            [row[1] for row in entrants], dtype=numpy.int64)
+        self.names = [row[2] for row in entrants]
+        count = len(entrants)
+
+        matches = numpy.asarray(matches, dtype=numpy.int64).reshape(-1, 4)
+        match_ids, results = matches[:, 0], matches[:, 3]
+
+        # Find each match row's entrant by its (tournament, player) key
+        keys = (self.tournaments << 32) | self.players
+        match_keys = (matches[:, 1] << 32) | matches[:, 2]
+        positions = numpy.searchsorted(keys, match_keys)
+        found = positions < count
+        found[found] = keys[positions[found]] == match_keys[found]
+        entrant = positions[found]
+        match_ids, results = match_ids[found], results[found]
+
+        self.wins = numpy.bincount(
+            entrant, weights=_RESULT_WINS[results],
+            minlength=count).astype(numpy.int64)
+        self.matches = numpy.bincount(
+            entrant, minlength=count).astype(numpy.int64)
+        self.points = numpy.bincount(
+            entrant, weights=_RESULT_POINTS[results],
+            minlength=count).astype(numpy.int64)
+
+        # Both rows of a match sit side by side once sorted by match id
+        order = numpy.argsort(match_ids, kind='mergesort')
+        match_ids, entrant = match_ids[order], entrant[order]
+        shared = match_ids[1:] == match_ids[:-1]
+        first, second = entrant[:-1][shared], entrant[1:][shared]
+
+        # Each opponent counts once, however often they were played
+        pairs = numpy.unique(numpy.concatenate((
+            first * count + second, second * count + first)))
+        player, opponent = pairs // count, pairs % count
+
+        self.omw = numpy.bincount(
+            player, weights=self.wins[opponent],
+            minlength=count).astype(numpy.int64)
+        percentage = numpy.maximum(
+            self.points / (3.0 * numpy.maximum(self.matches, 1)), 1 / 3.0)
+        opponents = numpy.bincount(player, minlength=count)
+        self.omwp = numpy.bincount(
+            player, weights=percentage[opponent],
+            minlength=count) / numpy.maximum(opponents, 1)
+
+        # By tournament, then wins, opponent match wins and player id
+        self._ranked = numpy.lexsort(
+            (self.players, -self.omw, -self.wins, self.tournaments))
+        self._ranked_tournaments = self.tournaments[self._ranked]
+
+    def __len__(self):
+        return len(self.names)
+
+    def _positions(self, tournament_id):
+        """Get the positions of a tournament's entrants, best first."""
+        start, stop = numpy.searchsorted(
+            self._ranked_tournaments, [tournament_id, tournament_id + 1])
+        return self._ranked[start:stop]
+
+    def _rows(self, positions):
+        return [
+            (int(self.players[i]), self.names[i], int(self.wins[i]),
+             int(self.matches[i]))
+            for i in positions]
+
+    def standings(self, tournament_id):
+        """Get a tournament's ranked standings.
+        :param int tournament_id: id of the tournament
+        :returns: (id, name, wins, matches) tuples, as returned by
+            tournament.ranked_standings
+        :rtype: list
+        """
+        return self._rows(self._positions(tournament_id))
+
+    def all_standings(self):
+        """Get the ranked standings of every tournament loaded.
+        :returns: standings keyed by tournament id
+        :rtype: dict
+        """
+        return dict(
+            (int(tournament_id), self.standings(tournament_id))
+            for tournament_id in numpy.unique(self.tournaments))
+
+    def opponents_match_wins(self, tournament_id):
+        """Get opponent match wins, as tournament.opponents_match_wins does.
+        :param int tournament_id: id of the tournament
+        :returns: opponent match wins keyed by player id
+        :rtype: dict
+        """
+        return dict(
+            (int(self.players[i]), int(self.omw[i]))
+            for i in self._positions(tournament_id))
+
+    def opponents_match_win_percentages(self, tournament_id):
+        """Get opponents match-win percentages, as
+        tournament.opponents_match_win_percentages does.
+        :param int tournament_id: id of the tournament
+        :returns: opponents match-win percentage keyed by player id
+        :rtype: dict
+        """
+        return dict(
+            (int(self.players[i]), float(self.omwp[i]))
+            for i in self._positions(tournament_id))
+
+    def season_standings(self):
+        """Get a leaderboard across every tournament loaded.
+        Players are ranked by their wins in all of them, then by the sum of
+        their opponent match wins, then by id.
+        :returns: (id, name, wins, matches) tuples, best first
+        :rtype: list
+        """
+        players, first, player = numpy.unique(
+            self.players, return_index=True, return_inverse=True)
+        count = len(players)
+        wins = numpy.bincount(player, weights=self.wins, minlength=count)
+        matches = numpy.bincount(
+            player, weights=self.matches, minlength=count)
+        omw = numpy.bincount(player, weights=self.omw, minlength=count)
+        return [
+            (int(players[i]), self.names[first[i]], int(wins[i]),
+             int(matches[i]))
+            for i in numpy.lexsort((players, -omw, -wins))]
+
+
+def load_standings(tournament_ids=None, fetch_size=None):
+    """Bulk-load match results and compute standings from them.
+    :param iterable tournament_ids: ids of the tournaments to load; None
+        loads every tournament
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: standings of every entrant of the tournaments
+    :rtype: Standings
+    """
+    fetch_size = fetch_size or tournament.FETCH_SIZE
+    if tournament_ids is None:
+        match_query, entrant_query, query_args = (
+            queries.MATCH_RESULTS, queries.ENTRANT_NAMES, ())
+    else:
+        match_query, entrant_query = (
+            queries.MATCH_RESULTS_BY_TOURNAMENTS,
+            queries.ENTRANT_NAMES_BY_TOURNAMENTS)
+        query_args = (sorted(set(tournament_ids)),)
+
+    # Entrants are read last, so every match row read has its entrant
+    with tournament.session():
+        matches = _to_array(
+            tournament.stream_query(match_query, query_args, fetch_size),
+            4, fetch_size)
+        entrants = list(
+            tournament.stream_query(entrant_query, query_args, fetch_size))
+    return Standings(entrants, matches)
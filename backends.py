@@ -0,0 +1,1232 @@
+"""Storage backends for the tournament database.
+PostgreSQLBackend is the production store. SQLiteBackend, on a file or in
+memory, and MemoryBackend, on plain Python objects, run the same operations
+without a database server, for tests and small deployments.
+Every backend hands out connections with the part of psycopg2's interface
+that tournament.py and pool.py use: cursor(), commit(), rollback(),
+close(), closed and get_transaction_status(). The SQLite and memory
+backends run the statements in queries.py; the memory backend runs nothing
+else.
+"""
+
+import itertools
+import os
+import re
+import sqlite3
+import threading
+
+import queries
+from pairing import TournamentState
+from queries import BYE, LOSS, POINTS, TIE, WIN
+
+# Transaction states, as in psycopg2.extensions
+TRANSACTION_STATUS_IDLE = 0
+TRANSACTION_STATUS_INTRANS = 2
+
+SQLITE_SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'tournament_sqlite.sql')
+
+
+class BackendError(Exception):
+
+    """Raised by the memory backend for failed or unsupported statements."""
+
+
+class IntegrityError(BackendError):
+
+    """Raised by the memory backend when a statement breaks a constraint."""
+
+
+def create(spec, dsn=None):
+    """Create a storage backend from its name.
+    :param str spec: postgresql | sqlite | sqlite:<path> | memory; sqlite
+        alone is an in-memory SQLite database
+    :param str dsn: libpq connection string of the postgresql backend
+    :returns: storage backend
+    :rtype: backends.Backend
+    :raises ValueError: if the backend is not supported
+    """
+    name, _, path = spec.partition(':')
+    if name == 'postgresql':
+        return PostgreSQLBackend(dsn)
+    elif name == 'sqlite':
+        return SQLiteBackend(path or ':memory:')
+    elif name == 'memory':
+        return MemoryBackend()
+    raise ValueError("Storage backend %s is not supported." % spec)
+
+
+class Backend(object):
+
+    """A store the tournament database lives in.
+    Error, IntegrityError and ProgrammingError are the exception classes
+    the backend's connections raise.
+    """
+
+    name = None
+    Error = BackendError
+    IntegrityError = IntegrityError
+    ProgrammingError = BackendError
+
+    def connect(self):
+        """Open a new connection.
+        :returns: connection following psycopg2's interface
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """Delete every row and restart ids, keeping the schema."""
+        raise NotImplementedError
+
+    def warm_up(self, connection):
+        """Get a new connection ready for its first queries.
+        :param connection: connection opened by this backend
+        :returns: count of statements prepared
+        :rtype: int
+        """
+        return 0
+
+    def stream(self, connection, query, query_args=(), fetch_size=2000):
+        """Run a query and yield its rows a batch at a time.
+        :param connection: connection opened by this backend
+        :param str query: query string to run
+        :param tuple query_args: query args to pass to execute
+        :param int fetch_size: count of rows fetched per batch
+        :returns: generator of rows
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, query_args)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+
+    def explain(self, cursor, query, query_args=()):
+        """Get the plan of a query without running it.
+        :param cursor: cursor of the connection the query ran on
+        :param str query: query string
+        :param tuple query_args: query args to pass to execute
+        :returns: lines of the plan, or None if there is no plan to show
+        :rtype: list | None
+        """
+        return None
+
+
+class PostgreSQLBackend(Backend):
+
+    """The tournament database on a PostgreSQL server, through psycopg2.
+    The schema is created with psql -f tournament.sql.
+    """
+
+    name = 'postgresql'
+
+    def __init__(self, dsn, prepare=True):
+        """Create a backend for a PostgreSQL database.
+        :param str dsn: libpq connection string, e.g. "dbname=tournament"
+        :param bool prepare: whether to run the statements in
+            queries.PREPARED as server-side prepared statements
+        """
+        # psycopg2 is only needed where PostgreSQL is
+        import psycopg2
+
+        self.dsn = dsn
+        self.prepare = prepare
+        self._cursors = itertools.count(1)
+        self._psycopg2 = psycopg2
+        self.Error = psycopg2.Error
+        self.IntegrityError = psycopg2.IntegrityError
+        self.ProgrammingError = psycopg2.ProgrammingError
+
+    def connect(self):
+        if not self.prepare:
+            return self._psycopg2.connect(self.dsn)
+        return self._psycopg2.connect(
+            self.dsn, connection_factory=_prepared_connection_class())
+
+    def warm_up(self, connection):
+        """Prepare every statement in queries.PREPARED on a connection.
+        Statements are otherwise prepared on their first use.
+        :param connection: connection opened by this backend
+        :returns: count of statements prepared
+        :rtype: int
+        """
+        if not self.prepare:
+            return 0
+        with connection.cursor() as cursor:
+            prepared = sum(
+                cursor.prepare(query) for query in queries.PREPARED)
+        connection.commit()
+        return prepared
+
+    def reset(self):
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                # Entrants and matches cascade; result rows are kept
+                cursor.execute(
+                    "TRUNCATE player, tournament RESTART IDENTITY CASCADE;")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def stream(self, connection, query, query_args=(), fetch_size=2000):
+        # A named cursor keeps the result on the server until it is fetched
+        name = 'tournament_stream_%d' % next(self._cursors)
+        with connection.cursor(name) as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, query_args)
+            for row in cursor:
+                yield row
+
+    def explain(self, cursor, query, query_args=()):
+        # A failed EXPLAIN must not abort the caller's transaction
+        cursor.execute("SAVEPOINT explain;")
+        try:
+            cursor.execute("EXPLAIN " + query, query_args)
+            plan = [row[0] for row in cursor.fetchall()]
+        except self.Error:
+            cursor.execute("ROLLBACK TO SAVEPOINT explain;")
+            plan = None
+        cursor.execute("RELEASE SAVEPOINT explain;")
+        return plan
+
+
+_PREPARED_PARAMETER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _prepared_statements(query, name, parameters):
+    """Get the PREPARE and EXECUTE statements running a query.
+    :param str query: statement with psycopg2 placeholders
+    :param str name: name of the prepared statement
+    :param tuple parameters: (parameter, type) pairs; see queries.PREPARED
+    :returns: PREPARE statement, and EXECUTE statement taking the query's
+        arguments
+    :rtype: tuple
+    """
+    names = [parameter for parameter, _ in parameters]
+    positions = iter(range(1, len(names) + 1))
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1):
+            return '$%d' % (names.index(match.group(1)) + 1)
+        return '$%d' % next(positions)
+
+    statement = _PREPARED_PARAMETER.sub(number, query).rstrip(';')
+    if not parameters:
+        return ("PREPARE %s AS %s;" % (name, statement),
+                "EXECUTE %s;" % name)
+
+    named = '%(' in query
+    arguments = ", ".join(
+        ("%%(%s)s::%s" if named else "%%s::%s") % (
+            (parameter, type_) if named else (type_,))
+        for parameter, type_ in parameters)
+    return ("PREPARE %s (%s) AS %s;" % (
+                name, ", ".join(type_ for _, type_ in parameters), statement),
+            "EXECUTE %s (%s);" % (name, arguments))
+
+
+_prepared_connection = None
+
+
+def _prepared_connection_class():
+    """Get the psycopg2 connection class running prepared statements.
+    Built on first use, as psycopg2 is only imported where PostgreSQL is.
+    """
+    global _prepared_connection
+
+    if _prepared_connection is not None:
+        return _prepared_connection
+
+    import psycopg2.extensions
+
+    statements = {}
+
+    class PreparedCursor(psycopg2.extensions.cursor):
+
+        """Cursor running queries.PREPARED statements by name."""
+
+        def prepare(self, query):
+            """Prepare a statement on this connection unless it already is.
+            :returns: whether the statement was prepared now
+            :rtype: bool
+            """
+            if query not in statements:
+                name, parameters = queries.PREPARED[query]
+                statements[query] = _prepared_statements(
+                    query, name, parameters)
+            if query in self.connection.prepared:
+                return False
+            super(PreparedCursor, self).execute(statements[query][0])
+            # Prepared statements outlive the transaction preparing them
+            self.connection.prepared.add(query)
+            return True
+
+        def execute(self, query, vars=None):
+            # Named cursors DECLARE their query, which EXECUTE cannot be
+            if self.name is not None or query not in queries.PREPARED:
+                return super(PreparedCursor, self).execute(query, vars)
+            self.prepare(query)
+            return super(PreparedCursor, self).execute(
+                statements[query][1], vars)
+
+    class PreparedConnection(psycopg2.extensions.connection):
+
+        """Connection remembering which statements it has prepared."""
+
+        def __init__(self, *args, **kwargs):
+            super(PreparedConnection, self).__init__(*args, **kwargs)
+            self.prepared = set()
+            self.cursor_factory = PreparedCursor
+
+    _prepared_connection = PreparedConnection
+    return _prepared_connection
+
+
+class _Cursor(object):
+
+    """Cursor over the rows of the last statement run."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, query, query_args=()):
+        rows, self.rowcount = self.connection._execute(query, query_args)
+        self._rows = list(reversed(rows))
+
+    def fetchone(self):
+        return self._rows.pop() if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows = self._rows[-size:]
+        del self._rows[-size:]
+        return list(reversed(rows))
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return list(reversed(rows))
+
+    def close(self):
+        self._rows = []
+
+
+class _Connection(object):
+
+    """Connection to a backend that runs one transaction at a time.
+    A transaction starts with its first statement and holds the backend's
+    lock until it is committed or rolled back, so transactions never
+    interleave. A thread must not use two connections at once.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.closed = False
+        self._in_transaction = False
+
+    def cursor(self):
+        if self.closed:
+            raise self.backend.Error("Connection is closed.")
+        return _Cursor(self)
+
+    def _execute(self, query, query_args):
+        if self.closed:
+            raise self.backend.Error("Connection is closed.")
+        if not self._in_transaction:
+            self.backend._lock.acquire()
+            try:
+                self.backend._begin()
+            except Exception:
+                self.backend._lock.release()
+                raise
+            self._in_transaction = True
+        return self.backend._execute(query, query_args)
+
+    def _end(self, finish):
+        if not self._in_transaction:
+            return
+        try:
+            finish()
+        finally:
+            self._in_transaction = False
+            self.backend._lock.release()
+
+    def commit(self):
+        self._end(self.backend._commit)
+
+    def rollback(self):
+        self._end(self.backend._rollback)
+
+    def close(self):
+        if not self.closed:
+            self.rollback()
+            self.closed = True
+
+    def get_transaction_status(self):
+        if self._in_transaction:
+            return TRANSACTION_STATUS_INTRANS
+        return TRANSACTION_STATUS_IDLE
+
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _sqlite_placeholder(match):
+    if match.group(1):
+        return ':' + match.group(1)
+    return '?' if match.group(0) == '%s' else '%'
+
+
+class SQLiteBackend(Backend):
+
+    """The tournament database in an SQLite file, or in memory.
+    The schema in tournament_sqlite.sql, SQLite's dialect of tournament.sql,
+    is applied when the database is opened. Connections share one sqlite3
+    connection and take turns at transactions. Placeholders are translated
+    for SQLite; statements relying on PostgreSQL-only SQL, such as
+    data-modifying CTEs, run as several SQLite statements.
+    """
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    ProgrammingError = sqlite3.ProgrammingError
+
+    def __init__(self, path=':memory:'):
+        """Open an SQLite database, creating its schema if needed.
+        :param str path: database file; ':memory:' keeps it in memory
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self._db.text_factory = str
+        with open(SQLITE_SCHEMA_PATH) as schema:
+            self._db.executescript(schema.read())
+
+        self._translated = {}
+        self._statements = {
+            queries.REPORT_MATCH: self._report_match,
+            queries.REPORT_MATCH_BYE: self._report_match_bye,
+            queries.REPORT_MATCHES: self._report_matches,
+            queries.REGISTER_PLAYERS: self._register_players,
+            queries.REGISTER_PLAYERS_BY_NAME: self._register_players_by_name,
+            queries.ENROLL_PLAYERS: self._enroll_players,
+            queries.SWISS_PAIRINGS: self._swiss_pairings,
+            queries.UPDATE_MATCHES_PLAYED: self._update_matches_played,
+            queries.MATCH_RESULTS_BY_TOURNAMENTS:
+                self._match_results_by_tournaments,
+            queries.ENTRANT_NAMES_BY_TOURNAMENTS:
+                self._entrant_names_by_tournaments,
+            queries.PLAYER_NAMES: self._player_names,
+            queries.REPAIR_PLAYER_RECORDS: self._repair_player_records,
+        }
+
+    def connect(self):
+        return _Connection(self)
+
+    def reset(self):
+        with self._lock:
+            self._db.executescript(
+                "DELETE FROM player; "
+                "DELETE FROM tournament; "
+                "DELETE FROM match_sequence; "
+                "DELETE FROM sqlite_sequence;")
+
+    def explain(self, cursor, query, query_args=()):
+        # Statements run as several SQLite statements have no single plan
+        if query in self._statements:
+            return None
+        try:
+            cursor.execute("EXPLAIN QUERY PLAN " + query, query_args)
+        except self.Error:
+            return None
+        return [row[-1] for row in cursor.fetchall()]
+
+    def _begin(self):
+        # Take the write lock up front, as other processes may share a file
+        self._db.execute("BEGIN IMMEDIATE;")
+
+    def _commit(self):
+        self._db.execute("COMMIT;")
+
+    def _rollback(self):
+        self._db.execute("ROLLBACK;")
+
+    def _translate(self, query):
+        translated = self._translated.get(query)
+        if translated is None:
+            translated = _PLACEHOLDER.sub(_sqlite_placeholder, query)
+            self._translated[query] = translated
+        return translated
+
+    def _execute(self, query, query_args):
+        cursor = self._db.cursor()
+        statement = self._statements.get(query)
+        if statement is None:
+            cursor.execute(self._translate(query), query_args)
+            rows = cursor.fetchall()
+            return rows, cursor.rowcount
+
+        # Statements made of several run all or nothing, as one would
+        cursor.execute("SAVEPOINT statement;")
+        try:
+            result = statement(cursor, query_args)
+        except Exception:
+            cursor.execute("ROLLBACK TO statement;")
+            cursor.execute("RELEASE statement;")
+            raise
+        cursor.execute("RELEASE statement;")
+        return result
+
+    def _lock_tournament(self, cursor, tournament):
+        """Lock a tournament with LOCK_TOURNAMENT, as PostgreSQL reports do.
+        Locking bumps the tournament's version.
+        :returns: whether the tournament exists
+        :rtype: bool
+        """
+        cursor.execute(
+            self._translate(queries.LOCK_TOURNAMENT),
+            {'tournament': tournament})
+        return cursor.fetchone() is not None
+
+    def _report(self, cursor, tournament, winner, loser, tie):
+        """Record one result; a result without a loser is a bye.
+        The tournament must be locked.
+        :returns: id of the match
+        :rtype: int
+        """
+        cursor.execute("INSERT INTO match_sequence DEFAULT VALUES;")
+        match_id = cursor.lastrowid
+        cursor.execute(
+            "DELETE FROM match_sequence WHERE id = ?;", (match_id,))
+
+        if loser is None:
+            played = [(winner, BYE, 1)]
+        else:
+            played = [
+                (winner, TIE if tie else WIN, 1),
+                (loser, TIE if tie else LOSS, 1 if tie else 0)]
+        cursor.executemany(
+            "INSERT INTO match (id, player_id, tournament_id, result_id) "
+            "VALUES (?, ?, ?, ?);",
+            [(match_id, player, tournament, result)
+             for player, result, _ in played])
+        cursor.executemany(
+            "UPDATE entrant "
+            "SET matches = matches + 1, "
+            "    wins = wins + ?, "
+            "    points = points + ?, "
+            "    bye = bye OR ? "
+            "WHERE player_id = ? "
+            "AND tournament_id = ?;",
+            [(wins, POINTS[result], result == BYE, player, tournament)
+             for player, result, wins in played])
+        self._update_tiebreaks(cursor, tournament, winner, loser)
+        return match_id
+
+    def _update_tiebreaks(self, cursor, tournament, winner, loser):
+        """Recompute the tiebreaks a new result changes.
+        Everyone the players have played, each other included, has an
+        opponent with a new result; nobody else's tiebreaks change. As in
+        the match_tiebreaks trigger of tournament.sql, they are found once
+        and their opponents' results summed in one grouped query.
+        """
+        opponents = (
+            "SELECT DISTINCT m.player_id, o.player_id AS opponent_id "
+            "FROM match m, match o "
+            "WHERE o.id = m.id "
+            "AND o.player_id != m.player_id "
+            "AND m.tournament_id = ? "
+            "AND m.player_id IN (%s)")
+        cursor.execute(
+            "SELECT DISTINCT opponent_id FROM (%s);" % (opponents % "?, ?"),
+            (tournament, winner, loser))
+        affected = [row[0] for row in cursor.fetchall()]
+        if not affected:
+            return
+
+        cursor.execute(
+            "SELECT op.player_id, sum(opponent.wins), "
+            "    avg(max("
+            "        opponent.points / (3.0 * opponent.matches), 1 / 3.0)) "
+            "FROM (%s) op "
+            "JOIN entrant opponent ON opponent.tournament_id = ? "
+            "AND opponent.player_id = op.opponent_id "
+            "GROUP BY op.player_id;" % (
+                opponents % ", ".join("?" * len(affected))),
+            [tournament] + affected + [tournament])
+        cursor.executemany(
+            "UPDATE entrant SET omw = ?, omwp = ? "
+            "WHERE tournament_id = ? AND player_id = ?;",
+            [(omw, omwp, tournament, player)
+             for player, omw, omwp in cursor.fetchall()])
+
+    def _report_match(self, cursor, args):
+        # Nothing comes back for a missing tournament, as on PostgreSQL
+        if not self._lock_tournament(cursor, args['tournament']):
+            return [], 0
+        key = args['key']
+        if key is not None:
+            cursor.execute(
+                self._translate(queries.SUBMITTED_MATCH),
+                (args['tournament'], key))
+            if cursor.fetchone() is not None:
+                return [], 0
+        match_id = self._report(
+            cursor, args['tournament'], args['winner'], args['loser'],
+            args['tie'])
+        if key is not None:
+            cursor.execute(
+                "INSERT INTO submission (tournament_id, key, match_id) "
+                "VALUES (?, ?, ?);", (args['tournament'], key, match_id))
+        return [(match_id,), (match_id,)], 2
+
+    def _report_match_bye(self, cursor, args):
+        cursor.execute(
+            "SELECT 1 FROM entrant WHERE player_id = ? AND tournament_id = ?;",
+            (args['player'], args['tournament']))
+        if cursor.fetchone() is None:
+            return [], 0
+        self._lock_tournament(cursor, args['tournament'])
+        self._report(cursor, args['tournament'], args['player'], None, False)
+        return [], 1
+
+    def _report_matches(self, cursor, args):
+        if not self._lock_tournament(cursor, args['tournament']):
+            return [], 0
+        match_ids = [
+            self._report(cursor, args['tournament'], winner, loser, tie)
+            for winner, loser, tie in zip(
+                args['winners'], args['losers'], args['ties'])]
+        return [(match_id,) for match_id in match_ids], len(match_ids)
+
+    def _update_matches_played(self, cursor, args):
+        players, = args
+        cursor.execute(
+            "UPDATE player SET matches = matches + 1 WHERE id IN (%s);" % (
+                ", ".join("?" * len(players))), list(players))
+        return [], cursor.rowcount
+
+    def _match_results_by_tournaments(self, cursor, args):
+        tournaments, = args
+        cursor.execute(
+            "SELECT id, tournament_id, player_id, result_id FROM match "
+            "WHERE tournament_id IN (%s);" % (
+                ", ".join("?" * len(tournaments))), list(tournaments))
+        rows = cursor.fetchall()
+        return rows, len(rows)
+
+    def _entrant_names_by_tournaments(self, cursor, args):
+        tournaments, = args
+        cursor.execute(
+            "SELECT e.tournament_id, e.player_id, p.name "
+            "FROM entrant e JOIN player p ON p.id = e.player_id "
+            "WHERE e.tournament_id IN (%s);" % (
+                ", ".join("?" * len(tournaments))), list(tournaments))
+        rows = cursor.fetchall()
+        return rows, len(rows)
+
+    def _player_names(self, cursor, args):
+        players, = args
+        cursor.execute(
+            "SELECT id, name FROM player WHERE id IN (%s);" % (
+                ", ".join("?" * len(players))), list(players))
+        rows = cursor.fetchall()
+        return rows, len(rows)
+
+    def _repair_player_records(self, cursor, args):
+        cursor.executemany(
+            "UPDATE player SET wins = wins + ?, matches = matches + ? "
+            "WHERE id = ?;",
+            zip(args['wins'], args['matches'], args['players']))
+        return [], len(args['players'])
+
+    def _register_players(self, cursor, args):
+        rows = []
+        for name in args['names']:
+            cursor.execute("INSERT INTO player (name) VALUES (?);", (name,))
+            rows.append((cursor.lastrowid,))
+        return rows, len(rows)
+
+    def _register_players_by_name(self, cursor, args):
+        player_ids = {}
+        for name in args['names']:
+            if name in player_ids:
+                continue
+            cursor.execute(
+                "SELECT min(id) FROM player WHERE name = ?;", (name,))
+            player_id, = cursor.fetchone()
+            if player_id is None:
+                cursor.execute(
+                    "INSERT INTO player (name) VALUES (?);", (name,))
+                player_id = cursor.lastrowid
+            player_ids[name] = player_id
+        rows = [(player_ids[name],) for name in args['names']]
+        return rows, len(rows)
+
+    def _enroll_players(self, cursor, args):
+        cursor.executemany(
+            "INSERT INTO entrant (player_id, tournament_id) "
+            "VALUES (?, ?) "
+            "ON CONFLICT DO NOTHING;",
+            [(player, args['tournament']) for player in args['players']])
+        return [], cursor.rowcount
+
+    def _swiss_pairings(self, cursor, args):
+        # Bye points come from POINTS, as for every other result
+        tournament, _ = args
+        cursor.execute(
+            self._translate(queries.STATE_ENTRANTS), (tournament,))
+        entrants = cursor.fetchall()
+        cursor.execute(
+            self._translate(queries.STATE_OPPONENTS), (tournament,))
+        state = TournamentState(tournament, entrants, cursor.fetchall())
+
+        pairs, bye = state.pair()
+        rows = []
+        if bye is not None:
+            self._report(cursor, tournament, state.ids[bye], None, False)
+            rows.append((state.ids[bye], state.names[bye], None, None))
+        rows.extend(state.pairings(pairs))
+        return rows, len(rows)
+
+
+def _template_pattern(template):
+    """Compile a pattern matching a statement formatted from a template.
+    :param str template: statement with one %s to format
+    :rtype: re.RegexObject
+    """
+    pattern = re.escape(template % 'TEMPLATEARGUMENT')
+    return re.compile(
+        '^%s$' % pattern.replace('TEMPLATEARGUMENT', '(.+?)'))
+
+
+class MemoryBackend(Backend):
+
+    """The tournament database as Python objects in this process.
+    Each statement in queries.py is carried out by a method keyed on its
+    text; anything else raises BackendError. Constraints and cascades are
+    enforced as in tournament.sql, and every change is logged so a
+    rollback, or a failed statement, can undo it.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._undo = []
+        self._clear()
+
+        self._statements = {
+            "SELECT 1;": lambda args: ([(1,)], 1),
+            queries.COUNT_PLAYERS: self._count_players,
+            queries.REGISTER_PLAYER: self._register_player,
+            queries.REGISTER_TOURNAMENT: self._register_tournament,
+            queries.REGISTER_ENTRANT: self._register_entrant,
+            queries.PLAYER_STANDINGS: self._player_standings,
+            queries.PLAYER_OPPONENTS: self._player_opponents,
+            queries.OPPONENTS_MATCH_WINS: self._opponents_match_wins,
+            queries.OPPONENTS_MATCH_WIN_PERCENTAGES:
+                self._opponents_match_win_percentages,
+            queries.RANKED_STANDINGS: self._ranked_standings,
+            queries.STANDINGS_BY_TOURNAMENT: self._standings_by_tournament,
+            queries.HAS_RECEIVED_BYE: self._has_received_bye,
+            queries.UPDATE_MATCH_WINS: self._update_match_wins,
+            queries.UPDATE_MATCHES_PLAYED: self._update_matches_played,
+            queries.PLAYER_OPPONENTS_MATCH_WINS:
+                self._player_opponents_match_wins,
+            queries.REPORT_MATCH: self._report_match,
+            queries.REPORT_MATCH_BYE: self._report_match_bye,
+            queries.REPORT_MATCHES: self._report_matches,
+            queries.SUBMITTED_MATCH: self._submitted_match,
+            queries.LOCK_TOURNAMENT: self._lock_tournament,
+            queries.TOURNAMENT_VERSION: self._tournament_version,
+            queries.MATCH_HISTORY: self._match_history,
+            queries.MATCH_HISTORY_BY_TOURNAMENT: self._match_history,
+            queries.MATCH_RESULTS: self._match_results,
+            queries.PLAYER_NAMES: self._player_names,
+            queries.PLAYER_RECORD_DRIFT: self._player_record_drift,
+            queries.REPAIR_PLAYER_RECORDS: self._repair_player_records,
+            queries.MATCH_RESULTS_BY_TOURNAMENTS: self._match_results,
+            queries.ENTRANT_NAMES: self._entrant_names,
+            queries.ENTRANT_NAMES_BY_TOURNAMENTS: self._entrant_names,
+            queries.STATE_ENTRANTS: self._state_entrants,
+            queries.STATE_OPPONENTS: self._state_opponents,
+            queries.REGISTER_PLAYERS: self._register_players,
+            queries.REGISTER_PLAYERS_BY_NAME: self._register_players_by_name,
+            queries.ENROLL_PLAYERS: self._enroll_players,
+            queries.SWISS_PAIRINGS: self._swiss_pairings,
+        }
+        self._templates = [
+            (_template_pattern(queries.DELETE_ALL), self._delete_all),
+        ]
+
+    def _clear(self):
+        # id -> (name, wins, matches)
+        self._players = {}
+        # id -> (name, players)
+        self._tournaments = {}
+        # tournament -> {player: (bye, wins, matches, points)}
+        self._entrants = {}
+        # tournament -> {match id: ((player, result), ...)}
+        self._matches = {}
+        # (tournament, idempotency key) -> match id
+        self._submissions = {}
+        # Like sequences, ids are never handed out twice
+        self._ids = dict(
+            (table, itertools.count(1))
+            for table in ('player', 'tournament', 'match'))
+
+    def connect(self):
+        return _Connection(self)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _begin(self):
+        self._undo = []
+
+    def _commit(self):
+        self._undo = []
+
+    def _rollback(self):
+        self._undo_to(0)
+
+    def _undo_to(self, mark):
+        while len(self._undo) > mark:
+            mapping, key, existed, value = self._undo.pop()
+            if existed:
+                mapping[key] = value
+            else:
+                del mapping[key]
+
+    def _set(self, mapping, key, value):
+        self._undo.append((mapping, key, key in mapping, mapping.get(key)))
+        mapping[key] = value
+
+    def _delete(self, mapping, key):
+        self._undo.append((mapping, key, True, mapping[key]))
+        del mapping[key]
+
+    def _execute(self, query, query_args):
+        statement = self._statements.get(query)
+        groups = ()
+        if statement is None:
+            for pattern, template_statement in self._templates:
+                match = pattern.match(query)
+                if match:
+                    statement, groups = template_statement, match.groups()
+                    break
+            else:
+                raise BackendError(
+                    "Query is not supported by the memory backend: %s" % (
+                        query))
+
+        mark = len(self._undo)
+        try:
+            return statement(query_args, *groups)
+        except Exception:
+            self._undo_to(mark)
+            raise
+
+    def _entrant(self, player, tournament):
+        """Get an entrant's record, raising if it is not registered."""
+        entrant = self._entrants.get(tournament, {}).get(player)
+        if entrant is None:
+            raise IntegrityError(
+                "Player %s is not an entrant of tournament %s." % (
+                    player, tournament))
+        return entrant
+
+    def _delete_all(self, args, table):
+        if table == 'match':
+            deleted = 0
+            for tournament in list(self._matches):
+                for played in self._matches[tournament].values():
+                    deleted += len(played)
+                self._delete(self._matches, tournament)
+            return [], deleted
+        elif table == 'entrant':
+            self._delete_all(args, 'match')
+            deleted = sum(len(e) for e in self._entrants.values())
+            for tournament in list(self._entrants):
+                self._delete(self._entrants, tournament)
+            return [], deleted
+        elif table in ('player', 'tournament'):
+            self._delete_all(args, 'entrant')
+            rows = self._players if table == 'player' else self._tournaments
+            if table == 'tournament':
+                for submission in list(self._submissions):
+                    self._delete(self._submissions, submission)
+            deleted = len(rows)
+            for key in list(rows):
+                self._delete(rows, key)
+            return [], deleted
+        raise BackendError("Table %s cannot be emptied." % table)
+
+    def _count_players(self, args):
+        return [(len(self._players),)], 1
+
+    def _register_player(self, args):
+        name, = args
+        player = next(self._ids['player'])
+        self._set(self._players, player, (name, 0, 0))
+        return [(player,)], 1
+
+    def _register_tournament(self, args):
+        name, players = args
+        tournament = next(self._ids['tournament'])
+        self._set(self._tournaments, tournament, (name, players))
+        return [(tournament,)], 1
+
+    def _register_entrant(self, args):
+        player, tournament = args
+        if player not in self._players or (
+                tournament not in self._tournaments):
+            raise IntegrityError(
+                "Player %s or tournament %s does not exist." % (
+                    player, tournament))
+        if tournament not in self._entrants:
+            self._set(self._entrants, tournament, {})
+        entrants = self._entrants[tournament]
+        if player in entrants:
+            raise IntegrityError(
+                "Player %s is already an entrant of tournament %s." % (
+                    player, tournament))
+        self._set(entrants, player, (False, 0, 0, 0))
+        return [], 1
+
+    def _register_players(self, args):
+        rows = [self._register_player((name,))[0][0]
+                for name in args['names']]
+        return rows, len(rows)
+
+    def _register_players_by_name(self, args):
+        names = set(args['names'])
+        player_ids = {}
+        for player, (name, _, _) in self._players.items():
+            if name in names:
+                player_ids[name] = min(player, player_ids.get(name, player))
+        for name in args['names']:
+            if name not in player_ids:
+                player_ids[name] = self._register_player((name,))[0][0][0]
+        rows = [(player_ids[name],) for name in args['names']]
+        return rows, len(rows)
+
+    def _enroll_players(self, args):
+        enrolled = 0
+        for player in args['players']:
+            if player not in self._entrants.get(args['tournament'], {}):
+                self._register_entrant((player, args['tournament']))
+                enrolled += 1
+        return [], enrolled
+
+    def _lifetime_records(self):
+        """Get lifetime records as PLAYER_STANDINGS adds them up.
+        :returns: player id -> [wins, matches]
+        :rtype: dict
+        """
+        records = dict(
+            (player, [wins, matches])
+            for player, (_, wins, matches) in self._players.items())
+        for entrants in self._entrants.values():
+            for player, (_, wins, matches, _) in entrants.items():
+                records[player][0] += wins
+                records[player][1] += matches
+        return records
+
+    def _player_standings(self, args):
+        rows = [
+            (player, self._players[player][0], wins, matches)
+            for player, (wins, matches) in self._lifetime_records().items()]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows, len(rows)
+
+    def _opponents(self, tournament):
+        """Get each player's opponents in a tournament, in match order.
+        :rtype: dict
+        """
+        opponents = {}
+        matches = self._matches.get(tournament, {})
+        for match_id in sorted(matches):
+            played = [player for player, _ in matches[match_id]]
+            for player in played:
+                opponents.setdefault(player, []).extend(
+                    opponent for opponent in played if opponent != player)
+        return opponents
+
+    def _player_opponents(self, args):
+        player, tournament, _ = args
+        rows = [
+            (opponent,)
+            for opponent in self._opponents(tournament).get(player, [])]
+        return rows, len(rows)
+
+    def _tiebreaks(self, tournament):
+        """Get each entrant's opponent match wins and opponents match-win
+        percentage, computed from the match history.
+        :rtype: dict
+        """
+        entrants = self._entrants.get(tournament, {})
+        opponents = self._opponents(tournament)
+        tiebreaks = {}
+        for player in entrants:
+            records = [
+                entrants[opponent] for opponent in set(
+                    opponents.get(player, ()))
+                if opponent in entrants]
+            if not records:
+                tiebreaks[player] = (0, 0.0)
+                continue
+            percentages = [
+                max(points / (3.0 * matches), 1 / 3.0)
+                for _, _, matches, points in records]
+            tiebreaks[player] = (
+                sum(wins for _, wins, _, _ in records),
+                sum(percentages) / len(percentages))
+        return tiebreaks
+
+    def _player_opponents_match_wins(self, args):
+        player, tournament = args
+        tiebreaks = self._tiebreaks(tournament)
+        if player not in tiebreaks:
+            return [], 0
+        return [(tiebreaks[player][0],)], 1
+
+    def _opponents_match_wins(self, args):
+        tournament, = args
+        rows = [
+            (player, omw)
+            for player, (omw, _) in sorted(
+                self._tiebreaks(tournament).items())]
+        return rows, len(rows)
+
+    def _opponents_match_win_percentages(self, args):
+        tournament, = args
+        rows = [
+            (player, omwp)
+            for player, (_, omwp) in sorted(
+                self._tiebreaks(tournament).items())]
+        return rows, len(rows)
+
+    def _ranked_standings(self, args):
+        tournament, = args
+        tiebreaks = self._tiebreaks(tournament)
+        rows, _ = self._standings_by_tournament(args)
+        rows.sort(key=lambda row: (-row[2], -tiebreaks[row[0]][0], row[0]))
+        return rows, len(rows)
+
+    def _standings_by_tournament(self, args):
+        tournament, = args
+        rows = [
+            (player, self._players[player][0], wins, matches)
+            for player, (_, wins, matches, _) in self._entrants.get(
+                tournament, {}).items()]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows, len(rows)
+
+    def _has_received_bye(self, args):
+        player, tournament = args
+        entrant = self._entrants.get(tournament, {}).get(player)
+        if entrant is None:
+            return [], 0
+        return [(entrant[0],)], 1
+
+    def _update_players(self, players, wins, matches):
+        """Add to the lifetime records of existing players.
+        :returns: count of players updated
+        :rtype: int
+        """
+        updated = 0
+        for player in set(players):
+            if player in self._players:
+                name, player_wins, player_matches = self._players[player]
+                self._set(self._players, player, (
+                    name, player_wins + wins, player_matches + matches))
+                updated += 1
+        return updated
+
+    def _update_match_wins(self, args):
+        player, = args
+        return [], self._update_players([player], 1, 0)
+
+    def _update_matches_played(self, args):
+        players, = args
+        return [], self._update_players(players, 0, 1)
+
+    def _report(self, tournament, winner, loser, tie):
+        """Record one result; a result without a loser is a bye.
+        :returns: id of the match
+        :rtype: int
+        """
+        if loser is None:
+            played = [(winner, BYE, 1)]
+        else:
+            played = [
+                (winner, TIE if tie else WIN, 1),
+                (loser, TIE if tie else LOSS, 1 if tie else 0)]
+        for player, _, _ in played:
+            self._entrant(player, tournament)
+
+        match_id = next(self._ids['match'])
+        if tournament not in self._matches:
+            self._set(self._matches, tournament, {})
+        self._set(self._matches[tournament], match_id, tuple(
+            (player, result) for player, result, _ in played))
+
+        entrants = self._entrants[tournament]
+        for player, result, wins in played:
+            bye, entrant_wins, matches, points = entrants[player]
+            self._set(entrants, player, (
+                bye or result == BYE, entrant_wins + wins, matches + 1,
+                points + POINTS[result]))
+        return match_id
+
+    def _report_match(self, args):
+        # Nothing comes back for a missing tournament, as on PostgreSQL
+        if args['tournament'] not in self._tournaments:
+            return [], 0
+        submission = args['tournament'], args['key']
+        if args['key'] is not None and submission in self._submissions:
+            return [], 0
+        match_id = self._report(
+            args['tournament'], args['winner'], args['loser'], args['tie'])
+        if args['key'] is not None:
+            self._set(self._submissions, submission, match_id)
+        return [(match_id,), (match_id,)], 2
+
+    def _match_history(self, args):
+        tournaments = sorted(self._matches) if not args else args
+        results = {WIN: 'Win', LOSS: 'Loss', TIE: 'Tie', BYE: 'Bye'}
+        rows = []
+        for tournament in tournaments:
+            for match_id, played in self._matches.get(tournament, {}).items():
+                for player, result in played:
+                    rows.append((
+                        match_id, tournament, player,
+                        self._players[player][0], results[result]))
+        rows.sort()
+        return rows, len(rows)
+
+    def _lock_tournament(self, args):
+        # Statements already run one at a time; only existence is checked
+        if args['tournament'] not in self._tournaments:
+            return [], 0
+        return [(args['tournament'],)], 1
+
+    def _tournament_version(self, args):
+        # Only this process writes here, and its writes invalidate the cache
+        # themselves, so one version serves
+        if args[0] not in self._tournaments:
+            return [], 0
+        return [(0,)], 1
+
+    def _match_results(self, args):
+        tournaments = sorted(self._matches) if not args else args[0]
+        rows = [
+            (match_id, tournament, player, result)
+            for tournament in tournaments
+            for match_id, played in self._matches.get(tournament, {}).items()
+            for player, result in played]
+        return rows, len(rows)
+
+    def _entrant_names(self, args):
+        tournaments = sorted(self._entrants) if not args else args[0]
+        rows = [
+            (tournament, player, self._players[player][0])
+            for tournament in tournaments
+            for player in self._entrants.get(tournament, {})]
+        return rows, len(rows)
+
+    def _player_names(self, args):
+        players, = args
+        rows = [
+            (player, self._players[player][0]) for player in set(players)
+            if player in self._players]
+        return rows, len(rows)
+
+    def _player_record_drift(self, args):
+        loss, = args
+        counted = dict((player, [0, 0]) for player in self._players)
+        for matches in self._matches.values():
+            for played in matches.values():
+                for player, result in played:
+                    counted[player][0] += result != loss
+                    counted[player][1] += 1
+        rows = [
+            (player, wins, matches) + tuple(counted[player])
+            for player, (wins, matches) in sorted(
+                self._lifetime_records().items())
+            if [wins, matches] != counted[player]]
+        return rows, len(rows)
+
+    def _repair_player_records(self, args):
+        for player, wins, matches in zip(
+                args['players'], args['wins'], args['matches']):
+            self._update_players([player], wins, matches)
+        return [], len(args['players'])
+
+    def _submitted_match(self, args):
+        match_id = self._submissions.get(tuple(args))
+        rows = [] if match_id is None else [(match_id,)]
+        return rows, len(rows)
+
+    def _report_match_bye(self, args):
+        if args['player'] not in self._entrants.get(args['tournament'], {}):
+            return [], 0
+        self._report(args['tournament'], args['player'], None, False)
+        return [], 1
+
+    def _report_matches(self, args):
+        if args['tournament'] not in self._tournaments:
+            return [], 0
+        match_ids = [
+            self._report(args['tournament'], winner, loser, tie)
+            for winner, loser, tie in zip(
+                args['winners'], args['losers'], args['ties'])]
+        return [(match_id,) for match_id in match_ids], len(match_ids)
+
+    def _state_entrants(self, args):
+        tournament, = args
+        rows = [
+            (player, self._players[player][0], wins, matches, bye)
+            for player, (bye, wins, matches, _) in sorted(
+                self._entrants.get(tournament, {}).items())]
+        return rows, len(rows)
+
+    def _state_opponents(self, args):
+        tournament, = args
+        rows = []
+        matches = self._matches.get(tournament, {})
+        for match_id in sorted(matches):
+            played = sorted(player for player, _ in matches[match_id])
+            if len(played) == 2:
+                rows.append(tuple(played))
+        return rows, len(rows)
+
+    def _swiss_pairings(self, args):
+        tournament, _ = args
+        entrants, _ = self._state_entrants((tournament,))
+        opponents, _ = self._state_opponents((tournament,))
+        state = TournamentState(tournament, entrants, opponents)
+
+        pairs, bye = state.pair()
+        rows = []
+        if bye is not None:
+            self._report(tournament, state.ids[bye], None, False)
+            rows.append((state.ids[bye], state.names[bye], None, None))
+        rows.extend(state.pairings(pairs))
+        return rows, len(rows)
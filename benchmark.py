@@ -0,0 +1,525 @@
+"""Benchmarks for the tournament.py hot paths.
+Benchmarks run against the database configured for tournament.py (see
+tournament.configure) and delete the rows they create when they finish.
+
+Usage:
+    python benchmark.py pool [--matches 10000]
+    python benchmark.py round [--tables 512]
+    python benchmark.py pairing [--players 2000]
+    python benchmark.py register [--players 1500]
+    python3 benchmark.py load [--clients 500]  # needs aiopg
+    python benchmark.py lifecycle [--players 8 64 512 10000]
+        [--output results.json] [--baseline baseline.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import math
+import platform
+import random
+import sys
+import threading
+import time
+
+import tournament
+from pairing import ENGINES, TournamentState
+
+
+class _ConnectPerQuery(object):
+
+    """Stand-in pool that opens a fresh connection for every checkout."""
+
+    def getconn(self):
+        return tournament.connect()
+
+    def putconn(self, connection):
+        connection.close()
+
+
+def delete_event(tournament_id, player_ids):
+    """Delete a benchmark's tournament and players from PostgreSQL.
+    Other backends only run the statements in queries.py; the benchmarks
+    use them in memory, so their rows are discarded with the process.
+    :param int tournament_id: id of the tournament to delete
+    :param list player_ids: ids of the players to delete
+    """
+    if tournament.get_backend().name != 'postgresql':
+        return
+    # Entrants and matches cascade from player and tournament
+    tournament.run_query(
+        "DELETE FROM player WHERE id = ANY(%s);",
+        query_args=(player_ids,), query_type='DELETE')
+    tournament.run_query(
+        "DELETE FROM tournament WHERE id = %s;",
+        query_args=(tournament_id,), query_type='DELETE')
+
+
+@contextlib.contextmanager
+def synthetic_event(name, players):
+    """Register a throwaway tournament and its entrants.
+    :param str name: name of the tournament
+    :param int players: count of entrants to register
+    :returns: tournament id and list of player ids
+    :rtype: tuple
+    """
+    tournament_id = tournament.register_tournament(name, players)
+    player_ids = []
+    try:
+        player_ids = tournament.register_players(
+            "Player %d of %d" % (number, tournament_id)
+            for number in range(players))
+        tournament.enroll_players(tournament_id, player_ids)
+        yield tournament_id, player_ids
+    finally:
+        delete_event(tournament_id, player_ids)
+
+
+@contextlib.contextmanager
+def connect_per_query():
+    """Run tournament.py with a new connection per query, unpooled."""
+    get_pool = tournament.get_pool
+    tournament.get_pool = _ConnectPerQuery
+    try:
+        yield
+    finally:
+        tournament.get_pool = get_pool
+
+
+def time_report_match(matches, players, seed):
+    """Time reporting seeded random matches one report_match at a time.
+    :returns: elapsed seconds
+    :rtype: float
+    """
+    rng = random.Random(seed)
+    with synthetic_event("Benchmark report_match", players) as event:
+        tournament_id, player_ids = event
+        results = [rng.sample(player_ids, 2) for _ in range(matches)]
+
+        start = time.time()
+        for winner, loser in results:
+            tournament.report_match(winner, loser, tournament_id)
+        return time.time() - start
+
+
+def bench_pool(matches=10000, players=64, seed=0):
+    """Compare report_match throughput pooled and with a connect per query.
+    :param int matches: count of matches to report in each mode
+    :param int players: count of entrants to spread the matches over
+    :param int seed: random seed for the match results
+    :returns: elapsed seconds keyed by mode
+    :rtype: dict
+    """
+    timings = {}
+    timings['pooled'] = time_report_match(matches, players, seed)
+    with connect_per_query():
+        timings['connect_per_query'] = time_report_match(
+            matches, players, seed)
+    return timings
+
+
+def bench_round(tables=512, rounds=3, seed=0):
+    """Compare reporting whole rounds per match and in bulk.
+    :param int tables: count of tables (matches) in each round
+    :param int rounds: count of rounds to report in each mode
+    :param int seed: random seed for the round results
+    :returns: mean seconds per round keyed by mode
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    timings = {'report_match': 0.0, 'report_matches': 0.0}
+    with synthetic_event("Benchmark round", tables * 2) as event:
+        tournament_id, player_ids = event
+        for _ in range(rounds):
+            for mode in ('report_match', 'report_matches'):
+                rng.shuffle(player_ids)
+                results = [
+                    (player_ids[i], player_ids[i + 1], rng.random() < 0.05)
+                    for i in range(0, len(player_ids), 2)]
+
+                start = time.time()
+                if mode == 'report_match':
+                    for winner, loser, tie in results:
+                        tournament.report_match(
+                            winner, loser, tournament_id, tie)
+                else:
+                    tournament.report_matches(tournament_id, results)
+                timings[mode] += time.time() - start
+
+    return dict((mode, total / rounds) for mode, total in timings.items())
+
+
+def bench_register(players=1500):
+    """Compare checking players in one at a time and in bulk.
+    :param int players: count of players to register and enter
+    :returns: elapsed seconds keyed by mode
+    :rtype: dict
+    """
+    timings = {}
+    for mode in ('register_player', 'register_players'):
+        tournament_id = tournament.register_tournament(
+            "Benchmark %s" % mode, players)
+        names = [
+            "Player %d of %d" % (number, tournament_id)
+            for number in range(players)]
+        player_ids = []
+        try:
+            start = time.time()
+            if mode == 'register_player':
+                for name in names:
+                    player_id = tournament.register_player(name)
+                    player_ids.append(player_id)
+                    tournament.register_player_in_tournament(
+                        player_id, tournament_id)
+            else:
+                player_ids = tournament.register_players(names)
+                tournament.enroll_players(tournament_id, player_ids)
+            timings[mode] = time.time() - start
+        finally:
+            delete_event(tournament_id, player_ids)
+    return timings
+
+
+def synthetic_state(players, rounds, seed=0):
+    """Build a tournament snapshot with seeded random history in memory.
+    Each round pairs players at random and flips a coin for the winner,
+    so no database is involved.
+    :param int players: count of entrants
+    :param int rounds: count of rounds already played
+    :param int seed: random seed for the history
+    :returns: tournament snapshot
+    :rtype: pairing.TournamentState
+    """
+    rng = random.Random(seed)
+    wins = [0] * players
+    history = []
+    order = list(range(players))
+    for _ in range(rounds):
+        rng.shuffle(order)
+        for i in range(0, players - 1, 2):
+            winner, loser = order[i], order[i + 1]
+            if rng.random() < 0.5:
+                winner, loser = loser, winner
+            wins[winner] += 1
+            history.append((winner, loser))
+
+    entrants = [
+        (player, "Player %d" % player, wins[player], rounds, False)
+        for player in range(players)]
+    return TournamentState(None, entrants, history)
+
+
+def bench_pairing(players=2000, rounds=8, repeat=5, seed=0,
+                  engine='greedy'):
+    """Time ranking and pairing a round entirely in memory.
+    :param int players: count of entrants
+    :param int rounds: count of rounds already played
+    :param int repeat: count of timed pairings; the best is reported
+    :param int seed: random seed for the history
+    :param str engine: pairing engine to time
+    :returns: best seconds per pairing
+    :rtype: float
+    """
+    pair = ENGINES[engine]
+    best = None
+    for _ in range(repeat):
+        state = synthetic_state(players, rounds, seed)
+        start = time.time()
+        pair(state)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_workload(clients, requests, tournament_id, player_ids, seed):
+    """Build each client's seeded sequence of requests.
+    Four in five requests look standings up; the rest report a match.
+    :returns: (function name, args) lists, one per client
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(clients):
+        calls = []
+        for _ in range(requests):
+            if rng.random() < 0.8:
+                calls.append((
+                    'player_standings_by_tournament', (tournament_id,)))
+            else:
+                winner, loser = rng.sample(player_ids, 2)
+                calls.append(('report_match', (winner, loser, tournament_id)))
+        workload.append(calls)
+    return workload
+
+
+def time_sync_clients(workload):
+    """Time every client as a thread calling tournament.py.
+    :returns: elapsed seconds
+    :rtype: float
+    """
+    def client(calls):
+        for name, args in calls:
+            getattr(tournament, name)(*args)
+
+    threads = [
+        threading.Thread(target=client, args=(calls,)) for calls in workload]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def bench_load(clients=500, requests=20, players=64, seed=0):
+    """Compare requests per second of the sync and async APIs under load.
+    Both share a pool of tournament.POOL_SIZE connections and the results
+    cache, so reports keep invalidating the standings being looked up.
+    :param int clients: count of concurrent clients
+    :param int requests: count of requests made by each client in turn
+    :param int players: count of entrants the matches are reported between
+    :param int seed: random seed for the requests
+    :returns: elapsed seconds keyed by mode
+    :rtype: dict
+    """
+    timings = {}
+    with synthetic_event("Benchmark load", players) as event:
+        tournament_id, player_ids = event
+        workload = load_workload(
+            clients, requests, tournament_id, player_ids, seed)
+        timings['sync'] = time_sync_clients(workload)
+        # Imported here as only Python 3 can parse it
+        from benchmark_async import time_async_clients
+        timings['async'] = time_async_clients(workload)
+    return timings
+
+
+def play_round(pairings, rng, tie_rate):
+    """Decide a paired round at random.
+    :param list pairings: (id1, name1, id2, name2) tuples
+    :param random.Random rng: source of the results
+    :param float tie_rate: chance of a match being a tie
+    :returns: (winner, loser, tie) tuples
+    :rtype: list
+    """
+    results = []
+    for id1, _, id2, _ in pairings:
+        if rng.random() < 0.5:
+            id1, id2 = id2, id1
+        results.append((id1, id2, rng.random() < tie_rate))
+    return results
+
+
+def bench_lifecycle(players=(8, 64, 512, 10000), rounds=None, seed=0,
+                    engine='matching', tie_rate=0.05):
+    """Time every stage of seeded synthetic events, round by round.
+    Each event registers its players in bulk, then for every round looks
+    the standings up, ranks them by opponent match wins, pairs the round
+    and reports seeded random results for it.
+    :param iterable players: count of entrants of each event
+    :param int rounds: count of rounds per event; None plays the Swiss
+        count of ceil(log2(players))
+    :param int seed: random seed for the results of every event
+    :param str engine: pairing engine passed to swiss_pairings
+    :param float tie_rate: chance of a match being a tie
+    :returns: (players, stage, round, seconds) dicts; registration has
+        round 0
+    :rtype: list
+    """
+    results = []
+    for count in players:
+        rng = random.Random(seed)
+        event_rounds = rounds or max(1, int(math.ceil(math.log(count, 2))))
+        tournament_id = tournament.register_tournament(
+            "Benchmark lifecycle", count)
+        player_ids = []
+
+        def timed(stage, number, function, *args):
+            start = time.time()
+            value = function(*args)
+            results.append({
+                'players': count, 'stage': stage, 'round': number,
+                'seconds': time.time() - start})
+            return value
+
+        def register():
+            ids = tournament.register_players(
+                "Player %d of %d" % (number, tournament_id)
+                for number in range(count))
+            tournament.enroll_players(tournament_id, ids)
+            return ids
+
+        try:
+            player_ids = timed('registration', 0, register)
+            for number in range(1, event_rounds + 1):
+                standings = timed(
+                    'standings', number,
+                    tournament.player_standings_by_tournament, tournament_id)
+                timed('ranking', number,
+                      tournament.rank_by_opponent_match_wins,
+                      standings, tournament_id)
+                pairings = timed(
+                    'pairing', number,
+                    tournament.swiss_pairings, tournament_id, engine)
+                timed('reporting', number, tournament.report_matches,
+                      tournament_id, play_round(pairings, rng, tie_rate))
+        finally:
+            delete_event(tournament_id, player_ids)
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.25, min_seconds=0.005):
+    """Find the stages that got slower than in a baseline run.
+    :param list results: results of bench_lifecycle
+    :param list baseline: results of an earlier run
+    :param float tolerance: fraction a stage may slow down by
+    :param float min_seconds: slowdowns below this are treated as noise
+    :returns: (result, baseline seconds) tuples of the regressed stages
+    :rtype: list
+    """
+    def key(result):
+        return result['players'], result['stage'], result['round']
+
+    expected = dict((key(result), result['seconds']) for result in baseline)
+    regressions = []
+    for result in results:
+        seconds = expected.get(key(result))
+        if seconds is None:
+            continue
+        if (result['seconds'] > seconds * (1 + tolerance) and
+                result['seconds'] - seconds > min_seconds):
+            regressions.append((result, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    pool_parser = subparsers.add_parser(
+        'pool', help="report_match pooled vs. connect per query")
+    pool_parser.add_argument('--matches', type=int, default=10000)
+    pool_parser.add_argument('--players', type=int, default=64)
+    pool_parser.add_argument('--seed', type=int, default=0)
+
+    round_parser = subparsers.add_parser(
+        'round', help="report_match loop vs. report_matches per round")
+    round_parser.add_argument('--tables', type=int, default=512)
+    round_parser.add_argument('--rounds', type=int, default=3)
+    round_parser.add_argument('--seed', type=int, default=0)
+
+    pairing_parser = subparsers.add_parser(
+        'pairing', help="in-memory ranking and pairing of one round")
+    pairing_parser.add_argument('--players', type=int, default=2000)
+    pairing_parser.add_argument('--rounds', type=int, default=8)
+    pairing_parser.add_argument('--repeat', type=int, default=5)
+    pairing_parser.add_argument('--seed', type=int, default=0)
+    pairing_parser.add_argument(
+        '--engine', choices=sorted(ENGINES), default='greedy')
+
+    register_parser = subparsers.add_parser(
+        'register', help="per-player vs. bulk check-in")
+    register_parser.add_argument('--players', type=int, default=1500)
+
+    load_parser = subparsers.add_parser(
+        'load', help="sync vs. async API under concurrent clients")
+    load_parser.add_argument('--clients', type=int, default=500)
+    load_parser.add_argument('--requests', type=int, default=20)
+    load_parser.add_argument('--players', type=int, default=64)
+    load_parser.add_argument('--seed', type=int, default=0)
+
+    lifecycle_parser = subparsers.add_parser(
+        'lifecycle', help="every stage of seeded events, round by round")
+    lifecycle_parser.add_argument(
+        '--players', type=int, nargs='+', default=[8, 64, 512, 10000])
+    lifecycle_parser.add_argument('--rounds', type=int, default=None)
+    lifecycle_parser.add_argument('--seed', type=int, default=0)
+    lifecycle_parser.add_argument('--tie-rate', type=float, default=0.05)
+    lifecycle_parser.add_argument(
+        '--engine', choices=sorted(ENGINES) + ['database'],
+        default='matching')
+    lifecycle_parser.add_argument(
+        '--backend', choices=['postgresql', 'sqlite', 'memory'],
+        help="store to run against; sqlite is in memory")
+    lifecycle_parser.add_argument(
+        '--output', help="write the results as JSON to this file")
+    lifecycle_parser.add_argument(
+        '--baseline', help="JSON results of an earlier run to compare with")
+    lifecycle_parser.add_argument('--tolerance', type=float, default=0.25)
+
+    args = parser.parse_args()
+    if args.benchmark == 'pool':
+        timings = bench_pool(args.matches, args.players, args.seed)
+        for mode in ('connect_per_query', 'pooled'):
+            print("%-18s %6d matches in %8.3fs (%8.1f matches/s)" % (
+                mode, args.matches, timings[mode],
+                args.matches / timings[mode]))
+        print("speedup: %.1fx" % (
+            timings['connect_per_query'] / timings['pooled']))
+    elif args.benchmark == 'round':
+        timings = bench_round(args.tables, args.rounds, args.seed)
+        for mode in ('report_match', 'report_matches'):
+            print("%-18s %6d tables in %8.3fs per round" % (
+                mode, args.tables, timings[mode]))
+        print("speedup: %.1fx" % (
+            timings['report_match'] / timings['report_matches']))
+    elif args.benchmark == 'pairing':
+        elapsed = bench_pairing(
+            args.players, args.rounds, args.repeat, args.seed, args.engine)
+        print("%d players after %d rounds paired by %s in %.1fms" % (
+            args.players, args.rounds, args.engine, elapsed * 1000))
+    elif args.benchmark == 'register':
+        timings = bench_register(args.players)
+        for mode in ('register_player', 'register_players'):
+            print("%-18s %6d players in %8.3fs" % (
+                mode, args.players, timings[mode]))
+        print("speedup: %.1fx" % (
+            timings['register_player'] / timings['register_players']))
+    elif args.benchmark == 'load':
+        timings = bench_load(
+            args.clients, args.requests, args.players, args.seed)
+        total = args.clients * args.requests
+        for mode in ('sync', 'async'):
+            print("%-18s %6d clients in %8.3fs (%8.1f requests/s)" % (
+                mode, args.clients, timings[mode], total / timings[mode]))
+        print("speedup: %.1fx" % (timings['sync'] / timings['async']))
+    elif args.benchmark == 'lifecycle':
+        if args.backend is not None:
+            tournament.configure(backend=args.backend)
+        results = bench_lifecycle(
+            args.players, args.rounds, args.seed, args.engine, args.tie_rate)
+        for result in results:
+            print("%6d players round %2d %-13s %9.1fms" % (
+                result['players'], result['round'], result['stage'],
+                result['seconds'] * 1000))
+
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump({
+                    'seed': args.seed, 'engine': args.engine,
+                    'tie_rate': args.tie_rate,
+                    'backend': tournament.get_backend().name,
+                    'python': platform.python_version(),
+                    'results': results,
+                }, output, indent=1, sort_keys=True)
+
+        if args.baseline:
+            with open(args.baseline) as baseline:
+                baseline = json.load(baseline)
+            regressions = compare_results(
+                results, baseline['results'], args.tolerance)
+            for result, seconds in regressions:
+                print("regression: %d players round %d %s %.1fms "
+                      "(baseline %.1fms)" % (
+                          result['players'], result['round'],
+                          result['stage'], result['seconds'] * 1000,
+                          seconds * 1000))
+            if regressions:
+                sys.exit(1)
+            print("no regressions against %s" % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Asyncio half of benchmark.py, kept apart as Python 2 cannot parse it.
+Requires Python 3.7+ and aiopg.
+"""
+
+import asyncio
+import time
+
+import tournament_async
+
+
+def time_async_clients(workload):
+    """Time every client as a task on one event loop calling
+    tournament_async.py.
+    :param list workload: (function name, args) lists, one per client
+    :returns: elapsed seconds
+    :rtype: float
+    """
+    async def client(calls):
+        for name, args in calls:
+            await getattr(tournament_async, name)(*args)
+
+    async def run():
+        try:
+            start = time.time()
+            await asyncio.gather(*[client(calls) for calls in workload])
+            return time.time() - start
+        finally:
+            await tournament_async.close()
+
+    return asyncio.run(run())
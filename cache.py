@@ -0,0 +1,242 @@
+"""Per-tournament read-through cache for standings and pairing data."""
+
+import collections
+import sys
+import threading
+from array import array
+
+
+def sizeof(value):
+    """Estimate the memory held by a cached value, in bytes.
+    Containers and plain objects are measured with their contents; shared
+    objects are only counted once.
+    :param value: value to measure
+    :returns: estimated size in bytes
+    :rtype: int
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif isinstance(item, array):
+            continue
+        elif hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+    return size
+
+
+class StandingsCache(object):
+
+    """LRU cache of values derived from a tournament's results.
+    Values are cached per tournament under a key and stay valid until the
+    tournament is invalidated, which bumps its version. Tournaments are
+    evicted least recently used first once the cache holds more than
+    max_tournaments or its estimated size exceeds max_bytes.
+    Invalidation only sees writes made through this process. Callers that
+    pass the tournament's database version to get and lookup also see the
+    writes of other processes: values cached under another database version
+    are dropped.
+    """
+
+    def __init__(self, max_tournaments=256, max_bytes=64 * 1024 * 1024):
+        """Create an empty cache.
+        :param int max_tournaments: count of tournaments to keep cached
+        :param int max_bytes: estimated memory cap; 0 disables caching
+        """
+        self.max_tournaments = max_tournaments
+        self.max_bytes = max_bytes
+
+        # tournament -> (database version, {key: (value, size)}), least
+        # recently used first
+        self._entries = collections.OrderedDict()
+        # Every invalidation takes the next tick of the clock. Only
+        # tournaments cached or being loaded keep a version of their own;
+        # the others share the floor, so memory is bounded by the cache
+        self._versions = {}
+        self._loading = {}
+        self._clock = 0
+        self._floor = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _version(self, tournament):
+        return self._versions.get(tournament, self._floor)
+
+    def get(self, tournament, key, load, database_version=None):
+        """Get a cached value, loading and caching it on a miss.
+        :param int tournament: id of the tournament the value belongs to
+        :param key: key of the value within the tournament
+        :param callable load: function loading the value on a miss
+        :param int database_version: version of the tournament in the
+            database, read before load runs
+        :returns: cached or freshly loaded value
+        """
+        found, value, version = self.lookup(tournament, key, database_version)
+        if found:
+            return value
+        try:
+            value = load()
+        except BaseException:
+            self.discard(tournament)
+            raise
+        self.store(tournament, key, value, version)
+        return value
+
+    def lookup(self, tournament, key, database_version=None):
+        """Look a value up without loading it on a miss.
+        Callers that load values themselves, such as coroutines, pass the
+        returned version on to store, or call discard if they do not load.
+        :param int tournament: id of the tournament the value belongs to
+        :param key: key of the value within the tournament
+        :param int database_version: version of the tournament in the
+            database, read before a value missed is loaded
+        :returns: whether the value was found, the value, and the version
+            a freshly loaded value must be stored under
+        :rtype: tuple
+        """
+        with self._lock:
+            entry = self._entries.get(tournament)
+            if entry is not None and entry[0] != database_version:
+                # Another process has written to the tournament since
+                self._drop(tournament)
+                entry = None
+            if entry is not None and key in entry[1]:
+                self.hits += 1
+                # Mark the tournament most recently used
+                self._entries[tournament] = self._entries.pop(tournament)
+                return True, entry[1][key][0], None
+            self.misses += 1
+            # Keep the version until the load is stored or discarded
+            self._loading[tournament] = self._loading.get(tournament, 0) + 1
+            version = self._versions.setdefault(tournament, self._floor)
+            return False, None, (version, database_version)
+
+    def store(self, tournament, key, value, version):
+        """Cache a value loaded after a missed lookup.
+        The value is dropped if the tournament was invalidated since.
+        :param int tournament: id of the tournament the value belongs to
+        :param key: key of the value within the tournament
+        :param value: freshly loaded value
+        :param tuple version: version returned by lookup
+        """
+        size = sizeof(value)
+        version, database_version = version
+
+        with self._lock:
+            self._loaded(tournament)
+            # Skip values that were invalidated while they were loading
+            if (size > self.max_bytes or
+                    self._version(tournament) != version):
+                self._forget(tournament)
+                return
+
+            # Values of another database version are not kept alongside
+            entry = self._entries.get(tournament)
+            if entry is not None and entry[0] != database_version:
+                self._drop(tournament)
+                entry = None
+            if entry is None:
+                entry = (database_version, {})
+            else:
+                del self._entries[tournament]
+            values = entry[1]
+            if key in values:
+                self._bytes -= values[key][1]
+            values[key] = (value, size)
+            self._entries[tournament] = entry
+            self._bytes += size
+
+            while self._entries and (
+                    self._bytes > self.max_bytes or
+                    len(self._entries) > self.max_tournaments):
+                evicted, (_, values) = self._entries.popitem(last=False)
+                self._bytes -= sum(size for _, size in values.values())
+                self.evictions += 1
+                self._forget(evicted)
+
+    def discard(self, tournament):
+        """Give up on loading a value after a missed lookup.
+        :param int tournament: id of the tournament the value belongs to
+        """
+        with self._lock:
+            self._loaded(tournament)
+            self._forget(tournament)
+
+    def _loaded(self, tournament):
+        """Count a load as finished; the lock must be held."""
+        loading = self._loading.pop(tournament, 1) - 1
+        if loading:
+            self._loading[tournament] = loading
+
+    def _forget(self, tournament):
+        """Drop the version of a tournament neither cached nor loading.
+        Raising the floor to it keeps every version increasing.
+        The lock must be held.
+        """
+        if tournament in self._entries or tournament in self._loading:
+            return
+        version = self._versions.pop(tournament, None)
+        if version is not None:
+            self._floor = max(self._floor, version)
+
+    def _drop(self, tournament):
+        """Drop a tournament's cached values; the lock must be held."""
+        entry = self._entries.pop(tournament, None)
+        if entry is not None:
+            self._bytes -= sum(size for _, size in entry[1].values())
+
+    def invalidate(self, tournament=None):
+        """Drop a tournament's cached values and bump its version.
+        :param int tournament: id of the tournament; None invalidates all
+        """
+        with self._lock:
+            self._clock += 1
+            if tournament is None:
+                self._floor = self._clock
+                self._versions.clear()
+                self._entries.clear()
+                self._bytes = 0
+                return
+
+            self._versions[tournament] = self._clock
+            self._drop(tournament)
+            self._forget(tournament)
+
+    def version(self, tournament):
+        """Get the version of a tournament's results.
+        :param int tournament: id of the tournament
+        :returns: version, bumped on every invalidation
+        :rtype: int
+        """
+        with self._lock:
+            return self._version(tournament)
+
+    def stats(self):
+        """Get cache counters.
+        :returns: hits, misses, evictions, tournaments and bytes cached, and
+            count of tournament versions kept
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'tournaments': len(self._entries),
+                'bytes': self._bytes,
+                'versions': len(self._versions),
+            }
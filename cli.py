@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""Command line for running rounds of a tournament.
+Commands print tab-separated rows. tournament.py, and with it the database
+driver, is only imported to run a command in this process: with a daemon
+serving on the socket, the command is sent to it instead, and the daemon
+answers from its pooled connections and cached tournament state.
+
+Usage:
+    python cli.py pair TOURNAMENT_ID [--engine matching]
+    python cli.py report TOURNAMENT_ID WINNER_ID LOSER_ID [--tie] [--key K]
+    python cli.py report TOURNAMENT_ID PLAYER_ID --bye
+    python cli.py standings TOURNAMENT_ID
+    python cli.py register-bulk TOURNAMENT_ID [NAMES_FILE] [--by-name]
+    python cli.py serve
+
+The socket is --socket, or TOURNAMENT_SOCKET in the environment.
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import os
+import socket
+import sys
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# Engines of tournament.swiss_pairings, listed here so parsing the command
+# line does not import pairing.py
+ENGINES = ('brackets', 'database', 'greedy', 'matching')
+
+
+def _rows(rows):
+    return ''.join(
+        '\t'.join(str(value) for value in row) + '\n' for row in rows)
+
+
+def execute(command):
+    """Run a parsed command in this process.
+    :param dict command: command and its arguments, as parsed by
+        parse_args
+    :returns: exit status, output and error message
+    :rtype: tuple
+    """
+    import tournament
+
+    name = command['command']
+    tournament_id = command['tournament']
+    try:
+        if name == 'pair':
+            output = _rows(tournament.swiss_pairings(
+                tournament_id, command['engine']))
+        elif name == 'report' and command['bye']:
+            if command['loser'] is not None:
+                raise ValueError("A bye has no loser.")
+            if not tournament.report_match_bye(
+                    command['winner'], tournament_id):
+                raise ValueError("Player %s is not an entrant of "
+                                 "tournament %s." % (
+                                     command['winner'], tournament_id))
+            output = ''
+        elif name == 'report':
+            if command['loser'] is None:
+                raise ValueError("A result needs a loser, or --bye.")
+            output = '%d\n' % tournament.report_match(
+                command['winner'], command['loser'], tournament_id,
+                command['tie'], command['key'])
+        elif name == 'standings':
+            output = _rows(
+                (rank,) + tuple(standing) for rank, standing in enumerate(
+                    tournament.ranked_standings(tournament_id), 1))
+        elif name == 'register-bulk':
+            names = command['names']
+            with tournament.session():
+                player_ids = tournament.register_players(
+                    names, command['by_name'])
+                tournament.enroll_players(tournament_id, player_ids)
+            output = _rows(zip(player_ids, names))
+        else:
+            raise ValueError("Command %s is not supported." % name)
+    except Exception as error:
+        return 1, '', str(error)
+    return 0, output, ''
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = self.rfile.readline()
+        try:
+            command = json.loads(request.decode())
+            if command is None:
+                # A check that the daemon answers
+                status, output, error = 0, '', ''
+            else:
+                status, output, error = execute(command)
+        except (KeyError, TypeError, ValueError) as failure:
+            status, output, error = 2, '', "Bad request: %s" % failure
+        response = {'status': status, 'output': output, 'error': error}
+        self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """Daemon running commands sent over a Unix socket, a thread each."""
+
+    daemon_threads = True
+
+
+def make_server(path):
+    """Bind a daemon to a Unix socket, warming up the connection pool.
+    A socket file left behind by a daemon that is gone is replaced. Cached
+    results are checked against the database unless
+    TOURNAMENT_CACHE_VALIDATE is 0.
+    :param str path: path of the socket
+    :rtype: Server
+    :raises RuntimeError: if a daemon is already serving on path
+    """
+    import tournament
+
+    if os.path.exists(path):
+        try:
+            send(path, None)
+        except socket.error:
+            os.remove(path)
+        except RuntimeError:
+            # Something accepted the connection without answering
+            pass
+        if os.path.exists(path):
+            raise RuntimeError("A daemon is already serving on %s." % path)
+    # Commands run without the daemon write to the tournaments it caches
+    if os.environ.get('TOURNAMENT_CACHE_VALIDATE') != '0':
+        tournament.configure(validate_cache=True)
+    tournament.warm_up()
+    return Server(path, _Handler)
+
+
+def send(path, command):
+    """Run a command on the daemon serving on a socket.
+    :param str path: path of the socket
+    :param dict command: command as parsed by parse_args; None only
+        checks that the daemon answers
+    :returns: exit status, output and error message
+    :rtype: tuple
+    :raises socket.error: if the daemon cannot be connected to, so the
+        command has not run
+    :raises RuntimeError: if the connection is lost once the command was
+        sent, so it may have run
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        try:
+            stream = client.makefile('rwb')
+            stream.write((json.dumps(command) + '\n').encode())
+            stream.flush()
+            reply = stream.readline()
+            stream.close()
+        except socket.error as error:
+            reply, lost = b'', error
+        else:
+            lost = "no reply"
+    finally:
+        client.close()
+    if not reply:
+        raise RuntimeError(
+            "Lost the daemon on %s (%s); the command may have run." % (
+                path, lost))
+    response = json.loads(reply.decode())
+    return response['status'], response['output'], response['error']
+
+
+def parse_args(argv=None):
+    """Parse a command line.
+    :param list argv: arguments, without the program name; None parses
+        sys.argv
+    :returns: command and its arguments, with the names to register read
+        from their file or standard input
+    :rtype: dict
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--socket', default=os.environ.get('TOURNAMENT_SOCKET'),
+        help="Unix socket of the daemon")
+    subparsers = parser.add_subparsers(dest='command')
+
+    pair_parser = subparsers.add_parser(
+        'pair', help="pair the next round")
+    pair_parser.add_argument('tournament', type=int)
+    pair_parser.add_argument('--engine', choices=ENGINES, default='matching')
+
+    report_parser = subparsers.add_parser(
+        'report', help="report a result or a bye")
+    report_parser.add_argument('tournament', type=int)
+    report_parser.add_argument('winner', type=int)
+    report_parser.add_argument('loser', type=int, nargs='?')
+    report_parser.add_argument('--tie', action='store_true')
+    report_parser.add_argument('--bye', action='store_true')
+    report_parser.add_argument(
+        '--key', default=None, help="idempotency key, e.g. round-table")
+
+    standings_parser = subparsers.add_parser(
+        'standings', help="print the ranked standings")
+    standings_parser.add_argument('tournament', type=int)
+
+    register_parser = subparsers.add_parser(
+        'register-bulk',
+        help="register and enter players, one name per line")
+    register_parser.add_argument('tournament', type=int)
+    register_parser.add_argument(
+        'names', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+    register_parser.add_argument(
+        '--by-name', action='store_true',
+        help="reuse players already registered under a name")
+
+    serve_parser = subparsers.add_parser(
+        'serve', help="run a daemon on the socket")
+    serve_parser.set_defaults(tournament=None)
+
+    command = vars(parser.parse_args(argv))
+    if command['command'] is None:
+        parser.error("a command is required")
+    if command['command'] == 'serve' and not command['socket']:
+        parser.error("serve needs --socket or TOURNAMENT_SOCKET")
+    if command['command'] == 'register-bulk':
+        command['names'] = [
+            line.strip() for line in command['names'] if line.strip()]
+    return command
+
+
+def main(argv=None):
+    command = parse_args(argv)
+    path = command.pop('socket')
+
+    if command['command'] == 'serve':
+        server = make_server(path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(path)
+        return 0
+
+    status = None
+    if path:
+        try:
+            status, output, error = send(path, command)
+        except socket.error as failure:
+            # Run the command here only if no daemon is listening; it may
+            # be running on one that cannot be reached
+            if failure.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                status, output, error = 1, '', "Daemon on %s: %s" % (
+                    path, failure)
+        except RuntimeError as failure:
+            # Running it again here could report a result twice
+            status, output, error = 1, '', str(failure)
+    if status is None:
+        status, output, error = execute(command)
+
+    sys.stdout.write(output)
+    if error:
+        sys.stderr.write(error + '\n')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
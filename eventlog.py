@@ -0,0 +1,436 @@
+"""Append-only log of tournament events, and snapshots of tournament state.
+tournament.py appends an event for every entrant registered and every
+result and bye reported, once its transaction has committed, while the log
+is open (see tournament.configure). A pairing service can then rebuild a
+tournament's TournamentState from the latest snapshot and the events
+logged after it, without a query.
+
+The log can trail the database. Events are appended once their
+transaction has committed, so a crash in between loses them, and
+transactions committing at once on several threads may be logged out of
+order; recover holds a result back until its players have entered. Check a
+recovered state against the database with compare_states before trusting
+it, as python eventlog.py recover does.
+
+Events are fixed-size binary records, little-endian, each followed by the
+player's name for entrants. A record cut short by a crash is dropped when
+the log is next opened. Snapshots hold one tournament's state as packed
+arrays, in the byte order of the machine that wrote them, and are replaced
+atomically.
+
+Usage:
+    python eventlog.py recover TOURNAMENT_ID --log events.log
+        [--snapshot 1.snapshot]
+    python eventlog.py reconcile [--repair]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import io
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from pairing import TournamentState
+
+# Kinds of events
+ENTER = 1
+RESULT = 2
+BYE = 3
+
+Event = collections.namedtuple(
+    'Event', 'kind tournament match player opponent tie name')
+
+# kind, tournament, match id, player, opponent, tie, length of the name
+_RECORD = struct.Struct('<BIqiiBH')
+
+_SNAPSHOT_MAGIC = b'TSNAP001'
+# magic, tournament, log offset, count of entrants, count of opponent pairs
+_SNAPSHOT_HEADER = struct.Struct('=8sIqII')
+
+
+def _encode(name):
+    if isinstance(name, bytes):
+        return name
+    return name.encode('utf-8')
+
+
+def _decode(data):
+    # Names come back as they are read from the database: str on both
+    if sys.version_info[0] < 3:
+        return data
+    return data.decode('utf-8')
+
+
+def _array(typecode, data):
+    values = array(typecode)
+    if sys.version_info[0] < 3:
+        values.fromstring(data)
+    else:
+        values.frombytes(data)
+    return values
+
+
+def _to_bytes(values):
+    if sys.version_info[0] < 3:
+        return values.tostring()
+    return values.tobytes()
+
+
+def _complete_length(data):
+    """Get the length of the complete records at the start of data."""
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        length = _RECORD.unpack_from(data, offset)[-1]
+        if offset + _RECORD.size + length > len(data):
+            break
+        offset += _RECORD.size + length
+    return offset
+
+
+class EventLog(object):
+
+    """Appends events to a log file.
+    Closed, append does nothing, so tournament.py only checks enabled.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.sync = False
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, path, sync=False):
+        """Open a log for appending, creating it if needed.
+        A record left incomplete by a crash is cut off first.
+        :param str path: path of the log file
+        :param bool sync: whether to fsync after every append
+        """
+        with self._lock:
+            self._close()
+            with io.open(path, 'ab+') as log:
+                log.seek(0)
+                complete = _complete_length(log.read())
+                log.truncate(complete)
+            self._file = io.open(path, 'ab')
+            self.path = path
+            self.sync = sync
+
+    def close(self):
+        """Close the log; later events are not recorded."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self.path = None
+
+    @property
+    def offset(self):
+        """Byte offset of the end of the log, for write_snapshot.
+        :rtype: int
+        """
+        with self._lock:
+            return self._file.tell() if self._file is not None else 0
+
+    def append(self, events):
+        """Append events in one write.
+        :param iterable events: Event tuples
+        :returns: offset of the end of the log
+        :rtype: int
+        """
+        records = []
+        for event in events:
+            name = _encode(event.name or '')
+            records.append(_RECORD.pack(
+                event.kind, event.tournament, event.match or 0,
+                event.player, event.opponent or 0, bool(event.tie),
+                len(name)))
+            records.append(name)
+
+        with self._lock:
+            if self._file is None:
+                return 0
+            self._file.write(b''.join(records))
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            return self._file.tell()
+
+
+def entered_event(tournament, player, name):
+    """Get the event of a player entering a tournament."""
+    return Event(ENTER, tournament, 0, player, 0, False, name)
+
+
+def result_event(tournament, match, winner, loser, tie=False):
+    """Get the event of a match result."""
+    return Event(RESULT, tournament, match, winner, loser, tie, None)
+
+
+def bye_event(tournament, player):
+    """Get the event of a player receiving a bye."""
+    return Event(BYE, tournament, 0, player, 0, False, None)
+
+
+def read_events(path, offset=0, tournament=None):
+    """Read the events of a log.
+    :param str path: path of the log file
+    :param int offset: byte offset to start at, e.g. a snapshot's
+    :param int tournament: id of the tournament to read events of; None
+        reads every event
+    :returns: generator of (offset after the event, Event) pairs; an
+        incomplete record at the end is not read
+    """
+    if not os.path.exists(path):
+        return
+    with io.open(path, 'rb') as log:
+        log.seek(offset)
+        data = log.read()
+
+    position, end = 0, _complete_length(data)
+    while position < end:
+        kind, event_tournament, match, player, opponent, tie, length = (
+            _RECORD.unpack_from(data, position))
+        position += _RECORD.size
+        name = None
+        if length:
+            name = _decode(data[position:position + length])
+            position += length
+        if tournament is None or event_tournament == tournament:
+            yield offset + position, Event(
+                kind, event_tournament, match, player, opponent, bool(tie),
+                name)
+
+
+def apply_event(state, event):
+    """Apply a logged event to a tournament snapshot.
+    :param TournamentState state: snapshot of the event's tournament
+    :param Event event: event to apply
+    """
+    if event.kind == ENTER:
+        state.add_entrant(event.player, event.name)
+    elif event.kind == RESULT:
+        state.record_result(event.player, event.opponent, event.tie)
+    elif event.kind == BYE:
+        state.record_result(event.player)
+    else:
+        raise ValueError("Event kind %s is not supported." % event.kind)
+
+
+def write_snapshot(path, state, offset):
+    """Write a tournament snapshot, replacing any earlier one atomically.
+    Events recover left unapplied are not carried over; write snapshots of
+    states that compare_states found to agree with the database.
+    :param str path: path of the snapshot file
+    :param TournamentState state: snapshot to write
+    :param int offset: offset of the log up to which state is current
+    """
+    pairs = array('i')
+    for i, played in enumerate(state.opponents):
+        for j in played:
+            if i < j:
+                pairs.extend((i, j))
+    names = [_encode(name) for name in state.names]
+
+    parts = [
+        _SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, state.tournament, offset, len(state),
+            len(pairs) // 2),
+        _to_bytes(array('i', state.ids)),
+        _to_bytes(array('i', state.wins)),
+        _to_bytes(array('i', state.matches)),
+        _to_bytes(array('B', [bool(received) for received in state.byes])),
+        _to_bytes(pairs),
+        _to_bytes(array('i', [len(name) for name in names])),
+        b''.join(names),
+    ]
+
+    temporary = path + '.tmp'
+    with io.open(temporary, 'wb') as snapshot:
+        snapshot.write(b''.join(parts))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.rename(temporary, path)
+
+
+def read_snapshot(path):
+    """Read a tournament snapshot.
+    :param str path: path of the snapshot file
+    :returns: snapshot, and offset of the log it is current up to
+    :rtype: tuple
+    :raises ValueError: if the file is not a snapshot
+    """
+    with io.open(path, 'rb') as snapshot:
+        data = snapshot.read()
+    if data[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+        raise ValueError("%s is not a tournament snapshot." % path)
+
+    _, tournament, offset, count, pair_count = (
+        _SNAPSHOT_HEADER.unpack_from(data))
+    position = _SNAPSHOT_HEADER.size
+    columns = []
+    for typecode, length in (
+            ('i', count), ('i', count), ('i', count), ('B', count),
+            ('i', 2 * pair_count), ('i', count)):
+        size = array(typecode).itemsize * length
+        columns.append(_array(typecode, data[position:position + size]))
+        position += size
+    ids, wins, matches, byes, pairs, lengths = columns
+
+    names = []
+    for length in lengths:
+        names.append(_decode(data[position:position + length]))
+        position += length
+
+    state = TournamentState(
+        tournament, zip(ids, names, wins, matches, byes),
+        ((ids[pairs[k]], ids[pairs[k + 1]])
+         for k in range(0, len(pairs), 2)))
+    return state, offset
+
+
+def _entered(state, event):
+    """Check whether the players of a result or bye are in a snapshot."""
+    return event.player in state.index and (
+        event.kind != RESULT or event.opponent in state.index)
+
+
+def recover(tournament, log_path, snapshot_path=None, unapplied=None):
+    """Rebuild a tournament's state from its snapshot and the log.
+    Results logged ahead of their players' entrant events are applied once
+    those are read. The state is only as complete as the log; see
+    compare_states.
+    :param int tournament: id of the tournament
+    :param str log_path: path of the event log
+    :param str snapshot_path: path of the tournament's snapshot; None, or a
+        missing file, replays the whole log
+    :param list unapplied: list to append the events of players that never
+        entered to; they are left out of the state
+    :returns: snapshot of the tournament, and offset of the log it is
+        current up to, for write_snapshot
+    :rtype: tuple
+    :raises ValueError: if the snapshot is of another tournament
+    """
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        state, offset = read_snapshot(snapshot_path)
+        if state.tournament != tournament:
+            raise ValueError(
+                "%s is a snapshot of tournament %s." % (
+                    snapshot_path, state.tournament))
+    else:
+        state, offset = TournamentState(tournament, (), ()), 0
+
+    # Other tournaments' events are read too, so offset ends up at the end
+    waiting = []
+    for offset, event in read_events(log_path, offset):
+        if event.tournament != tournament:
+            continue
+        if event.kind != ENTER and not _entered(state, event):
+            waiting.append(event)
+            continue
+        apply_event(state, event)
+        if event.kind == ENTER and waiting:
+            ready = [held for held in waiting if _entered(state, held)]
+            waiting = [held for held in waiting if not _entered(state, held)]
+            for held in ready:
+                apply_event(state, held)
+
+    if unapplied is not None:
+        unapplied.extend(waiting)
+    return state, offset
+
+
+def compare_states(state, expected):
+    """Get the differences between a recovered and a loaded snapshot.
+    :param TournamentState state: snapshot rebuilt from the log
+    :param TournamentState expected: snapshot loaded from the database,
+        e.g. by tournament.load_tournament_state
+    :returns: descriptions of the differences; empty if they agree
+    :rtype: list
+    """
+    differences = []
+    for player in sorted(set(state.ids) | set(expected.ids)):
+        if player not in state.index or player not in expected.index:
+            differences.append("player %s is %s the log" % (
+                player, 'missing from' if player not in state.index
+                else 'only in'))
+            continue
+        i, j = state.index[player], expected.index[player]
+        record = (state.wins[i], state.matches[i], state.byes[i],
+                  sorted(state.ids[k] for k in state.opponents[i]))
+        expected_record = (
+            expected.wins[j], expected.matches[j], expected.byes[j],
+            sorted(expected.ids[k] for k in expected.opponents[j]))
+        if record != expected_record:
+            differences.append(
+                "player %s has (wins, matches, bye, opponents) %r in the "
+                "log but %r in the database" % (
+                    player, record, expected_record))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    recover_parser = subparsers.add_parser(
+        'recover', help="rebuild a tournament from its snapshot and the "
+                        "log, check it against the database and write a "
+                        "new snapshot")
+    recover_parser.add_argument('tournament', type=int)
+    recover_parser.add_argument('--log', required=True)
+    recover_parser.add_argument('--snapshot', default=None)
+
+    reconcile_parser = subparsers.add_parser(
+        'reconcile', help="check players' lifetime records against their "
+                          "match rows")
+    reconcile_parser.add_argument(
+        '--repair', action='store_true',
+        help="correct the records that disagree")
+    args = parser.parse_args()
+
+    import tournament
+
+    if args.command == 'recover':
+        unapplied = []
+        state, offset = recover(
+            args.tournament, args.log, args.snapshot, unapplied)
+        differences = compare_states(
+            state, tournament.load_tournament_state(args.tournament))
+        differences.extend(
+            "player %s has a result in the log but never entered" % (
+                event.player if event.player not in state.index
+                else event.opponent)
+            for event in unapplied)
+        for difference in differences:
+            print(difference)
+        if args.snapshot is not None and not differences:
+            write_snapshot(args.snapshot, state, offset)
+        print("%d entrants, log offset %d, %d differences" % (
+            len(state), offset, len(differences)))
+        if differences:
+            raise SystemExit(1)
+    else:
+        drift = tournament.reconcile_player_records(repair=args.repair)
+        for player, wins, matches, match_wins, match_matches in drift:
+            print("player %d: wins %d, matches %d; match rows say %d, %d" % (
+                player, wins, matches, match_wins, match_matches))
+        print("%d players %s" % (
+            len(drift), 'repaired' if args.repair else 'disagree'))
+        if drift and not args.repair:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
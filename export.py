@@ -0,0 +1,107 @@
+"""Write standings, pairings and match history as CSV or JSON lines.
+Rows are streamed from the database (see tournament.stream_query) and
+written one at a time, so exports of any size run in flat memory. Output
+is a path or any object with a write method, such as an open file or
+socket.makefile('w').
+"""
+
+import csv
+import json
+import sys
+
+import tournament
+
+FORMATS = ('csv', 'jsonl')
+
+STANDINGS_FIELDS = ('id', 'name', 'wins', 'matches')
+PAIRINGS_FIELDS = ('id1', 'name1', 'id2', 'name2')
+HISTORY_FIELDS = ('match_id', 'tournament_id', 'player_id', 'name', 'result')
+
+
+def _open(path):
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def write_rows(rows, fields, output, format='csv'):
+    """Write rows as they are read.
+    CSV gets a header row of fields; JSON lines get one object per row,
+    keyed by fields.
+    :param iterable rows: tuples in the order of fields
+    :param tuple fields: names of the columns
+    :param output: path or writable file-like object
+    :param str format: csv | jsonl
+    :returns: count of rows written
+    :rtype: int
+    :raises ValueError: if the format is not supported
+    """
+    if format not in FORMATS:
+        raise ValueError("Export format %s is not supported." % format)
+
+    opened = not hasattr(output, 'write')
+    if opened:
+        output = _open(output)
+
+    written = 0
+    try:
+        if format == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+        else:
+            for row in rows:
+                output.write(json.dumps(dict(zip(fields, row))) + '\n')
+                written += 1
+        output.flush()
+        return written
+    finally:
+        if opened:
+            output.close()
+
+
+def export_standings(output, tournament_id=None, format='csv',
+                     fetch_size=None):
+    """Export win records, of every player or of a tournament's entrants.
+    :param output: path or writable file-like object
+    :param int tournament_id: id of the tournament; None exports every
+        player's lifetime record
+    :param str format: csv | jsonl
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: count of rows written
+    :rtype: int
+    """
+    if tournament_id is None:
+        rows = tournament.iter_player_standings(fetch_size)
+    else:
+        rows = tournament.iter_standings_by_tournament(
+            tournament_id, fetch_size)
+    return write_rows(rows, STANDINGS_FIELDS, output, format)
+
+
+def export_pairings(output, pairings, format='csv'):
+    """Export a round's pairings.
+    :param output: path or writable file-like object
+    :param list pairings: (id1, name1, id2, name2) tuples, as returned by
+        tournament.swiss_pairings
+    :param str format: csv | jsonl
+    :returns: count of rows written
+    :rtype: int
+    """
+    return write_rows(pairings, PAIRINGS_FIELDS, output, format)
+
+
+def export_match_history(output, tournament_id=None, format='csv',
+                         fetch_size=None):
+    """Export every match played, one row per player, oldest first.
+    :param output: path or writable file-like object
+    :param int tournament_id: id of a tournament to limit the history to
+    :param str format: csv | jsonl
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: count of rows written
+    :rtype: int
+    """
+    rows = tournament.iter_match_history(tournament_id, fetch_size)
+    return write_rows(rows, HISTORY_FIELDS, output, format)
@@ -0,0 +1,350 @@
+"""Query counts, latencies and slow-query capture for tournament.py.
+Metrics are off until enabled; disabled, an instrumented function costs one
+attribute check and run_query records nothing. Enabled, every query is
+counted against each instrumented function on the calling thread's stack,
+so swiss_pairings is charged for the queries load_tournament_state runs on
+its behalf.
+"""
+
+import bisect
+import collections
+import cProfile
+import functools
+import json
+import pstats
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Histogram(object):
+
+    """Latency histogram over fixed buckets."""
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Record one latency.
+        :param float seconds: latency to record
+        """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        """Get the histogram with cumulative bucket counts.
+        Bounds are formatted as Prometheus "le" labels, e.g. '0.1', '+Inf'.
+        :returns: count, sum and (upper bound, cumulative count) buckets
+        :rtype: dict
+        """
+        buckets, total = [], 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            buckets.append((_format_bound(bound), total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class FunctionStats(object):
+
+    """Counters of one instrumented function, including what it calls."""
+
+    __slots__ = ('calls', 'errors', 'queries', 'rows', 'connections',
+                 'seconds', 'query_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.queries = 0
+        self.rows = 0
+        self.connections = 0
+        self.seconds = Histogram()
+        self.query_seconds = Histogram()
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'queries': self.queries,
+            'rows': self.rows,
+            'connections': self.connections,
+            'seconds': self.seconds.snapshot(),
+            'query_seconds': self.query_seconds.snapshot(),
+        }
+
+
+class Metrics(object):
+
+    """Per-function query counts and latency histograms.
+    Functions are instrumented with the instrument decorator; run_query
+    reports each query with record_query and each new connection with
+    record_connection. Queries slower than slow_query_seconds are kept,
+    with their plan when explain is set, in slow_queries.
+    """
+
+    def __init__(self, max_slow_queries=100):
+        """Create disabled metrics.
+        :param int max_slow_queries: count of slow queries to keep
+        """
+        self.enabled = False
+        self.slow_query_seconds = None
+        self.explain = False
+        self.on_slow_query = None
+        self.slow_queries = collections.deque(maxlen=max_slow_queries)
+
+        self._functions = collections.defaultdict(FunctionStats)
+        self._totals = FunctionStats()
+        self._profiled = frozenset()
+        self._profiles = {}
+        self._profile_locks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, slow_query_seconds=None, explain=False,
+               on_slow_query=None, profile=()):
+        """Start recording.
+        :param float slow_query_seconds: latency above which a query is
+            logged as slow; None logs nothing
+        :param bool explain: whether to capture the plan of slow queries
+        :param callable on_slow_query: called with each slow query record
+        :param iterable profile: names of instrumented functions to run
+            under cProfile; see profile_stats
+        """
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+        self.on_slow_query = on_slow_query
+        self._profiled = frozenset(profile)
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording, keeping what was recorded so far."""
+        self.enabled = False
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self._functions.clear()
+            self._totals = FunctionStats()
+            self._profiles.clear()
+            self.slow_queries.clear()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _charged(self):
+        """Get the stats of every function on this thread's stack."""
+        charged = [self._totals]
+        seen = set()
+        for name in self._stack():
+            if name not in seen:
+                seen.add(name)
+                charged.append(self._functions[name])
+        return charged
+
+    def instrument(self, function):
+        """Decorate a function so its calls and queries are recorded.
+        :param callable function: function to instrument
+        :returns: instrumented function
+        :rtype: callable
+        """
+        name = function.__name__
+
+        @functools.wraps(function)
+        def instrumented(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            return self._call(name, function, args, kwargs)
+
+        return instrumented
+
+    def _call(self, name, function, args, kwargs):
+        stack = self._stack()
+        stack.append(name)
+        profile = self._profiler(name)
+        error = False
+        start = time.time()
+        try:
+            if profile is None:
+                return function(*args, **kwargs)
+            return profile.runcall(function, *args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            seconds = time.time() - start
+            stack.pop()
+            if profile is not None:
+                self._local.profiling = False
+                self._profile_locks[name].release()
+            with self._lock:
+                stats = self._functions[name]
+                stats.calls += 1
+                stats.errors += error
+                stats.seconds.observe(seconds)
+
+    def _profiler(self, name):
+        """Get the profiler of a function, if it is to be profiled now.
+        A profiler runs one call at a time and a thread runs one profiler
+        at a time; calls made meanwhile are not profiled on their own.
+        """
+        if name not in self._profiled or getattr(
+                self._local, 'profiling', False):
+            return None
+        if not self._profile_locks[name].acquire(False):
+            return None
+        with self._lock:
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = cProfile.Profile()
+        self._local.profiling = True
+        return profile
+
+    def record_connection(self):
+        """Count a new database connection against the calling functions."""
+        with self._lock:
+            for stats in self._charged():
+                stats.connections += 1
+
+    def record_query(self, query, seconds, rows, explain=None):
+        """Count a query against the calling functions.
+        :param str query: query string that was run
+        :param float seconds: time the query took
+        :param int rows: count of rows returned or affected
+        :param callable explain: returns the query's plan; called for slow
+            queries when explain is enabled
+        """
+        with self._lock:
+            for stats in self._charged():
+                stats.queries += 1
+                stats.rows += rows
+                stats.query_seconds.observe(seconds)
+
+        if (self.slow_query_seconds is None or
+                seconds < self.slow_query_seconds):
+            return
+
+        stack = self._stack()
+        slow_query = {
+            'function': stack[-1] if stack else None,
+            'stack': list(stack),
+            'query': query,
+            'seconds': seconds,
+            'rows': rows,
+            'plan': explain() if self.explain and explain else None,
+            'time': time.time(),
+        }
+        self.slow_queries.append(slow_query)
+        if self.on_slow_query is not None:
+            self.on_slow_query(slow_query)
+
+    def profile_stats(self, name):
+        """Get the profile of a function enabled with profile=.
+        :param str name: name of the profiled function
+        :returns: profile statistics, or None if it has not been called
+        :rtype: pstats.Stats | None
+        """
+        with self._lock:
+            profile = self._profiles.get(name)
+        if profile is None:
+            return None
+        return pstats.Stats(profile)
+
+    def snapshot(self):
+        """Get everything recorded so far.
+        :returns: totals, stats keyed by function name and slow queries
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'totals': self._totals.snapshot(),
+                'functions': dict(
+                    (name, stats.snapshot())
+                    for name, stats in self._functions.items()),
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def export(self, exporter):
+        """Hand a snapshot to an exporter.
+        :param callable exporter: called with the snapshot, e.g.
+            JSONLinesExporter(stream) or a function of the caller's
+        :returns: whatever the exporter returns
+        """
+        return exporter(self.snapshot())
+
+
+def prometheus_text(snapshot, prefix='tournament'):
+    """Format a snapshot in the Prometheus text exposition format.
+    :param dict snapshot: snapshot from Metrics.snapshot
+    :param str prefix: prefix of every metric name
+    :returns: metrics text, one sample per line
+    :rtype: str
+    """
+    lines = []
+    counters = ('calls', 'errors', 'queries', 'rows', 'connections')
+    functions = sorted(snapshot['functions'].items())
+
+    for counter in counters:
+        name = '%s_%s_total' % (prefix, counter)
+        lines.append('# TYPE %s counter' % name)
+        for function, stats in functions:
+            lines.append('%s{function="%s"} %d' % (
+                name, function, stats[counter]))
+
+    for histogram in ('seconds', 'query_seconds'):
+        name = '%s_function_%s' % (prefix, histogram)
+        lines.append('# TYPE %s histogram' % name)
+        for function, stats in functions:
+            values = stats[histogram]
+            for bound, count in values['buckets']:
+                lines.append('%s_bucket{function="%s",le="%s"} %d' % (
+                    name, function, bound, count))
+            lines.append('%s_sum{function="%s"} %r' % (
+                name, function, values['sum']))
+            lines.append('%s_count{function="%s"} %d' % (
+                name, function, values['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+class JSONLinesExporter(object):
+
+    """Exporter writing a snapshot as JSON lines to a stream.
+    Each function, then each slow query, is written as one JSON object.
+    """
+
+    def __init__(self, stream):
+        """Create an exporter.
+        :param stream: file-like object opened for writing text
+        """
+        self.stream = stream
+
+    def __call__(self, snapshot):
+        exported = time.time()
+        records = [{
+            'type': 'totals', 'time': exported,
+            'stats': snapshot['totals']}]
+        for function, stats in sorted(snapshot['functions'].items()):
+            records.append({
+                'type': 'function', 'time': exported, 'function': function,
+                'stats': stats})
+        for slow_query in snapshot['slow_queries']:
+            records.append(dict(slow_query, type='slow_query'))
+
+        for record in records:
+            self.stream.write(json.dumps(record, default=str) + '\n')
+        self.stream.flush()
+        return len(records)
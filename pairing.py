@@ -0,0 +1,360 @@
+"""In-memory Swiss pairing over a snapshot of one tournament."""
+
+from array import array
+
+from matching import max_weight_matching
+
+
+class TournamentState(object):
+
+    """Snapshot of a tournament's entrants, records and match history.
+    Players are addressed by their position in the snapshot; ids maps a
+    position back to the player id and index maps a player id to its
+    position. Opponents are kept as sets of positions, so ranking and
+    pairing never go back to the database.
+    """
+
+    def __init__(self, tournament, entrants, opponents):
+        """Build a tournament snapshot.
+        :param int tournament: id of the tournament
+        :param iterable entrants: (id, name, wins, matches, bye) tuples
+        :param iterable opponents: (player id, opponent id) pairs; each
+            match only needs to be listed once
+        """
+        self.tournament = tournament
+        self.ids = []
+        self.names = []
+        self.wins = array('i')
+        self.matches = array('i')
+        self.byes = []
+
+        for player, name, wins, matches, bye in entrants:
+            self.ids.append(player)
+            self.names.append(name)
+            self.wins.append(wins)
+            self.matches.append(matches)
+            self.byes.append(bool(bye))
+
+        self.index = dict((player, i) for i, player in enumerate(self.ids))
+        self.opponents = [set() for _ in self.ids]
+        for player, opponent in opponents:
+            i, j = self.index[player], self.index[opponent]
+            self.opponents[i].add(j)
+            self.opponents[j].add(i)
+
+        self._omw = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_entrant(self, player, name, wins=0, matches=0, bye=False):
+        """Add a player to the snapshot, as a new entrant by default.
+        :param int player: id of the player
+        :param str name: name of the player
+        :returns: position of the player
+        :rtype: int
+        """
+        i = self.index.get(player)
+        if i is not None:
+            return i
+        i = self.index[player] = len(self.ids)
+        self.ids.append(player)
+        self.names.append(name)
+        self.wins.append(wins)
+        self.matches.append(matches)
+        self.byes.append(bool(bye))
+        self.opponents.append(set())
+        self._omw = None
+        return i
+
+    def record_result(self, winner, loser=None, tie=False):
+        """Apply a result to the snapshot, as report_match would.
+        :param int winner: id of the winner
+        :param int loser: id of the loser; None records a bye for winner
+        :param bool tie: whether the match was a tie
+        """
+        i = self.index[winner]
+        self.wins[i] += 1
+        self.matches[i] += 1
+        if loser is None:
+            self.byes[i] = True
+        else:
+            j = self.index[loser]
+            self.wins[j] += 1 if tie else 0
+            self.matches[j] += 1
+            self.opponents[i].add(j)
+            self.opponents[j].add(i)
+        self._omw = None
+
+    @property
+    def omw(self):
+        """Sum of played opponents match wins, by position.
+        :rtype: array
+        """
+        if self._omw is None:
+            wins = self.wins
+            self._omw = array('i', (
+                sum(wins[j] for j in played) for played in self.opponents))
+        return self._omw
+
+    def ranking(self):
+        """Get positions ranked by match wins, then opponent match wins.
+        Remaining ties are broken by player id, as in
+        tournament.rank_by_opponent_match_wins.
+        :returns: player positions, best first
+        :rtype: list
+        """
+        wins, omw, ids = self.wins, self.omw, self.ids
+        return sorted(
+            range(len(ids)), key=lambda i: (-wins[i], -omw[i], ids[i]))
+
+    def standings(self):
+        """Get ranked standings in player_standings_by_tournament format.
+        :returns: (id, name, wins, matches) tuples, best first
+        :rtype: list
+        """
+        return [
+            (self.ids[i], self.names[i], self.wins[i], self.matches[i])
+            for i in self.ranking()]
+
+    def have_played(self, i, j):
+        """Get whether the players at two positions have already met."""
+        return j in self.opponents[i]
+
+    def bye_candidate(self, ranking):
+        """Get the lowest ranked player yet to receive a bye.
+        :param list ranking: player positions, best first
+        :returns: position of the player to receive a bye, or None when
+            every player has already had one
+        :rtype: int | None
+        """
+        for i in reversed(ranking):
+            if not self.byes[i]:
+                return i
+        return None
+
+    def pair(self):
+        """Pair the next round greedily down the ranking.
+        An odd field gives the lowest ranked player without a bye a bye.
+        Each remaining player then takes the highest ranked player left that
+        they have not played yet; a player with no such opponent left is not
+        paired.
+        :returns: (i, j) position pairs and the position receiving a bye
+        :rtype: tuple
+        """
+        ranking = self.ranking()
+
+        bye = None
+        if len(ranking) % 2 != 0:
+            bye = self.bye_candidate(ranking)
+            if bye is not None:
+                ranking.remove(bye)
+
+        pairs = []
+        while ranking:
+            i = ranking.pop(0)
+            played = self.opponents[i]
+            for index, j in enumerate(ranking):
+                # Never play the same opponent twice
+                if j not in played:
+                    pairs.append((i, ranking.pop(index)))
+                    break
+
+        return pairs, bye
+
+    def pairings(self, pairs):
+        """Get pairings in swiss_pairings format.
+        :param list pairs: (i, j) position pairs
+        :returns: (id1, name1, id2, name2) tuples
+        :rtype: list
+        """
+        ids, names = self.ids, self.names
+        return [(ids[i], names[i], ids[j], names[j]) for i, j in pairs]
+
+
+def pair_greedy(state):
+    """Pair a round with the greedy engine; see TournamentState.pair."""
+    return state.pair()
+
+
+def pair_by_matching(state, window=16):
+    """Pair a round as a minimum-cost perfect matching.
+    Pairs cost the square of their win difference and, far less, their
+    distance in the ranking; rematches are left out of the graph altogether.
+    In an odd field a virtual bye player is added, linked to everyone yet to
+    receive a bye at the cost of their distance from the lowest score and
+    one past the bottom of the ranking, so the bye is part of the optimum
+    and its best edge weighs the same as the best pair's.
+    Each player is linked to the next window unplayed players down the
+    ranking; the window doubles until every player is paired, so the
+    matching is cheapest among those edges, not over every possible pair.
+    :param pairing.TournamentState state: tournament to pair
+    :param int window: initial count of candidate opponents per player
+    :returns: (i, j) position pairs and the position receiving a bye
+    :rtype: tuple
+    :raises ValueError: if no pairing without rematches exists
+    """
+    ranking = state.ranking()
+    count = len(ranking)
+    wins = [state.wins[i] for i in ranking]
+    bye_vertex = count if count % 2 else None
+    if bye_vertex is not None and all(state.byes):
+        raise ValueError(
+            "Every player in tournament %s has already had a bye." % (
+                state.tournament))
+
+    low = min(wins) if wins else 0
+    high = max(wins) if wins else 0
+    # Win differences outweigh any possible total of ranking distances
+    scale = count * count
+    heaviest = ((high - low) ** 2 + 1) * scale
+
+    def weight(score_difference, distance):
+        return heaviest - score_difference ** 2 * scale - distance
+
+    while True:
+        edges = []
+        if bye_vertex is not None:
+            # Listed first so the matching's warm start hands the bye to
+            # the lowest ranked eligible player. Every matching has one bye,
+            # so counting its distance from one past the bottom leaves the
+            # optimum alone, while the bye no longer outweighs every pair:
+            # only the heaviest edges are matched before the search starts.
+            for r in reversed(range(count)):
+                if not state.byes[ranking[r]]:
+                    edges.append((r, bye_vertex, weight(
+                        wins[r] - low, count - r)))
+        for r in range(count):
+            played = state.opponents[ranking[r]]
+            linked = 0
+            for s in range(r + 1, count):
+                if linked == window:
+                    break
+                if ranking[s] not in played:
+                    edges.append((r, s, weight(wins[r] - wins[s], s - r)))
+                    linked += 1
+
+        vertices = count + (1 if bye_vertex is not None else 0)
+        mate = max_weight_matching(vertices, edges, maxcardinality=True)
+        if -1 not in mate:
+            break
+        if window >= count:
+            raise ValueError(
+                "No pairing without rematches exists for tournament %s." % (
+                    state.tournament))
+        window *= 2
+
+    pairs, bye = [], None
+    for r in range(count):
+        s = mate[r]
+        if s == bye_vertex:
+            bye = ranking[r]
+        elif r < s:
+            pairs.append((ranking[r], ranking[s]))
+
+    return pairs, bye
+
+
+def _pair_bracket(state, bracket, pairs, backtrack):
+    """Pair one score bracket in ranking order.
+    Players that cannot be paired within the bracket are first swapped into
+    one of the last backtrack pairs made in it, when that re-pairs two of
+    them without a rematch.
+    :param pairing.TournamentState state: tournament being paired
+    :param list bracket: positions to pair, floaters first
+    :param list pairs: (i, j) position pairs; new pairs are appended
+    :param int backtrack: count of recent pairs open to swaps
+    :returns: positions left unpaired, to float down
+    :rtype: list
+    """
+    opponents = state.opponents
+    first = len(pairs)
+    paired = [False] * len(bracket)
+    leftovers = []
+
+    for x, i in enumerate(bracket):
+        if paired[x]:
+            continue
+        played = opponents[i]
+        for y in range(x + 1, len(bracket)):
+            if not paired[y] and bracket[y] not in played:
+                paired[x] = paired[y] = True
+                pairs.append((i, bracket[y]))
+                break
+        else:
+            leftovers.append(i)
+
+    floaters = []
+    while leftovers:
+        i = leftovers.pop(0)
+        swapped = False
+        for k in range(len(pairs) - 1, max(first, len(pairs) - backtrack) - 1,
+                       -1):
+            a, b = pairs[k]
+            for j in leftovers:
+                if a not in opponents[i] and b not in opponents[j]:
+                    pairs[k] = (a, i)
+                    pairs.append((b, j))
+                elif b not in opponents[i] and a not in opponents[j]:
+                    pairs[k] = (a, j)
+                    pairs.append((b, i))
+                else:
+                    continue
+                leftovers.remove(j)
+                swapped = True
+                break
+            if swapped:
+                break
+        if not swapped:
+            floaters.append(i)
+
+    return floaters
+
+
+def pair_by_brackets(state, backtrack=8):
+    """Pair a round bracket by bracket, floating leftovers down.
+    Players are grouped by wins. Each bracket is paired down the ranking
+    with its floaters from the bracket above first; anyone left unpaired
+    floats to the next bracket. The cost is close to linear in the field
+    size. If players are still unpaired at the bottom, the round is paired
+    by pair_by_matching instead.
+    :param pairing.TournamentState state: tournament to pair
+    :param int backtrack: count of recent pairs in a bracket that may be
+        broken up to avoid floating players
+    :returns: (i, j) position pairs and the position receiving a bye
+    :rtype: tuple
+    :raises ValueError: if no pairing without rematches exists
+    """
+    ranking = state.ranking()
+
+    bye = None
+    if len(ranking) % 2 != 0:
+        bye = state.bye_candidate(ranking)
+        if bye is None:
+            raise ValueError(
+                "Every player in tournament %s has already had a bye." % (
+                    state.tournament))
+        ranking.remove(bye)
+
+    wins = state.wins
+    pairs, floaters = [], []
+    start, count = 0, len(ranking)
+    while start < count:
+        end = start
+        while end < count and wins[ranking[end]] == wins[ranking[start]]:
+            end += 1
+        floaters = _pair_bracket(
+            state, floaters + ranking[start:end], pairs, backtrack)
+        start = end
+
+    if floaters:
+        return pair_by_matching(state)
+    return pairs, bye
+
+
+# Pairing engines by name, for tournament.swiss_pairings
+ENGINES = {
+    'brackets': pair_by_brackets,
+    'greedy': pair_greedy,
+    'matching': pair_by_matching,
+}
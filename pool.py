@@ -0,0 +1,183 @@
+"""Bounded, thread-safe connection pool for the tournament database."""
+
+import collections
+import threading
+import time
+
+from backends import TRANSACTION_STATUS_IDLE
+
+
+class PoolError(Exception):
+
+    """Raised when a connection cannot be checked out of the pool."""
+
+
+class ConnectionPool(object):
+
+    """A bounded pool of reusable database connections.
+    Connections are opened lazily up to maxconn and handed out most recently
+    used first. Connections follow psycopg2's interface, whatever backend
+    opened them. A connection that sat idle for longer than max_idle seconds
+    is pinged before it is handed out again; closed or unresponsive
+    connections are discarded and replaced transparently.
+    """
+
+    def __init__(self, connect, minconn=0, maxconn=10, timeout=None,
+                 max_idle=30.0):
+        """Create a connection pool.
+        :param callable connect: factory returning a new connection
+        :param int minconn: count of connections to open up front
+        :param int maxconn: maximum count of connections open at once
+        :param float timeout: seconds to wait for a free connection; None
+            waits forever
+        :param float max_idle: seconds a connection may sit idle before it
+            is health-checked on checkout
+        """
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError(
+                "Invalid pool bounds: minconn=%s, maxconn=%s" % (
+                    minconn, maxconn))
+
+        self._connect = connect
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._open(), time.time()))
+
+    def _open(self):
+        """Open a new connection for a slot that is already reserved."""
+        try:
+            return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _release_slot(self):
+        """Free the slot of a discarded connection and wake a waiter."""
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _discard(self, connection):
+        """Close a connection and free its slot."""
+        try:
+            connection.close()
+        except Exception:
+            # A connection that fails to close is gone either way
+            pass
+        self._release_slot()
+
+    def _is_healthy(self, connection, idle_since):
+        """Check whether a pooled connection can be handed out.
+        :param connection: connection to check
+        :param float idle_since: time the connection was returned
+        :returns: whether the connection is usable; True | False
+        :rtype: boolean
+        """
+        if connection.closed:
+            return False
+        if time.time() - idle_since < self.max_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def getconn(self):
+        """Check a connection out of the pool.
+        Blocks until a connection is free or the pool timeout expires.
+        :returns: database connection
+        :rtype: psycopg2.connection
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.maxconn:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed.")
+                    if deadline is None:
+                        self._condition.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolError(
+                            "No connection available after %.1fs." % (
+                                self.timeout))
+                    self._condition.wait(remaining)
+
+                if self._closed:
+                    raise PoolError("Connection pool is closed.")
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+                    pooled = None
+
+            if pooled is None:
+                return self._open()
+
+            connection, idle_since = pooled
+            if self._is_healthy(connection, idle_since):
+                return connection
+            self._discard(connection)
+
+    def putconn(self, connection):
+        """Return a connection to the pool.
+        Any open transaction is rolled back; broken connections are closed.
+        :param connection: connection previously returned by getconn
+        """
+        if not connection.closed:
+            status = connection.get_transaction_status()
+            if status != TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Exception:
+                    pass
+
+        with self._condition:
+            if not self._closed and not connection.closed and (
+                    connection.get_transaction_status() ==
+                    TRANSACTION_STATUS_IDLE):
+                self._idle.append((connection, time.time()))
+                self._condition.notify()
+                return
+
+        self._discard(connection)
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts.
+        Connections currently checked out are closed when returned.
+        """
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+
+        for connection, _ in idle:
+            self._discard(connection)
+
+    @property
+    def size(self):
+        """Count of connections currently open, idle or checked out."""
+        return self._size
+
+    @property
+    def idle(self):
+        """Count of connections waiting in the pool."""
+        return len(self._idle)
@@ -0,0 +1,453 @@
+"""SQL shared by the sync (tournament.py) and async (tournament_async.py) APIs.
+Statements use psycopg2 placeholders, which both drivers accept; lists of
+values are passed as one array parameter, so every statement has a single
+text and plan. Functions build the arguments of statements whose parameters
+take more than passing the caller's values through. PREPARED names the
+statements the PostgreSQL backend prepares on each connection.
+"""
+
+WIN = 1
+LOSS = 2
+TIE = 3
+BYE = 4
+
+# Match points awarded per result
+POINTS = {WIN: 3, LOSS: 0, TIE: 1, BYE: 3}
+
+DELETE_ALL = "DELETE FROM %s;"
+
+COUNT_PLAYERS = "SELECT count(id) FROM player;"
+
+REGISTER_PLAYER = "INSERT INTO player (name) VALUES (%s) RETURNING id;"
+
+REGISTER_TOURNAMENT = ("INSERT INTO tournament (name, players) "
+                       "VALUES (%s, %s) "
+                       "RETURNING id;")
+
+REGISTER_ENTRANT = ("INSERT INTO entrant (player_id, tournament_id) "
+                    "VALUES (%s, %s);")
+
+# Every name is a new player, numbered in input order
+REGISTER_PLAYERS = (
+    "WITH new_player AS ("
+    "    SELECT nextval(pg_get_serial_sequence('player', 'id')) AS id, "
+    "        n.name, n.ord "
+    "    FROM unnest(%(names)s::text[]) WITH ORDINALITY AS n (name, ord) "
+    "    ORDER BY n.ord"
+    "), inserted AS ("
+    "    INSERT INTO player (id, name) "
+    "    SELECT id, name FROM new_player"
+    ") "
+    "SELECT id FROM new_player ORDER BY ord;")
+
+# Names already registered reuse the lowest id with that name; new names
+# are numbered in input order
+REGISTER_PLAYERS_BY_NAME = (
+    "WITH name AS ("
+    "    SELECT n.name, min(n.ord) AS ord "
+    "    FROM unnest(%(names)s::text[]) WITH ORDINALITY AS n (name, ord) "
+    "    GROUP BY n.name"
+    "), existing AS ("
+    "    SELECT p.name, min(p.id) AS id "
+    "    FROM player p "
+    "    WHERE p.name IN (SELECT name FROM name) "
+    "    GROUP BY p.name"
+    "), new_player AS ("
+    "    SELECT nextval(pg_get_serial_sequence('player', 'id')) AS id, "
+    "        name.name "
+    "    FROM name "
+    "    WHERE NOT EXISTS ("
+    "        SELECT 1 FROM existing WHERE existing.name = name.name) "
+    "    ORDER BY name.ord"
+    "), inserted AS ("
+    "    INSERT INTO player (id, name) "
+    "    SELECT id, name FROM new_player"
+    ") "
+    "SELECT coalesce(existing.id, new_player.id) "
+    "FROM unnest(%(names)s::text[]) WITH ORDINALITY AS n (name, ord) "
+    "LEFT JOIN existing ON existing.name = n.name "
+    "LEFT JOIN new_player ON new_player.name = n.name "
+    "ORDER BY n.ord;")
+
+ENROLL_PLAYERS = (
+    "INSERT INTO entrant (player_id, tournament_id) "
+    "SELECT DISTINCT p.player_id, %(tournament)s "
+    "FROM unnest(%(players)s::integer[]) AS p (player_id) "
+    "ON CONFLICT DO NOTHING;")
+
+# Lifetime records add up the player's entrant rows, so reports never
+# write to player; its own counters only hold wins and matches recorded
+# outside any tournament, by UPDATE_MATCH_WINS, UPDATE_MATCHES_PLAYED and
+# REPAIR_PLAYER_RECORDS
+PLAYER_STANDINGS = ("SELECT p.id, p.name, "
+                    "       p.wins + coalesce(sum(e.wins), 0) AS wins, "
+                    "       p.matches + coalesce(sum(e.matches), 0) "
+                    "FROM player p "
+                    "LEFT JOIN entrant e ON e.player_id = p.id "
+                    "GROUP BY p.id "
+                    "ORDER BY wins DESC;")
+
+PLAYER_OPPONENTS = ("SELECT player_id "
+                    "FROM match "
+                    "WHERE id IN (SELECT id "
+                    "             FROM match "
+                    "             WHERE player_id = %s "
+                    "             AND tournament_id = %s) "
+                    "AND player_id != %s;")
+
+# Tiebreaks are kept in entrant as results are reported; see tournament.sql
+PLAYER_OPPONENTS_MATCH_WINS = ("SELECT omw "
+                               "FROM entrant "
+                               "WHERE player_id = %s "
+                               "AND tournament_id = %s;")
+
+OPPONENTS_MATCH_WINS = ("SELECT player_id, omw "
+                        "FROM entrant "
+                        "WHERE tournament_id = %s;")
+
+OPPONENTS_MATCH_WIN_PERCENTAGES = ("SELECT player_id, omwp "
+                                   "FROM entrant "
+                                   "WHERE tournament_id = %s;")
+
+RANKED_STANDINGS = ("SELECT id, name, e.wins, e.matches "
+                    "FROM entrant e "
+                    "JOIN player p ON p.id = e.player_id "
+                    "WHERE e.tournament_id = %s "
+                    "ORDER BY e.wins DESC, e.omw DESC, e.player_id;")
+
+STANDINGS_BY_TOURNAMENT = ("SELECT id, name, e.wins, e.matches "
+                           "FROM player p, entrant e "
+                           "WHERE p.id = e.player_id "
+                           "AND tournament_id = %s "
+                           "ORDER BY e.wins DESC, id;")
+
+HAS_RECEIVED_BYE = ("SELECT bye "
+                    "FROM entrant "
+                    "WHERE player_id = %s "
+                    "AND tournament_id = %s;")
+
+UPDATE_MATCH_WINS = ("UPDATE player "
+                     "SET wins = wins + 1 "
+                     "WHERE id = %s;")
+
+UPDATE_MATCHES_PLAYED = ("UPDATE player "
+                         "SET matches = matches + 1 "
+                         "WHERE id = ANY(%s);")
+
+# Every write to a tournament's results first bumps its version, locking
+# the tournament row so concurrent writers queue up rather than deadlock
+LOCK_TOURNAMENT = (
+    "UPDATE tournament "
+    "SET version = version + 1 "
+    "WHERE id = %(tournament)s "
+    "RETURNING id")
+
+# Cached results are checked against the version before they are served,
+# so writes made by other processes are seen too
+TOURNAMENT_VERSION = ("SELECT version "
+                      "FROM tournament "
+                      "WHERE id = %s;")
+
+# Both match rows share one id; counters are bumped in the same statement.
+# A result submitted under a key already used in the tournament is skipped
+# and no rows are returned.
+REPORT_MATCH = (
+    "WITH locked AS (" + LOCK_TOURNAMENT + "), "
+    "new_match AS ("
+    "    SELECT nextval(pg_get_serial_sequence('match', 'id')) AS id "
+    "    FROM locked"
+    "), claimed AS ("
+    "    INSERT INTO submission (tournament_id, key, match_id) "
+    "    SELECT %(tournament)s, %(key)s, id FROM new_match "
+    "    WHERE %(key)s IS NOT NULL "
+    "    ON CONFLICT DO NOTHING "
+    "    RETURNING match_id"
+    "), reported AS ("
+    "    SELECT id FROM new_match "
+    "    WHERE %(key)s IS NULL OR id IN (SELECT match_id FROM claimed)"
+    "), standings AS ("
+    "    UPDATE entrant "
+    "    SET matches = matches + 1, "
+    "        wins = wins + CASE "
+    "            WHEN player_id = %(winner)s OR %(tie)s "
+    "            THEN 1 ELSE 0 END, "
+    "        points = points + CASE "
+    "            WHEN player_id = %(winner)s "
+    "            THEN %(winner_points)s ELSE %(loser_points)s END "
+    "    WHERE tournament_id = %(tournament)s "
+    "    AND player_id IN (%(winner)s, %(loser)s) "
+    "    AND EXISTS (SELECT 1 FROM reported)"
+    ") "
+    "INSERT INTO match (id, player_id, tournament_id, result_id) "
+    "SELECT reported.id, r.player_id, %(tournament)s, r.result_id "
+    "FROM reported, (VALUES "
+    "    (%(winner)s, %(winner_result)s), "
+    "    (%(loser)s, %(loser_result)s)"
+    ") AS r (player_id, result_id) "
+    "RETURNING id;")
+
+REPORT_MATCH_BYE = (
+    "WITH locked AS (" + LOCK_TOURNAMENT + "), "
+    "bye AS ("
+    "    UPDATE entrant "
+    "    SET bye = TRUE, "
+    "        wins = wins + 1, "
+    "        matches = matches + 1, "
+    "        points = points + %(points)s "
+    "    FROM locked "
+    "    WHERE player_id = %(player)s "
+    "    AND tournament_id = locked.id "
+    "    RETURNING player_id"
+    ") "
+    "INSERT INTO match (player_id, tournament_id, result_id) "
+    "SELECT player_id, %(tournament)s, %(result)s FROM bye;")
+
+# The SELECT returns the ids once every data-modifying CTE has run
+REPORT_MATCHES = (
+    "WITH locked AS (" + LOCK_TOURNAMENT + "), "
+    "result AS ("
+    "    SELECT nextval(pg_get_serial_sequence('match', 'id')) AS id,"
+    "        r.winner, r.loser, r.tie, r.ord "
+    "    FROM locked, unnest("
+    "        %(winners)s::integer[], %(losers)s::integer[], "
+    "        %(ties)s::boolean[]"
+    "    ) WITH ORDINALITY AS r (winner, loser, tie, ord)"
+    "), played AS ("
+    "    SELECT id, winner AS player_id, CASE "
+    "        WHEN loser IS NULL THEN %(bye)s "
+    "        WHEN tie THEN %(tie)s ELSE %(win)s END AS result_id, "
+    "        1 AS wins "
+    "    FROM result "
+    "    UNION ALL "
+    "    SELECT id, loser, CASE "
+    "        WHEN tie THEN %(tie)s ELSE %(loss)s END, "
+    "        CASE WHEN tie THEN 1 ELSE 0 END "
+    "    FROM result "
+    "    WHERE loser IS NOT NULL"
+    "), totals AS ("
+    "    SELECT player_id, count(*) AS matches, sum(wins) AS wins, "
+    "        sum(CASE result_id "
+    "            WHEN %(win)s THEN %(win_points)s "
+    "            WHEN %(loss)s THEN %(loss_points)s "
+    "            WHEN %(tie)s THEN %(tie_points)s "
+    "            ELSE %(bye_points)s END) AS points "
+    "    FROM played "
+    "    GROUP BY player_id"
+    "), inserted AS ("
+    "    INSERT INTO match (id, player_id, tournament_id, result_id) "
+    "    SELECT id, player_id, %(tournament)s, result_id FROM played"
+    "), standings AS ("
+    "    UPDATE entrant "
+    "    SET matches = entrant.matches + totals.matches, "
+    "        wins = entrant.wins + totals.wins, "
+    "        points = entrant.points + totals.points, "
+    "        bye = entrant.bye OR entrant.player_id IN ("
+    "            SELECT winner FROM result WHERE loser IS NULL) "
+    "    FROM totals "
+    "    WHERE entrant.tournament_id = %(tournament)s "
+    "    AND entrant.player_id = totals.player_id"
+    ") "
+    "SELECT id FROM result ORDER BY ord;")
+
+SUBMITTED_MATCH = ("SELECT match_id "
+                   "FROM submission "
+                   "WHERE tournament_id = %s "
+                   "AND key = %s;")
+
+# Pairs a round and records its bye in the database; see tournament.sql.
+# The bye, if any, comes first as (id, name, NULL, NULL).
+SWISS_PAIRINGS = ("SELECT id1, name1, id2, name2 "
+                  "FROM swiss_pairings(%s, %s);")
+
+STATE_ENTRANTS = ("SELECT id, name, e.wins, e.matches, e.bye "
+                  "FROM player p, entrant e "
+                  "WHERE p.id = e.player_id "
+                  "AND tournament_id = %s;")
+
+# Each match is listed once, from the lower player id's side
+STATE_OPPONENTS = ("SELECT m.player_id, o.player_id "
+                   "FROM match m, match o "
+                   "WHERE o.id = m.id "
+                   "AND o.player_id > m.player_id "
+                   "AND m.tournament_id = %s;")
+
+# One row per player per match, oldest match first
+MATCH_HISTORY = ("SELECT m.id, m.tournament_id, m.player_id, p.name, "
+                 "       r.name "
+                 "FROM match m "
+                 "JOIN player p ON p.id = m.player_id "
+                 "JOIN result r ON r.id = m.result_id "
+                 "ORDER BY m.id, m.player_id;")
+
+MATCH_HISTORY_BY_TOURNAMENT = ("SELECT m.id, m.tournament_id, m.player_id, "
+                               "       p.name, r.name "
+                               "FROM match m "
+                               "JOIN player p ON p.id = m.player_id "
+                               "JOIN result r ON r.id = m.result_id "
+                               "WHERE m.tournament_id = %s "
+                               "ORDER BY m.id, m.player_id;")
+
+PLAYER_NAMES = ("SELECT id, name "
+                "FROM player "
+                "WHERE id = ANY(%s);")
+
+# Lifetime records, as PLAYER_STANDINGS adds them up, that disagree with
+# the player's match rows: id, wins, matches, then wins and matches counted
+# from match
+PLAYER_RECORD_DRIFT = (
+    "SELECT p.id, p.wins + coalesce(e.wins, 0), "
+    "       p.matches + coalesce(e.matches, 0), "
+    "       coalesce(m.wins, 0), coalesce(m.matches, 0) "
+    "FROM player p "
+    "LEFT JOIN (SELECT player_id, sum(wins) AS wins, "
+    "                  sum(matches) AS matches "
+    "           FROM entrant "
+    "           GROUP BY player_id) AS e ON e.player_id = p.id "
+    "LEFT JOIN (SELECT player_id, count(*) AS matches, "
+    "                  sum(CASE WHEN result_id = %s "
+    "                      THEN 0 ELSE 1 END) AS wins "
+    "           FROM match "
+    "           GROUP BY player_id) AS m ON m.player_id = p.id "
+    "WHERE p.wins + coalesce(e.wins, 0) != coalesce(m.wins, 0) "
+    "OR p.matches + coalesce(e.matches, 0) != coalesce(m.matches, 0) "
+    "ORDER BY p.id;")
+
+# Corrections are added, so results reported meanwhile are kept
+REPAIR_PLAYER_RECORDS = (
+    "UPDATE player "
+    "SET wins = player.wins + r.wins, "
+    "    matches = player.matches + r.matches "
+    "FROM unnest(%(players)s::integer[], %(wins)s::integer[], "
+    "            %(matches)s::integer[]) AS r (id, wins, matches) "
+    "WHERE player.id = r.id;")
+
+# Bulk loads for season-wide analytics; see analytics.py
+MATCH_RESULTS = ("SELECT id, tournament_id, player_id, result_id "
+                 "FROM match;")
+
+MATCH_RESULTS_BY_TOURNAMENTS = ("SELECT id, tournament_id, player_id, "
+                                "       result_id "
+                                "FROM match "
+                                "WHERE tournament_id = ANY(%s);")
+
+ENTRANT_NAMES = ("SELECT e.tournament_id, e.player_id, p.name "
+                 "FROM entrant e "
+                 "JOIN player p ON p.id = e.player_id;")
+
+ENTRANT_NAMES_BY_TOURNAMENTS = ("SELECT e.tournament_id, e.player_id, "
+                                "       p.name "
+                                "FROM entrant e "
+                                "JOIN player p ON p.id = e.player_id "
+                                "WHERE e.tournament_id = ANY(%s);")
+
+# Prepared statements by text: their name and (parameter, type) pairs, in
+# positional order or naming the keys of the statement's arguments
+PREPARED = {
+    COUNT_PLAYERS: ('count_players', ()),
+    REGISTER_PLAYER: ('register_player', (('name', 'text'),)),
+    REGISTER_TOURNAMENT: ('register_tournament', (
+        ('name', 'text'), ('players', 'integer'))),
+    REGISTER_ENTRANT: ('register_entrant', (
+        ('player', 'integer'), ('tournament', 'integer'))),
+    REGISTER_PLAYERS: ('register_players', (('names', 'text[]'),)),
+    REGISTER_PLAYERS_BY_NAME: ('register_players_by_name', (
+        ('names', 'text[]'),)),
+    ENROLL_PLAYERS: ('enroll_players', (
+        ('tournament', 'integer'), ('players', 'integer[]'))),
+    PLAYER_STANDINGS: ('player_standings', ()),
+    TOURNAMENT_VERSION: ('tournament_version', (
+        ('tournament', 'integer'),)),
+    PLAYER_OPPONENTS: ('player_opponents', (
+        ('player', 'integer'), ('tournament', 'integer'),
+        ('opponent', 'integer'))),
+    PLAYER_OPPONENTS_MATCH_WINS: ('player_opponents_match_wins', (
+        ('player', 'integer'), ('tournament', 'integer'))),
+    OPPONENTS_MATCH_WINS: ('opponents_match_wins', (
+        ('tournament', 'integer'),)),
+    OPPONENTS_MATCH_WIN_PERCENTAGES: ('opponents_match_win_percentages', (
+        ('tournament', 'integer'),)),
+    RANKED_STANDINGS: ('ranked_standings', (('tournament', 'integer'),)),
+    STANDINGS_BY_TOURNAMENT: ('standings_by_tournament', (
+        ('tournament', 'integer'),)),
+    HAS_RECEIVED_BYE: ('has_received_bye', (
+        ('player', 'integer'), ('tournament', 'integer'))),
+    UPDATE_MATCH_WINS: ('update_match_wins', (('player', 'integer'),)),
+    UPDATE_MATCHES_PLAYED: ('update_matches_played', (
+        ('players', 'integer[]'),)),
+    REPORT_MATCH: ('report_match', (
+        ('winner', 'integer'), ('loser', 'integer'),
+        ('tournament', 'integer'), ('tie', 'boolean'), ('key', 'text'),
+        ('winner_result', 'integer'), ('loser_result', 'integer'),
+        ('winner_points', 'integer'), ('loser_points', 'integer'))),
+    REPORT_MATCH_BYE: ('report_match_bye', (
+        ('player', 'integer'), ('tournament', 'integer'),
+        ('result', 'integer'), ('points', 'integer'))),
+    REPORT_MATCHES: ('report_matches', (
+        ('tournament', 'integer'), ('winners', 'integer[]'),
+        ('losers', 'integer[]'), ('ties', 'boolean[]'),
+        ('win', 'integer'), ('loss', 'integer'), ('tie', 'integer'),
+        ('bye', 'integer'), ('win_points', 'integer'),
+        ('loss_points', 'integer'), ('tie_points', 'integer'),
+        ('bye_points', 'integer'))),
+    SUBMITTED_MATCH: ('submitted_match', (
+        ('tournament', 'integer'), ('key', 'text'))),
+    SWISS_PAIRINGS: ('swiss_pairings', (
+        ('tournament', 'integer'), ('bye_points', 'integer'))),
+    STATE_ENTRANTS: ('state_entrants', (('tournament', 'integer'),)),
+    STATE_OPPONENTS: ('state_opponents', (('tournament', 'integer'),)),
+}
+
+
+def report_match_args(winner, loser, tournament, tie=False, key=None):
+    """Get the arguments of REPORT_MATCH.
+    Ties count as wins for both players.
+    :param str key: idempotency key of the result; None reports it anyway
+    :rtype: dict
+    """
+    winner_result = TIE if tie else WIN
+    loser_result = TIE if tie else LOSS
+    return {
+        'winner': winner, 'loser': loser, 'tournament': tournament,
+        'tie': tie, 'key': key,
+        'winner_result': winner_result, 'loser_result': loser_result,
+        'winner_points': POINTS[winner_result],
+        'loser_points': POINTS[loser_result]}
+
+
+def report_match_bye_args(player, tournament):
+    """Get the arguments of REPORT_MATCH_BYE.
+    :rtype: dict
+    """
+    return {
+        'player': player, 'tournament': tournament,
+        'result': BYE, 'points': POINTS[BYE]}
+
+
+def report_matches_args(tournament, results, byes=()):
+    """Get the arguments of REPORT_MATCHES.
+    :param int tournament: id of the tournament the round was played in
+    :param iterable results: (winner, loser, tie) tuples; tie is optional
+    :param iterable byes: ids of the players receiving a bye
+    :returns: arguments, or None when there is nothing to report
+    :rtype: dict | None
+    """
+    winners, losers, ties = [], [], []
+    for result in results:
+        winners.append(result[0])
+        losers.append(result[1])
+        ties.append(len(result) > 2 and bool(result[2]))
+    for player in byes:
+        # A bye is a result without a loser
+        winners.append(player)
+        losers.append(None)
+        ties.append(False)
+
+    if not winners:
+        return None
+
+    return {
+        'tournament': tournament,
+        'winners': winners, 'losers': losers, 'ties': ties,
+        'win': WIN, 'loss': LOSS, 'tie': TIE, 'bye': BYE,
+        'win_points': POINTS[WIN], 'loss_points': POINTS[LOSS],
+        'tie_points': POINTS[TIE], 'bye_points': POINTS[BYE]}
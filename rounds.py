@@ -0,0 +1,152 @@
+"""Pair the next round of many tournaments at once.
+Each tournament is paired in a transaction of its own: its results are
+locked, so reports made meanwhile wait for the round, its snapshot is
+loaded, paired on a process pool and its bye written back. Tournaments go
+through these steps side by side, one thread per pooled connection, so one
+tournament's loads and writes overlap another's pairing, and a tournament
+that fails leaves the others paired.
+
+Usage:
+    python rounds.py TOURNAMENT_ID [TOURNAMENT_ID ...] [--processes 8]
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import time
+from multiprocessing.pool import ThreadPool
+
+import tournament
+from pairing import ENGINES
+
+
+def _pair_state(state, engine):
+    """Pair a tournament snapshot; run on a pairing process."""
+    return ENGINES[engine](state)
+
+
+def pair_round(tournament_id, engine='matching', processes=None):
+    """Pair the next round of one tournament in one transaction.
+    :param int tournament_id: id of the tournament
+    :param str engine: pairing engine, as for tournament.swiss_pairings
+    :param multiprocessing.Pool processes: pool to pair on; None pairs in
+        this thread
+    :returns: the tournament id, its pairings, or None and the exception
+        that stopped it, and seconds spent loading, pairing and writing
+    :rtype: dict
+    """
+    result = {
+        'tournament': tournament_id, 'pairings': None, 'error': None,
+        'load_seconds': 0.0, 'pair_seconds': 0.0, 'write_seconds': 0.0}
+    start = time.time()
+    try:
+        with tournament.session():
+            if engine == 'database':
+                # The database locks, pairs and writes in one statement
+                result['pairings'] = tournament.pair_in_database(
+                    tournament_id)
+                result['pair_seconds'] = time.time() - start
+            else:
+                if engine not in ENGINES:
+                    raise ValueError(
+                        "Pairing engine %s is not supported." % engine)
+                tournament.lock_tournament(tournament_id)
+                state = tournament.load_tournament_state(tournament_id)
+                loaded = time.time()
+                result['load_seconds'] = loaded - start
+
+                if processes is None:
+                    pairs, bye = _pair_state(state, engine)
+                else:
+                    pairs, bye = processes.apply(_pair_state, (state, engine))
+                paired = time.time()
+                result['pair_seconds'] = paired - loaded
+
+                if bye is not None:
+                    tournament.report_match_bye(state.ids[bye], tournament_id)
+                result['pairings'] = state.pairings(pairs)
+    except Exception as error:
+        # Nothing of the tournament's round was committed
+        result['pairings'] = None
+        result['error'] = error
+
+    result['seconds'] = time.time() - start
+    if result['error'] is None:
+        result['write_seconds'] = result['seconds'] - (
+            result['load_seconds'] + result['pair_seconds'])
+    return result
+
+
+def pair_rounds(tournament_ids, engine='matching', processes=None,
+                threads=None, pool=None):
+    """Pair the next round of several tournaments concurrently.
+    A tournament that cannot be paired, say because every pairing left
+    would be a rematch, gets its exception in its result; the others are
+    paired regardless.
+    :param iterable tournament_ids: ids of the tournaments
+    :param str engine: pairing engine, as for tournament.swiss_pairings
+    :param int processes: count of pairing processes; None uses one per
+        CPU, 0 pairs on the loading threads
+    :param int threads: count of tournaments in flight at once; None uses
+        one per pooled connection
+    :param multiprocessing.Pool pool: pairing processes to reuse across
+        rounds instead of starting processes on every call
+    :returns: results of pair_round, in the order of tournament_ids
+    :rtype: list
+    """
+    tournament_ids = list(tournament_ids)
+    if not tournament_ids:
+        return []
+
+    # Start processes before threads, so no thread is forked mid-query
+    owned = None
+    if pool is None and processes != 0 and engine != 'database':
+        pool = owned = multiprocessing.Pool(processes)
+
+    threads = min(threads or tournament.POOL_SIZE, len(tournament_ids))
+    workers = ThreadPool(threads)
+    try:
+        pending = [
+            workers.apply_async(pair_round, (tournament_id, engine, pool))
+            for tournament_id in tournament_ids]
+        return [result.get() for result in pending]
+    finally:
+        workers.close()
+        workers.join()
+        if owned is not None:
+            owned.close()
+            owned.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('tournaments', type=int, nargs='+')
+    parser.add_argument(
+        '--engine', choices=sorted(ENGINES) + ['database'],
+        default='matching')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    failed = 0
+    for result in pair_rounds(
+            args.tournaments, args.engine, args.processes, args.threads):
+        if result['error'] is not None:
+            failed += 1
+            print("tournament %d failed after %.1fms: %s" % (
+                result['tournament'], result['seconds'] * 1000,
+                result['error']))
+            continue
+        print("tournament %d: %d pairings in %.1fms "
+              "(load %.1fms, pair %.1fms, write %.1fms)" % (
+                  result['tournament'], len(result['pairings']),
+                  result['seconds'] * 1000, result['load_seconds'] * 1000,
+                  result['pair_seconds'] * 1000,
+                  result['write_seconds'] * 1000))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
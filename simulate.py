@@ -0,0 +1,260 @@
+"""Simulate complete Swiss events for capacity planning.
+Each event registers its players, then pairs rounds with swiss_pairings and
+reports seeded random results with report_matches, as an event would.
+Results follow the players' Elo ratings, with a fixed chance of a tie.
+Events fanned out over a process pool run on the memory backend, one
+backend per worker; otherwise they run on tournament.py's configured
+backend and are kept there, so point it at a scratch database.
+
+Usage:
+    python simulate.py [--events 10000] [--players 64] [--processes 8]
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import random
+import time
+
+import tournament
+from pairing import ENGINES
+
+
+def win_probability(rating, opponent):
+    """Get the chance of a player beating an opponent, by Elo rating.
+    :param float rating: Elo rating of the player
+    :param float opponent: Elo rating of the opponent
+    :rtype: float
+    """
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def simulate_event(players, rounds=None, seed=0, engine='matching',
+                   elo_spread=200.0, tie_rate=0.05):
+    """Play one event end to end.
+    A round that leaves players unpaired counts as a rematch-avoidance
+    failure; a round that cannot be paired at all ends the event.
+    :param int players: count of entrants
+    :param int rounds: count of rounds; None plays ceil(log2(players))
+    :param int seed: random seed for the ratings and results
+    :param str engine: pairing engine passed to swiss_pairings
+    :param float elo_spread: standard deviation of the players' ratings
+        around 1500; 0 makes every match a coin flip
+    :param float tie_rate: chance of a match being a tie
+    :returns: rounds played, the round after which one player led alone,
+        players left unpaired, wins of each bye's recipient when it was
+        given, and seconds spent pairing each round
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    rounds = rounds or max(1, int(math.ceil(math.log(players, 2))))
+
+    tournament_id = tournament.register_tournament(
+        "Simulation %d" % seed, players)
+    player_ids = tournament.register_players(
+        "Player %d of %d" % (number, tournament_id)
+        for number in range(players))
+    tournament.enroll_players(tournament_id, player_ids)
+
+    ratings = dict(
+        (player, rng.gauss(1500, elo_spread)) for player in player_ids)
+    wins = dict((player, 0) for player in player_ids)
+    had_bye = set()
+    event = {
+        'players': players, 'rounds': 0, 'decided_after': None,
+        'unpaired': [], 'bye_wins': [], 'pairing_seconds': [],
+        'stopped': False}
+
+    for number in range(1, rounds + 1):
+        start = time.time()
+        try:
+            pairings = tournament.swiss_pairings(tournament_id, engine)
+        except ValueError:
+            # Every remaining pairing would be a rematch
+            event['stopped'] = True
+            break
+        event['pairing_seconds'].append(time.time() - start)
+
+        paired = set()
+        results = []
+        for id1, _, id2, _ in pairings:
+            paired.update((id1, id2))
+            if rng.random() < tie_rate:
+                results.append((id1, id2, True))
+            elif rng.random() < win_probability(ratings[id1], ratings[id2]):
+                results.append((id1, id2, False))
+            else:
+                results.append((id2, id1, False))
+
+        # The player swiss_pairings just gave a bye to is not paired
+        unpaired = [player for player in player_ids if player not in paired]
+        for player in unpaired:
+            if player not in had_bye and tournament.player_has_received_bye(
+                    player, tournament_id):
+                had_bye.add(player)
+                event['bye_wins'].append(wins[player])
+                wins[player] += 1
+                unpaired.remove(player)
+                break
+        event['unpaired'].append(len(unpaired))
+
+        tournament.report_matches(tournament_id, results)
+        for winner, loser, tie in results:
+            # Ties count as a win for both players
+            wins[winner] += 1
+            if tie:
+                wins[loser] += 1
+
+        event['rounds'] = number
+        if event['decided_after'] is None:
+            best = max(wins.values())
+            if list(wins.values()).count(best) == 1:
+                event['decided_after'] = number
+
+    return event
+
+
+def _simulate_in_worker(kwargs):
+    """Play one event on the worker's memory backend."""
+    # Each event starts from an empty store so workers stay small
+    tournament.get_backend().reset()
+    return simulate_event(**kwargs)
+
+
+def _start_worker():
+    tournament.configure(backend='memory')
+
+
+def simulate(events, players=64, rounds=None, seed=0, engine='matching',
+             elo_spread=200.0, tie_rate=0.05, processes=None):
+    """Play many independent events.
+    Event n is seeded with seed + n, so results do not depend on how the
+    events are spread over processes.
+    :param int events: count of events to play
+    :param int processes: count of worker processes, each on its own memory
+        backend; None uses one per CPU, 0 plays every event in this process
+        on the configured backend
+    :returns: results of simulate_event, in event order
+    :rtype: list
+    :see: simulate_event for the remaining parameters
+    """
+    tasks = [
+        {'players': players, 'rounds': rounds, 'seed': seed + number,
+         'engine': engine, 'elo_spread': elo_spread, 'tie_rate': tie_rate}
+        for number in range(events)]
+    if processes == 0:
+        return [simulate_event(**task) for task in tasks]
+
+    # Forked workers must not inherit, and then close, pooled connections
+    tournament.disconnect()
+    pool = multiprocessing.Pool(processes, initializer=_start_worker)
+    try:
+        workers = processes or multiprocessing.cpu_count()
+        chunksize = max(1, events // (4 * workers))
+        return pool.map(_simulate_in_worker, tasks, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(results):
+    """Aggregate the results of many events.
+    :param list results: results of simulate_event
+    :returns: counts of events by rounds needed to find a sole leader,
+        rematch-avoidance failures, bye recipients by their wins and
+        pairing latency percentiles per round
+    :rtype: dict
+    """
+    decided = collections.Counter(
+        result['decided_after'] for result in results)
+    bye_wins = collections.Counter(
+        wins for result in results for wins in result['bye_wins'])
+
+    latency = collections.defaultdict(list)
+    for result in results:
+        for number, seconds in enumerate(result['pairing_seconds'], 1):
+            latency[number].append(seconds)
+
+    return {
+        'events': len(results),
+        'decided_after': dict(
+            (str(rounds), count) for rounds, count in decided.items()),
+        'unpaired_players': sum(
+            sum(result['unpaired']) for result in results),
+        'events_with_unpaired': sum(
+            1 for result in results if any(result['unpaired'])),
+        'events_stopped': sum(1 for result in results if result['stopped']),
+        'bye_wins': dict(
+            (str(wins), count) for wins, count in bye_wins.items()),
+        'pairing_seconds': dict(
+            (str(number), {
+                'mean': sum(seconds) / len(seconds),
+                'p50': _percentile(seconds, 0.5),
+                'p95': _percentile(seconds, 0.95),
+                'max': max(seconds)})
+            for number, seconds in latency.items()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--engine', choices=sorted(ENGINES) + ['database'],
+        default='matching')
+    parser.add_argument('--elo-spread', type=float, default=200.0)
+    parser.add_argument('--tie-rate', type=float, default=0.05)
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help="worker processes; 0 plays in this process on the configured "
+             "backend")
+    parser.add_argument(
+        '--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args()
+
+    start = time.time()
+    results = simulate(
+        args.events, args.players, args.rounds, args.seed, args.engine,
+        args.elo_spread, args.tie_rate, args.processes)
+    elapsed = time.time() - start
+    summary = summarize(results)
+
+    if args.json:
+        summary['seconds'] = elapsed
+        print(json.dumps(summary, indent=1, sort_keys=True))
+        return
+
+    print("%d events of %d players in %.1fs" % (
+        args.events, args.players, elapsed))
+    print("rounds to a sole leader: %s" % ", ".join(
+        "%s: %d" % item for item in sorted(
+            summary['decided_after'].items(),
+            key=lambda item: (item[0] == 'None', item[0].zfill(3)))))
+    print("unpaired players: %d in %d events; %d events stopped" % (
+        summary['unpaired_players'], summary['events_with_unpaired'],
+        summary['events_stopped']))
+    print("byes by recipient's wins: %s" % ", ".join(
+        "%s: %d" % item for item in sorted(
+            summary['bye_wins'].items(), key=lambda item: int(item[0]))))
+    for number, latency in sorted(
+            summary['pairing_seconds'].items(),
+            key=lambda item: int(item[0])):
+        print("round %2s pairing: mean %7.2fms p95 %7.2fms max %7.2fms" % (
+            number, latency['mean'] * 1000, latency['p95'] * 1000,
+            latency['max'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
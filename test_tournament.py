@@ -1,10 +1,40 @@
-"""Functional testing of tournament.py using a tournament database."""
+"""Functional testing of tournament.py using a tournament database.
+Every test runs against each storage backend: PostgreSQL (skipped when psql
+is not installed), SQLite in memory and the pure-Python memory backend.
+"""
 
+import json
 import os
+import random
+import shutil
+import socket
 import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from distutils.spawn import find_executable
+from StringIO import StringIO
 
+import cli
+import eventlog
+import export
+import pairing
+import queries
+import rounds
+import simulate
 import tournament
+from cache import StandingsCache
+from metrics import JSONLinesExporter, prometheus_text
+from pairing import (
+    ENGINES, TournamentState, pair_by_brackets, pair_by_matching,
+    pair_greedy)
+
+try:
+    import analytics
+except ImportError:
+    # NumPy is optional; its tests are skipped without it
+    analytics = None
 
 SQL_FILE_PATH = os.path.realpath(
     os.path.join(
@@ -15,10 +45,17 @@ SQL_FILE_PATH = os.path.realpath(
 
 class TestTournament(unittest.TestCase):
 
-    """Functional tests for tournament.py."""
+    """Functional tests for tournament.py on PostgreSQL."""
 
-    def setUp(self):
-        """Create a fresh tournament database."""
+    backend = 'postgresql'
+
+    @classmethod
+    def setUpClass(cls):
+        """Create the tournament database."""
+        if cls.backend != 'postgresql':
+            return
+        if find_executable('psql') is None:
+            raise unittest.SkipTest("psql is not installed.")
         try:
             subprocess.check_call(
                 ['psql', '-f', SQL_FILE_PATH],
@@ -28,8 +65,13 @@ class TestTournament(unittest.TestCase):
                 "SQL file %s could not be executed: %s" % (
                     SQL_FILE_PATH, error))
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         """Destroy the tournament database."""
+        # Pooled connections would otherwise block the DROP
+        tournament.disconnect()
+        if cls.backend != 'postgresql':
+            return
         try:
             # DROP cannot run in a transaction block, so use psql
             subprocess.check_call(
@@ -39,6 +81,46 @@ class TestTournament(unittest.TestCase):
             raise RuntimeError(
                 "The tournament database could not be dropped: %s" % (error))
 
+    def setUp(self):
+        """Start from an empty tournament database."""
+        tournament.configure(backend=self.backend, validate_cache=False)
+        tournament.get_backend().reset()
+
+    def tearDown(self):
+        """Return every pooled connection and stop recording metrics."""
+        tournament.disconnect()
+        tournament.metrics.disable()
+        tournament.metrics.reset()
+
+    def explain(self, function, *args):
+        """Get the query plans of the queries a tournament function runs.
+        Sequential scans are disabled so the plans show which indexes the
+        queries can use regardless of how little data the test has.
+        """
+        queries = []
+        run_query = tournament.run_query
+
+        def capture(query, query_args=(), query_type='SELECT'):
+            queries.append((query, query_args))
+            return run_query(query, query_args, query_type)
+
+        tournament.run_query = capture
+        try:
+            function(*args)
+        finally:
+            tournament.run_query = run_query
+
+        plans = []
+        with tournament.session() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off;")
+                for query, query_args in queries:
+                    cursor.execute("EXPLAIN " + query, query_args)
+                    plans.append(
+                        "\n".join(row[0] for row in cursor.fetchall()))
+            connection.rollback()
+        return plans
+
     def test_delete_matches(self):
         """Test matches can be deleted."""
         tournament_id = tournament.register_tournament(
@@ -110,6 +192,69 @@ class TestTournament(unittest.TestCase):
         self.assertEqual(registered, 1)
         print "* Player registered in tournament."
 
+    def test_register_players_in_bulk(self):
+        """Test registering and entering many players at once."""
+        tournament_id = tournament.register_tournament("Test Bulk Event", 3)
+        existing_id = tournament.register_player("Fluttershy")
+        player_ids = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy", "Applejack",
+             "Twilight Sparkle"], by_name=True)
+
+        # Ids come back in input order; known names keep their id
+        self.assertEqual(player_ids[1], existing_id)
+        self.assertEqual(player_ids[0], player_ids[3])
+        self.assertLess(player_ids[0], player_ids[2])
+        self.assertEqual(tournament.count_players(), 3)
+        self.assertEqual(
+            tournament.register_players(
+                ["Applejack", "Fluttershy"], by_name=True),
+            [player_ids[2], existing_id])
+
+        # Otherwise players sharing a name are different players
+        namesakes = tournament.register_players(
+            ["Applejack", "Rarity", "Applejack"])
+        self.assertEqual(len(set(namesakes) | set(player_ids)), 6)
+        self.assertEqual(namesakes, sorted(namesakes))
+        self.assertEqual(tournament.count_players(), 6)
+        self.assertEqual(tournament.register_players([]), [])
+
+        self.assertEqual(
+            tournament.enroll_players(tournament_id, player_ids), 3)
+        self.assertEqual(
+            tournament.enroll_players(tournament_id, player_ids), 0)
+        self.assertEqual(
+            len(tournament.player_standings_by_tournament(tournament_id)), 3)
+        print "* Players can be registered and entered in bulk."
+
+    def test_import_players_csv(self):
+        """Test importing players from a CSV file in batches."""
+        tournament_id = tournament.register_tournament("Test CSV Event", 5)
+        with tempfile.NamedTemporaryFile(suffix='.csv') as csv_file:
+            csv_file.write("name,rating\n")
+            for number in range(5):
+                csv_file.write("Player %d,1500\n" % number)
+            csv_file.flush()
+
+            imported = tournament.import_players_csv(
+                csv_file.name, tournament_id, batch_size=2)
+            self.assertEqual(imported, 5)
+            # A second import by name finds every player already registered
+            tournament.import_players_csv(
+                csv_file.name, tournament_id, by_name=True)
+
+        self.assertEqual(tournament.count_players(), 5)
+        self.assertEqual(
+            sorted(row[1] for row in
+                   tournament.player_standings_by_tournament(tournament_id)),
+            ["Player %d" % number for number in range(5)])
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as csv_file:
+            csv_file.write("player\nFluttershy\n")
+            csv_file.flush()
+            with self.assertRaises(ValueError):
+                tournament.import_players_csv(csv_file.name)
+        print "* Players can be imported from CSV."
+
     def test_register_count_delete(self):
         """Test players can be registered and deleted."""
         tournament.register_player("Markov Chaney")
@@ -200,6 +345,57 @@ class TestTournament(unittest.TestCase):
             self.assertEqual(wins, 1)
         print "* After a match tie, tied players both have wins."
 
+    def test_standings_are_per_tournament(self):
+        """Test results in one tournament do not leak into another."""
+        tournament1_id = tournament.register_tournament("Test Event 1", 2)
+        tournament2_id = tournament.register_tournament("Test Event 2", 2)
+        player1_id = tournament.register_player("Twilight Sparkle")
+        player2_id = tournament.register_player("Fluttershy")
+        for tournament_id in (tournament1_id, tournament2_id):
+            tournament.register_player_in_tournament(player1_id, tournament_id)
+            tournament.register_player_in_tournament(player2_id, tournament_id)
+
+        tournament.report_match(player1_id, player2_id, tournament1_id)
+        tournament.report_match(player2_id, player1_id, tournament2_id)
+        tournament.report_match_bye(player2_id, tournament2_id)
+
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament1_id),
+            [(player1_id, "Twilight Sparkle", 1, 1),
+             (player2_id, "Fluttershy", 0, 1)])
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament2_id),
+            [(player2_id, "Fluttershy", 2, 2),
+             (player1_id, "Twilight Sparkle", 0, 1)])
+        self.assertEqual(
+            tournament.opponents_match_wins(tournament1_id),
+            {player1_id: 0, player2_id: 1})
+
+        # The memory backend only runs the statements in queries.py
+        if self.backend != 'memory':
+            points = tournament.run_query(
+                "SELECT player_id, points FROM standings "
+                "WHERE tournament_id = %s ORDER BY player_id;",
+                (tournament2_id,))
+            self.assertEqual(
+                points['result'],
+                [(player1_id, tournament.POINTS[tournament.LOSS]),
+                 (player2_id,
+                  tournament.POINTS[tournament.WIN] +
+                  tournament.POINTS[tournament.BYE])])
+
+            # Reports leave the players' own rows alone
+            untouched = tournament.run_query(
+                "SELECT DISTINCT wins, matches FROM player;")
+            self.assertEqual(untouched['result'], [(0, 0)])
+
+        # Lifetime records still cover every tournament
+        self.assertEqual(
+            sorted(tournament.player_standings()),
+            [(player1_id, "Twilight Sparkle", 1, 2),
+             (player2_id, "Fluttershy", 2, 3)])
+        print "* Standings are kept per tournament."
+
     def test_rank_by_opponent_match_wins(self):
         """Test ranking standings by opponent match wins."""
         tournament_id = tournament.register_tournament(
@@ -228,6 +424,222 @@ class TestTournament(unittest.TestCase):
              (2, "Boots O'Neal", 0, 1), (4, 'Diane Grant', 0, 1)])
         print "* Matches are ranked by opponent match wins."
 
+    def test_opponents_match_wins(self):
+        """Test tournament-wide OMW agrees with the per-player sums."""
+        tournament_id = tournament.register_tournament(
+            "Test Tournament OMW", 4)
+        player_names = (
+            "Bruno Walton", "Boots O'Neal", "Cathy Burton", "Diane Grant")
+        for player_name in player_names:
+            tournament.register_player_in_tournament(
+                tournament.register_player(player_name), tournament_id)
+
+        standings = tournament.player_standings_by_tournament(tournament_id)
+        player1, player2, player3, player4 = [row[0] for row in standings]
+        tournament.report_match(player1, player2, tournament_id)
+        tournament.report_match(player3, player4, tournament_id, tie=True)
+        tournament.report_match(player1, player3, tournament_id)
+        tournament.report_match_bye(player4, tournament_id)
+
+        omw = tournament.opponents_match_wins(tournament_id)
+        for player in (player1, player2, player3, player4):
+            self.assertEqual(
+                omw[player],
+                tournament.player_opponents_match_wins(
+                    player, tournament_id))
+        print "* Opponent match wins are computed for a whole tournament."
+
+    def test_incremental_tiebreaks(self):
+        """Test stored tiebreaks match ones recomputed from the results."""
+        tournament_id = tournament.register_tournament(
+            "Test Tiebreaks Tournament", 7)
+        players = tournament.register_players(
+            "Player %d" % number for number in range(7))
+        tournament.enroll_players(tournament_id, players)
+
+        rng = random.Random(21)
+        wins = dict((player, 0) for player in players)
+        points = dict((player, 0) for player in players)
+        matches = dict((player, 0) for player in players)
+        opponents = dict((player, set()) for player in players)
+
+        def record(player, won, result):
+            wins[player] += won
+            points[player] += tournament.POINTS[result]
+            matches[player] += 1
+
+        for number in range(5):
+            order = list(players)
+            rng.shuffle(order)
+            results = []
+            for winner, loser in zip(order[1::2], order[2::2]):
+                tie = rng.random() < 0.3
+                results.append((winner, loser, tie))
+                opponents[winner].add(loser)
+                opponents[loser].add(winner)
+                record(winner, 1, tournament.TIE if tie else tournament.WIN)
+                record(loser, int(tie),
+                       tournament.TIE if tie else tournament.LOSS)
+            record(order[0], 1, tournament.BYE)
+
+            # Alternate between single reports and whole rounds
+            if number % 2:
+                tournament.report_matches(
+                    tournament_id, results, byes=[order[0]])
+            else:
+                for winner, loser, tie in results:
+                    tournament.report_match(
+                        winner, loser, tournament_id, tie)
+                tournament.report_match_bye(order[0], tournament_id)
+
+        omw = tournament.opponents_match_wins(tournament_id)
+        omwp = tournament.opponents_match_win_percentages(tournament_id)
+        for player in players:
+            self.assertEqual(
+                omw[player],
+                sum(wins[opponent] for opponent in opponents[player]))
+            self.assertEqual(
+                omw[player],
+                tournament.player_opponents_match_wins(
+                    player, tournament_id))
+            percentages = [
+                max(points[opponent] / (3.0 * matches[opponent]), 1 / 3.0)
+                for opponent in opponents[player]]
+            self.assertAlmostEqual(
+                omwp[player], sum(percentages) / len(percentages))
+
+        standings = tournament.player_standings_by_tournament(tournament_id)
+        self.assertEqual(
+            tournament.ranked_standings(tournament_id),
+            tournament.rank_by_opponent_match_wins(standings, tournament_id))
+        print "* Tiebreaks are kept up to date as results are reported."
+
+    def test_analytics(self):
+        """Test vectorized standings agree with the database's."""
+        if analytics is None:
+            self.skipTest("NumPy is not installed.")
+        rng = random.Random(23)
+        tournament_ids = []
+        for number in range(3):
+            tournament_id = tournament.register_tournament(
+                "Test Season Event %d" % number, 9)
+            player_ids = tournament.register_players(
+                "Season Player %d" % player for player in range(
+                    number * 3, number * 3 + 9))
+            tournament.enroll_players(tournament_id, player_ids)
+            for _ in range(3):
+                pairings = tournament.swiss_pairings(tournament_id)
+                tournament.report_matches(tournament_id, [
+                    (id1, id2, rng.random() < 0.2)
+                    for id1, _, id2, _ in pairings])
+            tournament_ids.append(tournament_id)
+        # Entrants without a match are ranked too
+        tournament_ids.append(tournament.register_tournament("Empty", 1))
+        tournament.register_player_in_tournament(
+            tournament.register_player("Season Player 0"), tournament_ids[-1])
+
+        standings = analytics.load_standings(fetch_size=7)
+        self.assertEqual(len(standings), 28)
+        for tournament_id in tournament_ids:
+            self.assertEqual(
+                standings.standings(tournament_id),
+                tournament.ranked_standings(tournament_id))
+            self.assertEqual(
+                standings.opponents_match_wins(tournament_id),
+                tournament.opponents_match_wins(tournament_id))
+            omwp = tournament.opponents_match_win_percentages(tournament_id)
+            for player, percentage in (
+                    standings.opponents_match_win_percentages(
+                        tournament_id).items()):
+                self.assertAlmostEqual(percentage, omwp[player])
+
+        # Loading some tournaments gives the same standings for them
+        some = analytics.load_standings(tournament_ids[1:3])
+        self.assertEqual(sorted(some.all_standings()), tournament_ids[1:3])
+        self.assertEqual(
+            some.standings(tournament_ids[1]),
+            standings.standings(tournament_ids[1]))
+
+        # Every player is an entrant, so the season is their lifetime
+        season = standings.season_standings()
+        self.assertEqual(sorted(season), sorted(tournament.player_standings()))
+        self.assertEqual(
+            [row[2] for row in season],
+            sorted((row[2] for row in season), reverse=True))
+        print "* Season standings are computed in bulk."
+
+    def test_hot_queries_use_indexes(self):
+        """Test per-tournament lookups use the tournament indexes."""
+        if self.backend != 'postgresql':
+            self.skipTest("Query plans are checked on PostgreSQL only.")
+        tournament_id = tournament.register_tournament(
+            "Test Index Tournament", 2)
+        player1_id = tournament.register_player("Twilight Sparkle")
+        player2_id = tournament.register_player("Fluttershy")
+        tournament.register_player_in_tournament(player1_id, tournament_id)
+        tournament.register_player_in_tournament(player2_id, tournament_id)
+        tournament.report_match(player1_id, player2_id, tournament_id)
+
+        [plan] = self.explain(
+            tournament.player_standings_by_tournament, tournament_id)
+        self.assertIn("entrant_", plan)
+
+        [plan] = self.explain(
+            tournament.opponents_match_wins, tournament_id)
+        self.assertIn("entrant_", plan)
+
+        [plan] = self.explain(tournament.ranked_standings, tournament_id)
+        self.assertIn("entrant_rank_idx", plan)
+
+        [plan] = self.explain(
+            tournament.player_opponents, player1_id, tournament_id)
+        self.assertIn("match_tournament_player_idx", plan)
+
+        [plan] = self.explain(lambda: tournament.run_query(
+            "SELECT * FROM standings WHERE tournament_id = %s;",
+            (tournament_id,)))
+        self.assertIn("entrant_", plan)
+        self.assertNotIn("match", plan)
+        self.assertEqual(
+            tournament.run_query(
+                "SELECT player_id, wins, matches, omw FROM standings "
+                "WHERE tournament_id = %s ORDER BY player_id;",
+                (tournament_id,))['result'],
+            [(player1_id, 1, 1, 0), (player2_id, 0, 1, 1)])
+        print "* Tournament lookups use the tournament indexes."
+
+    def test_tournament_state(self):
+        """Test the in-memory snapshot ranks like the database does."""
+        tournament_id = tournament.register_tournament(
+            "Test State Tournament", 5)
+        player_names = (
+            "Twilight Sparkle", "Fluttershy", "Applejack",
+            "Pinkie Pie", "Brandy Ruby")
+        for player_name in player_names:
+            tournament.register_player_in_tournament(
+                tournament.register_player(player_name), tournament_id)
+
+        standings = tournament.player_standings_by_tournament(tournament_id)
+        player1, player2, player3, player4, player5 = [
+            row[0] for row in standings]
+        tournament.report_match(player1, player2, tournament_id)
+        tournament.report_match(player3, player4, tournament_id, tie=True)
+        tournament.report_match_bye(player5, tournament_id)
+
+        state = tournament.load_tournament_state(tournament_id)
+        self.assertEqual(len(state), 5)
+        self.assertEqual(
+            state.standings(),
+            tournament.rank_by_opponent_match_wins(
+                tournament.player_standings_by_tournament(tournament_id),
+                tournament_id))
+        self.assertTrue(state.have_played(
+            state.index[player3], state.index[player4]))
+        self.assertFalse(state.have_played(
+            state.index[player1], state.index[player3]))
+        self.assertEqual(state.byes[state.index[player5]], True)
+        print "* Tournament snapshots rank like the database."
+
     def test_pairings(self):
         """Test pairing players."""
         tournament_id = tournament.register_tournament(
@@ -285,6 +697,894 @@ class TestTournament(unittest.TestCase):
             "* After one match where one player was granted a bye, "
             "players with one win are paired.")
 
+    def test_pairings_in_database(self):
+        """Test the database engine pairs like the greedy engine."""
+        tournament_id = tournament.register_tournament(
+            "Test Database Pairings Tournament", 7)
+        player_ids = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie",
+             "Rarity", "Brandy Ruby", "Spike"])
+        tournament.enroll_players(tournament_id, player_ids)
+        tournament.report_matches(tournament_id, [
+            (player_ids[0], player_ids[1]), (player_ids[2], player_ids[3]),
+            (player_ids[4], player_ids[5], True)], byes=[player_ids[6]])
+
+        state = tournament.load_tournament_state(tournament_id)
+        pairs, bye = state.pair()
+        bye_id = state.ids[bye]
+        pairings = tournament.swiss_pairings(tournament_id, 'database')
+        self.assertEqual(pairings, state.pairings(pairs))
+        self.assertEqual(len(pairings), 3)
+        self.assertTrue(
+            tournament.player_has_received_bye(bye_id, tournament_id))
+
+        # The bye was recorded, so the cached snapshot is stale
+        state = tournament.load_tournament_state(tournament_id)
+        self.assertEqual(state.matches[state.index[bye_id]], 2)
+        print "* The database pairs a round and records its bye."
+
+    def test_report_match_is_atomic(self):
+        """Test a rejected match report leaves standings untouched."""
+        tournament_id = tournament.register_tournament(
+            "Test Atomic Report Tournament", 2)
+        player1_id = tournament.register_player("Twilight Sparkle")
+        player2_id = tournament.register_player("Fluttershy")
+        tournament.register_player_in_tournament(player1_id, tournament_id)
+
+        # Fluttershy is not an entrant, so the loser row is rejected
+        with self.assertRaises(tournament.get_backend().IntegrityError):
+            tournament.report_match(player1_id, player2_id, tournament_id)
+
+        for id, name, wins, matches in tournament.player_standings():
+            self.assertEqual((wins, matches), (0, 0))
+        self.assertEqual(tournament.delete_matches(), 0)
+
+        tournament.register_player_in_tournament(player2_id, tournament_id)
+        match_id = tournament.report_match(
+            player1_id, player2_id, tournament_id)
+        self.assertIsInstance(match_id, int)
+        self.assertEqual(
+            tournament.player_standings(),
+            [(player1_id, "Twilight Sparkle", 1, 1),
+             (player2_id, "Fluttershy", 0, 1)])
+        print "* A rejected match report is rolled back completely."
+
+    def test_report_to_missing_tournament(self):
+        """Test every backend rejects reports to a missing tournament."""
+        tournament_id = tournament.register_tournament(
+            "Test Missing Tournament", 2)
+        player1_id, player2_id = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy"])
+        missing = tournament_id + 1
+
+        with self.assertRaises(ValueError):
+            tournament.report_match(player1_id, player2_id, missing)
+        with self.assertRaises(ValueError):
+            tournament.report_match(
+                player1_id, player2_id, missing, key="round 1 table 1")
+        with self.assertRaises(ValueError):
+            tournament.report_matches(missing, [(player1_id, player2_id)])
+        self.assertEqual(tournament.report_match_bye(player1_id, missing), 0)
+        self.assertEqual(tournament.delete_matches(), 0)
+        print "* Reports to a missing tournament raise ValueError."
+
+    def test_report_match_idempotent(self):
+        """Test a result resubmitted under its key is only reported once."""
+        tournament_id = tournament.register_tournament(
+            "Test Idempotent Tournament", 2)
+        player1_id, player2_id = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy"])
+        tournament.enroll_players(tournament_id, [player1_id, player2_id])
+
+        match_id = tournament.report_match(
+            player1_id, player2_id, tournament_id, key="round 1 table 1")
+        self.assertEqual(tournament.report_match(
+            player1_id, player2_id, tournament_id, key="round 1 table 1"),
+            match_id)
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament_id),
+            [(player1_id, "Twilight Sparkle", 1, 1),
+             (player2_id, "Fluttershy", 0, 1)])
+
+        # Keys are per tournament, and results without one always count
+        self.assertNotEqual(tournament.report_match(
+            player2_id, player1_id, tournament_id), match_id)
+        self.assertEqual(tournament.player_opponents(
+            player1_id, tournament_id), [player2_id, player2_id])
+        print "* A resubmitted result is only reported once."
+
+    def test_concurrent_reports(self):
+        """Test counters match the match table under concurrent reports."""
+        tournament_id = tournament.register_tournament(
+            "Test Concurrent Tournament", 16)
+        player_ids = tournament.register_players(
+            "Player %d" % number for number in range(16))
+        tournament.enroll_players(tournament_id, player_ids)
+
+        # Every result is submitted twice, by two different judges
+        rng = random.Random(0)
+        results = dict(
+            ("result %d" % number, rng.sample(player_ids, 2))
+            for number in range(256))
+        keys = sorted(results) * 2
+        rng.shuffle(keys)
+        errors = []
+
+        def judge(keys):
+            try:
+                for key in keys:
+                    winner, loser = results[key]
+                    tournament.report_match(
+                        winner, loser, tournament_id, key=key)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [
+            threading.Thread(target=judge, args=(keys[number::64],))
+            for number in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        wins = dict((player, 0) for player in player_ids)
+        matches = dict((player, 0) for player in player_ids)
+        for winner, loser in results.values():
+            wins[winner] += 1
+            matches[winner] += 1
+            matches[loser] += 1
+        state = tournament.load_tournament_state(tournament_id)
+        for player in player_ids:
+            position = state.index[player]
+            self.assertEqual(state.wins[position], wins[player])
+            self.assertEqual(state.matches[position], matches[player])
+            # Each reported match is one row per player in match
+            self.assertEqual(len(tournament.player_opponents(
+                player, tournament_id)), matches[player])
+        print "* Counters match the match table under concurrent reports."
+
+    def test_report_matches_in_bulk(self):
+        """Test reporting a whole round of results at once."""
+        tournament_id = tournament.register_tournament(
+            "Test Bulk Report Tournament", 5)
+        player_names = (
+            "Twilight Sparkle", "Fluttershy", "Applejack",
+            "Pinkie Pie", "Brandy Ruby")
+        for player_name in player_names:
+            tournament.register_player_in_tournament(
+                tournament.register_player(player_name), tournament_id)
+
+        standings = tournament.player_standings_by_tournament(tournament_id)
+        player1, player2, player3, player4, player5 = [
+            row[0] for row in standings]
+        match_ids = tournament.report_matches(
+            tournament_id,
+            [(player1, player2), (player3, player4, True)],
+            byes=[player5])
+
+        # One distinct id per result, in input order
+        self.assertEqual(len(set(match_ids)), 3)
+        self.assertEqual(tournament.delete_matches(), 5)
+
+        records = dict(
+            (id, (wins, matches))
+            for id, name, wins, matches in tournament.player_standings())
+        self.assertEqual(records, {
+            player1: (1, 1), player2: (0, 1), player3: (1, 1),
+            player4: (1, 1), player5: (1, 1)})
+        self.assertTrue(
+            tournament.player_has_received_bye(player5, tournament_id))
+        self.assertEqual(tournament.report_matches(tournament_id, []), [])
+        print "* A round of results can be reported at once."
+
+    def test_metrics(self):
+        """Test queries are counted against the functions issuing them."""
+        tournament_id = tournament.register_tournament(
+            "Test Metrics Tournament", 4)
+        player_ids = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+        tournament.enroll_players(tournament_id, player_ids)
+        self.assertEqual(tournament.metrics.snapshot()['functions'], {})
+        # Close the pool so pairing opens a connection
+        tournament.disconnect()
+
+        slow_queries = []
+        tournament.metrics.enable(
+            slow_query_seconds=0, explain=True,
+            on_slow_query=slow_queries.append, profile=['swiss_pairings'])
+        tournament.swiss_pairings(tournament_id)
+        tournament.player_standings_by_tournament(tournament_id)
+        snapshot = tournament.metrics.snapshot()
+
+        functions = snapshot['functions']
+        # Entrants and matches, charged to every function on the stack
+        self.assertEqual(functions['swiss_pairings']['queries'], 2)
+        self.assertEqual(functions['load_tournament_state']['queries'], 2)
+        self.assertEqual(functions['swiss_pairings']['rows'], 4)
+        self.assertEqual(functions['swiss_pairings']['calls'], 1)
+        self.assertEqual(
+            functions['swiss_pairings']['seconds']['buckets'][-1], ('+Inf', 1))
+        self.assertEqual(snapshot['totals']['queries'], 3)
+        self.assertEqual(snapshot['totals']['connections'], 1)
+        self.assertIsNotNone(
+            tournament.metrics.profile_stats('swiss_pairings'))
+
+        self.assertEqual(len(slow_queries), 3)
+        self.assertEqual(slow_queries[0]['stack'], [
+            'swiss_pairings', 'load_tournament_state'])
+        if self.backend != 'memory':
+            self.assertTrue(slow_queries[0]['plan'])
+
+        text = prometheus_text(snapshot)
+        self.assertIn(
+            'tournament_queries_total{function="swiss_pairings"} 2', text)
+        stream = StringIO()
+        # Totals, three functions and three slow queries
+        self.assertEqual(
+            tournament.metrics.export(JSONLinesExporter(stream)), 7)
+        self.assertEqual(len(stream.getvalue().splitlines()), 7)
+
+        tournament.metrics.disable()
+        tournament.count_players()
+        self.assertNotIn('count_players', tournament.metrics.snapshot()[
+            'functions'])
+        print "* Queries are counted per function."
+
+    def test_simulate(self):
+        """Test whole events are simulated reproducibly."""
+        event = simulate.simulate_event(9, rounds=4, seed=1)
+        self.assertEqual(event['rounds'], 4)
+        self.assertEqual(event['unpaired'], [0, 0, 0, 0])
+        self.assertEqual(len(event['bye_wins']), 4)
+        self.assertEqual(len(event['pairing_seconds']), 4)
+
+        # Worker processes play on their own memory backends
+        results = simulate.simulate(3, players=9, rounds=4, processes=1)
+        in_process = simulate.simulate(3, players=9, rounds=4, processes=0)
+        summary = simulate.summarize(results)
+        self.assertEqual(summary['events'], 3)
+        self.assertEqual(sum(summary['bye_wins'].values()), 12)
+        self.assertEqual(len(summary['pairing_seconds']), 4)
+        for result in results + in_process:
+            del result['pairing_seconds']
+        self.assertEqual(results, in_process)
+        print "* Whole events are simulated reproducibly."
+
+    def test_event_log(self):
+        """Test tournament state is rebuilt from a snapshot and the log."""
+        directory = tempfile.mkdtemp()
+        log_path = os.path.join(directory, 'events.log')
+        snapshot_path = os.path.join(directory, 'tournament.snapshot')
+        tournament.configure(event_log=log_path)
+        try:
+            tournament_id = tournament.register_tournament(
+                "Test Logged Tournament", 7)
+            player_ids = tournament.register_players(
+                ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie",
+                 "Rarity", "Brandy Ruby"])
+            tournament.enroll_players(tournament_id, player_ids)
+            latecomer = tournament.register_player("Spike")
+            tournament.register_player_in_tournament(
+                latecomer, tournament_id)
+            tournament.report_match(
+                player_ids[0], player_ids[1], tournament_id, key='1-1')
+            tournament.report_match(
+                player_ids[0], player_ids[1], tournament_id, key='1-1')
+            tournament.report_matches(tournament_id, [
+                (player_ids[2], player_ids[3], True),
+                (player_ids[4], player_ids[5])], byes=[latecomer])
+
+            # Rolled back results are never logged
+            with self.assertRaises(RuntimeError):
+                with tournament.session():
+                    tournament.report_match(
+                        player_ids[1], player_ids[2], tournament_id)
+                    raise RuntimeError("Result entered by mistake.")
+
+            state, offset = eventlog.recover(tournament_id, log_path)
+            self.assertEqual(eventlog.compare_states(
+                state, tournament.load_tournament_state(tournament_id)), [])
+            self.assertEqual(offset, os.path.getsize(log_path))
+            eventlog.write_snapshot(snapshot_path, state, offset)
+
+            # Later events are replayed on top of the snapshot
+            for engine in ('matching', 'database'):
+                pairings = tournament.swiss_pairings(tournament_id, engine)
+                tournament.report_matches(tournament_id, [
+                    (id1, id2) for id1, _, id2, _ in pairings])
+            recovered, offset = eventlog.recover(
+                tournament_id, log_path, snapshot_path)
+            self.assertEqual(recovered.names, state.names)
+            self.assertEqual(eventlog.compare_states(
+                recovered, tournament.load_tournament_state(tournament_id)),
+                [])
+            self.assertEqual(sum(recovered.byes), 3)
+
+            # A record cut short by a crash is dropped on reopening
+            with open(log_path, 'ab') as log:
+                log.write(b'\x02\x01')
+            self.assertEqual(
+                eventlog.recover(tournament_id, log_path)[1], offset)
+            tournament.configure(event_log=log_path)
+            self.assertEqual(tournament.events.offset, offset)
+
+            # A result can be logged ahead of its players' entrant events
+            reordered = eventlog.EventLog()
+            reordered.open(os.path.join(directory, 'reordered.log'))
+            reordered.append([
+                eventlog.result_event(9, 1, 10, 11),
+                eventlog.bye_event(9, 12),
+                eventlog.entered_event(9, 10, "Rarity"),
+                eventlog.entered_event(9, 11, "Spike")])
+            reordered.close()
+            unapplied = []
+            state, _ = eventlog.recover(
+                9, os.path.join(directory, 'reordered.log'),
+                unapplied=unapplied)
+            self.assertEqual(
+                (list(state.ids), list(state.wins), list(state.matches)),
+                ([10, 11], [1, 0], [1, 1]))
+            self.assertEqual(unapplied, [eventlog.bye_event(9, 12)])
+        finally:
+            tournament.events.close()
+            shutil.rmtree(directory)
+        print "* Tournaments are rebuilt from snapshots and the event log."
+
+    def test_reconcile_player_records(self):
+        """Test lifetime records are checked against match rows."""
+        tournament_id = tournament.register_tournament(
+            "Test Reconciled Tournament", 2)
+        player1_id = tournament.register_player("Twilight Sparkle")
+        player2_id = tournament.register_player("Fluttershy")
+        tournament.enroll_players(tournament_id, [player1_id, player2_id])
+        tournament.report_match(player1_id, player2_id, tournament_id)
+        self.assertEqual(tournament.reconcile_player_records(), [])
+
+        # update_match_wins counts a win without a match row
+        tournament.update_match_wins(player2_id)
+        self.assertEqual(
+            tournament.reconcile_player_records(repair=True),
+            [(player2_id, 1, 1, 0, 1)])
+        self.assertEqual(tournament.reconcile_player_records(), [])
+        self.assertEqual(
+            sorted(tournament.player_standings()),
+            [(player1_id, "Twilight Sparkle", 1, 1),
+             (player2_id, "Fluttershy", 0, 1)])
+        print "* Lifetime records are reconciled with match rows."
+
+    def test_pair_rounds(self):
+        """Test pairing several tournaments at once, failures isolated."""
+        tournament_ids = []
+        for players in (4, 5):
+            tournament_id = tournament.register_tournament(
+                "Test Side Event %d" % players, players)
+            player_ids = tournament.register_players(
+                "Side %d Player %d" % (players, number)
+                for number in range(players))
+            tournament.enroll_players(tournament_id, player_ids)
+            tournament_ids.append(tournament_id)
+        missing = max(tournament_ids) + 1
+
+        for processes in (0, 2):
+            results = rounds.pair_rounds(
+                tournament_ids + [missing], processes=processes)
+            self.assertEqual(
+                [result['tournament'] for result in results],
+                tournament_ids + [missing])
+            for result in results[:2]:
+                self.assertIsNone(result['error'])
+                self.assertEqual(len(result['pairings']), 2)
+                self.assertGreaterEqual(result['seconds'], 0)
+            self.assertIsInstance(results[2]['error'], ValueError)
+            self.assertIsNone(results[2]['pairings'])
+
+            # The odd tournament's bye is written back with its round
+            byes = [
+                player for player, _, _, _ in
+                tournament.player_standings_by_tournament(tournament_ids[1])
+                if tournament.player_has_received_bye(
+                    player, tournament_ids[1])]
+            self.assertEqual(len(byes), 1 + (processes != 0))
+            for result in results[:2]:
+                tournament.report_matches(result['tournament'], [
+                    (id1, id2) for id1, _, id2, _ in result['pairings']])
+
+        # A round failing once loaded leaves no state cached under the
+        # version its lock bumped, which rolls back with it
+        tournament.cache.invalidate()
+        pair_state = rounds._pair_state
+
+        def fail(state, engine):
+            raise ValueError("Only rematches are left.")
+
+        rounds._pair_state = fail
+        try:
+            result = rounds.pair_round(tournament_ids[0])
+        finally:
+            rounds._pair_state = pair_state
+        self.assertIsInstance(result['error'], ValueError)
+        self.assertEqual(tournament.cache.stats()['tournaments'], 0)
+
+        # Each tournament's round is committed, or not, on its own
+        results = rounds.pair_rounds(tournament_ids, engine='unknown')
+        self.assertTrue(all(
+            isinstance(result['error'], ValueError) for result in results))
+        print "* Rounds of several tournaments are paired at once."
+
+    def test_cli(self):
+        """Test the command line, run here and sent to a daemon."""
+        tournament_id = tournament.register_tournament("Test CLI Event", 4)
+        directory = tempfile.mkdtemp()
+        names_path = os.path.join(directory, 'names.txt')
+        socket_path = os.path.join(directory, 'tournament.sock')
+        with open(names_path, 'w') as names:
+            names.write("CLI Alice\nCLI Bob\n\nCLI Carol\nCLI Dave\n")
+
+        def run(argv):
+            return cli.execute(cli.parse_args(argv))
+
+        server = cli.make_server(socket_path)
+        # Commands run without the daemon may write meanwhile
+        self.assertTrue(tournament.CACHE_VALIDATE)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            status, output, error = run(
+                ['register-bulk', str(tournament_id), names_path])
+            self.assertEqual((status, error), (0, ''))
+            registered = [line.split('\t') for line in output.splitlines()]
+            self.assertEqual(
+                [name for _, name in registered],
+                ["CLI Alice", "CLI Bob", "CLI Carol", "CLI Dave"])
+            # Checking in again by name registers nobody twice
+            self.assertEqual(
+                cli.send(socket_path, cli.parse_args(
+                    ['register-bulk', str(tournament_id), names_path,
+                     '--by-name'])),
+                (0, output, ''))
+
+            # The daemon answers exactly as the command run here does
+            command = cli.parse_args(['pair', str(tournament_id)])
+            pairs = cli.send(socket_path, command)
+            self.assertEqual(pairs, cli.execute(command))
+            self.assertEqual(len(pairs[1].splitlines()), 2)
+            for line in pairs[1].splitlines():
+                id1, _, id2, _ = line.split('\t')
+                status, output, _ = cli.send(socket_path, cli.parse_args(
+                    ['report', str(tournament_id), id1, id2,
+                     '--key', 'r1-' + id1]))
+                self.assertEqual(status, 0)
+                self.assertTrue(output.strip().isdigit())
+
+            command = cli.parse_args(['standings', str(tournament_id)])
+            standings = cli.send(socket_path, command)
+            self.assertEqual(standings, cli.execute(command))
+            rows = [line.split('\t') for line in standings[1].splitlines()]
+            self.assertEqual([row[0] for row in rows], ['1', '2', '3', '4'])
+            self.assertEqual([row[3] for row in rows], ['1', '1', '0', '0'])
+
+            # Failures come back as a status and a message
+            status, output, error = cli.send(socket_path, cli.parse_args(
+                ['report', str(tournament_id), registered[0][0]]))
+            self.assertEqual((status, output), (1, ''))
+            self.assertIn("loser", error)
+            self.assertRaises(RuntimeError, cli.make_server, socket_path)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            shutil.rmtree(directory)
+        print "* The command line runs commands here or on a daemon."
+
+    def test_cli_lost_daemon(self):
+        """Test commands fall back to this process only without a daemon."""
+        tournament_id = tournament.register_tournament("Test CLI Event", 2)
+        player_ids = tournament.register_players(["CLI Alice", "CLI Bob"])
+        tournament.enroll_players(tournament_id, player_ids)
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, 'tournament.sock')
+        report = ['--socket', socket_path, 'report', str(tournament_id),
+                  str(player_ids[0]), str(player_ids[1])]
+
+        # A daemon that reads the command and hangs up, as if it crashed
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socket_path)
+        listener.listen(1)
+
+        def hang_up():
+            connection, _ = listener.accept()
+            connection.makefile('rb').readline()
+            connection.close()
+
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = StringIO()
+        try:
+            thread = threading.Thread(target=hang_up)
+            thread.start()
+            self.assertEqual(cli.main(report), 1)
+            thread.join()
+            self.assertIn("may have run", sys.stderr.getvalue())
+
+            # The report is not run again here
+            self.assertEqual(
+                [matches for _, _, _, matches in
+                 tournament.ranked_standings(tournament_id)], [0, 0])
+
+            # Without a daemon listening, the command runs here
+            listener.close()
+            self.assertEqual(cli.main(report), 0)
+            os.remove(socket_path)
+            self.assertEqual(cli.main(report), 0)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            listener.close()
+            shutil.rmtree(directory)
+        self.assertEqual(
+            [matches for _, _, _, matches in
+             tournament.ranked_standings(tournament_id)], [2, 2])
+        print "* Commands run here only when no daemon was reached."
+
+    def test_prepared_statements(self):
+        """Test warm_up prepares the statements on every pooled connection."""
+        pool_size = tournament.POOL_SIZE
+        tournament.configure(pool_size=2)
+        try:
+            prepared = tournament.warm_up()
+            if self.backend != 'postgresql':
+                self.assertEqual(prepared, 0)
+                return
+            self.assertEqual(prepared, 2 * len(queries.PREPARED))
+            self.assertEqual(tournament.warm_up(), 0)
+
+            names = tournament.run_query(
+                "SELECT name FROM pg_prepared_statements;")['result']
+            self.assertEqual(
+                set(name for name, in names),
+                set(name for name, _ in queries.PREPARED.values()))
+            # Statements that take a list take it as one array
+            tournament.update_matches_played([])
+            self.assertEqual(tournament.count_players(), 0)
+        finally:
+            tournament.configure(pool_size=pool_size)
+        print "* Statements are prepared on every pooled connection."
+
+    def test_streaming_export(self):
+        """Test standings and history are streamed and exported."""
+        tournament_id = tournament.register_tournament(
+            "Test Export Tournament", 3)
+        player_ids = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy", "Applejack"])
+        tournament.enroll_players(tournament_id, player_ids)
+        tournament.report_matches(
+            tournament_id, [(player_ids[0], player_ids[1])],
+            byes=[player_ids[2]])
+
+        streamed = tournament.iter_player_standings(fetch_size=1)
+        self.assertEqual(list(streamed), tournament.player_standings())
+        self.assertEqual(
+            list(tournament.iter_standings_by_tournament(tournament_id)),
+            tournament.player_standings_by_tournament(tournament_id))
+        history = list(tournament.iter_match_history(fetch_size=2))
+        self.assertEqual(
+            [row[2:] for row in history],
+            [(player_ids[0], "Twilight Sparkle", "Win"),
+             (player_ids[1], "Fluttershy", "Loss"),
+             (player_ids[2], "Applejack", "Bye")])
+        self.assertEqual(
+            list(tournament.iter_match_history(tournament_id + 1)), [])
+
+        output = StringIO()
+        self.assertEqual(export.export_standings(output, tournament_id), 3)
+        self.assertEqual(output.getvalue().splitlines()[:2], [
+            "id,name,wins,matches", "%d,Twilight Sparkle,1,1" % (
+                player_ids[0])])
+        output = StringIO()
+        self.assertEqual(export.export_match_history(
+            output, tournament_id, format='jsonl'), 3)
+        self.assertEqual(json.loads(output.getvalue().splitlines()[2]), {
+            'match_id': history[2][0], 'tournament_id': tournament_id,
+            'player_id': player_ids[2], 'name': "Applejack",
+            'result': "Bye"})
+        output = StringIO()
+        pairings = [(player_ids[0], "Twilight Sparkle",
+                     player_ids[2], "Applejack")]
+        self.assertEqual(export.export_pairings(output, pairings), 1)
+        with self.assertRaises(ValueError):
+            export.export_pairings(output, pairings, format='xml')
+        print "* Standings and match history are streamed and exported."
+
+    def test_session_shares_connection(self):
+        """Test queries in a session share one pooled connection."""
+        with tournament.session() as connection:
+            player_id = tournament.register_player("Twilight Sparkle")
+            with tournament.session() as nested:
+                self.assertIs(nested, connection)
+                self.assertEqual(tournament.count_players(), 1)
+
+        # The connection is returned to the pool and reused
+        with tournament.session() as reused:
+            self.assertIs(reused, connection)
+        self.assertEqual(tournament.player_standings()[0][0], player_id)
+        print "* Queries in a session share a pooled connection."
+
+    def test_session_rolls_back_on_error(self):
+        """Test a failed session leaves no partial writes behind."""
+        with self.assertRaises(ValueError):
+            with tournament.session():
+                tournament.register_player("Fluttershy")
+                tournament.run_query("SELECT 1;", query_type='COPY')
+
+        self.assertEqual(tournament.count_players(), 0)
+        print "* A failed session is rolled back."
+
+    def test_pool_replaces_closed_connection(self):
+        """Test the pool discards connections that have gone away."""
+        with tournament.session() as connection:
+            pass
+        connection.close()
+
+        self.assertEqual(tournament.count_players(), 0)
+        with tournament.session() as replacement:
+            self.assertIsNot(replacement, connection)
+        self.assertEqual(tournament.get_pool().size, 1)
+        print "* Closed pooled connections are replaced."
+
+    def test_standings_cache(self):
+        """Test standings are served from cache until results change."""
+        tournament_id = tournament.register_tournament(
+            "Test Cache Tournament", 2)
+        player1_id = tournament.register_player("Twilight Sparkle")
+        player2_id = tournament.register_player("Fluttershy")
+        tournament.register_player_in_tournament(player1_id, tournament_id)
+        tournament.register_player_in_tournament(player2_id, tournament_id)
+
+        stats = tournament.cache.stats()
+        standings = tournament.player_standings_by_tournament(tournament_id)
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament_id),
+            standings)
+        self.assertEqual(tournament.cache.stats()['hits'], stats['hits'] + 1)
+        self.assertEqual(
+            tournament.cache.stats()['misses'], stats['misses'] + 1)
+
+        version = tournament.cache.version(tournament_id)
+        tournament.report_match(player1_id, player2_id, tournament_id)
+        self.assertNotEqual(tournament.cache.version(tournament_id), version)
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament_id),
+            [(player1_id, "Twilight Sparkle", 1, 1),
+             (player2_id, "Fluttershy", 0, 1)])
+
+        # Results written in a session are not cached before they commit
+        with tournament.session():
+            tournament.report_match(player2_id, player1_id, tournament_id)
+            tournament.player_standings_by_tournament(tournament_id)
+            self.assertEqual(tournament.cache.stats()['tournaments'], 0)
+        print "* Standings are cached until results change."
+
+    def test_cache_sees_other_writers(self):
+        """Test results written without this process's cache are seen."""
+        if self.backend == 'memory':
+            self.skipTest("Only this process writes to the memory backend.")
+        tournament.configure(validate_cache=True)
+        tournament_id = tournament.register_tournament(
+            "Test Shared Tournament", 4)
+        player_ids = tournament.register_players(
+            ["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+        tournament.enroll_players(tournament_id, player_ids)
+        self.assertEqual(
+            [matches for _, _, _, matches in
+             tournament.ranked_standings(tournament_id)], [0, 0, 0, 0])
+        tournament.load_tournament_state(tournament_id)
+
+        # Run the statements as another process would, bypassing invalidate
+        for winner, loser in ((0, 1), (2, 3)):
+            tournament.run_query(
+                queries.REPORT_MATCH, query_args=queries.report_match_args(
+                    player_ids[winner], player_ids[loser], tournament_id))
+        self.assertEqual(
+            [matches for _, _, _, matches in
+             tournament.ranked_standings(tournament_id)], [1, 1, 1, 1])
+        for id1, _, id2, _ in tournament.swiss_pairings(tournament_id):
+            self.assertNotIn(
+                set([id1, id2]),
+                [set(player_ids[:2]), set(player_ids[2:])])
+
+        late_id = tournament.register_player("Rarity")
+        tournament.run_query(
+            queries.ENROLL_PLAYERS,
+            query_args={'tournament': tournament_id, 'players': [late_id]},
+            query_type='INSERT')
+        self.assertEqual(
+            len(tournament.ranked_standings(tournament_id)), 5)
+        print "* Cached results are checked against other writers."
+
+    def test_standings_cache_eviction(self):
+        """Test the cache evicts least recently used tournaments."""
+        cache = StandingsCache(max_tournaments=2)
+        for tournament_id in (1, 2, 1, 3):
+            cache.get(tournament_id, 'standings', lambda: [tournament_id])
+        self.assertEqual(cache.get(1, 'standings', list), [1])
+        self.assertEqual(cache.get(2, 'standings', list), [])
+        self.assertEqual(cache.evictions, 2)
+
+        cache = StandingsCache(max_bytes=0)
+        cache.get(1, 'standings', lambda: [1])
+        self.assertEqual(cache.stats()['tournaments'], 0)
+        print "* The cache evicts least recently used tournaments."
+
+    def test_standings_cache_versions(self):
+        """Test versions are only kept for tournaments cached or loading."""
+        cache = StandingsCache(max_tournaments=2)
+        versions = []
+        for tournament_id in range(100):
+            cache.get(tournament_id, 'standings', lambda: [tournament_id])
+            versions.append(cache.version(tournament_id))
+            cache.invalidate(tournament_id + 50)
+            # A failed load leaves no version behind either
+            with self.assertRaises(ValueError):
+                cache.get(tournament_id, 'omw', lambda: int("omw"))
+        self.assertEqual(cache.stats()['versions'], 2)
+        self.assertEqual(versions, sorted(versions))
+
+        # A value invalidated while it loads is not stored, even once the
+        # tournament's version has been dropped
+        found, _, version = cache.lookup(7, 'standings')
+        cache.invalidate(7)
+        self.assertGreater(cache.version(7), version[0])
+        cache.store(7, 'standings', [7], version)
+        self.assertEqual(cache.get(7, 'standings', lambda: [8]), [8])
+        self.assertEqual(cache.stats()['versions'], 2)
+        print "* The cache keeps versions of cached tournaments only."
+
+    def test_matching_pairs_everyone(self):
+        """Test the matching engine pairs players greedy pairing drops."""
+        entrants = [
+            (1, "Twilight Sparkle", 2, 2, False),
+            (2, "Fluttershy", 2, 2, False),
+            (3, "Applejack", 1, 2, False),
+            (4, "Pinkie Pie", 1, 2, False)]
+        state = TournamentState(None, entrants, [(3, 4)])
+
+        # Greedy pairs the leaders and strands the two who already met
+        pairs, bye = pair_greedy(state)
+        self.assertEqual(state.pairings(pairs), [
+            (1, "Twilight Sparkle", 2, "Fluttershy")])
+
+        pairs, bye = pair_by_matching(state)
+        self.assertEqual(len(pairs), 2)
+        self.assertIsNone(bye)
+        for i, j in pairs:
+            self.assertFalse(state.have_played(i, j))
+
+        state = TournamentState(None, entrants[:2], [(1, 2)])
+        with self.assertRaises(ValueError):
+            pair_by_matching(state)
+        print "* Matching pairs every player without a rematch."
+
+    def test_matching_warm_start_odd_field(self):
+        """Test an odd field's bye does not outweigh the best pairs."""
+        rng = random.Random(0)
+        states = {}
+        for players in (200, 201):
+            state = states[players] = TournamentState(None, [
+                (player, "Player %d" % player, 0, 0, False)
+                for player in range(1, players + 1)], [])
+            for _ in range(4):
+                pairs, bye = pair_by_matching(state)
+                for i, j in pairs:
+                    if rng.random() < 0.5:
+                        i, j = j, i
+                    state.record_result(state.ids[i], state.ids[j])
+                if bye is not None:
+                    state.record_result(state.ids[bye])
+
+        # The search starts by matching every edge of the heaviest weight
+        heaviest = {}
+        max_weight_matching = pairing.max_weight_matching
+
+        def capture(vertices, edges, maxcardinality=False):
+            top = max(weight for _, _, weight in edges)
+            heaviest[vertices] = sum(
+                1 for _, _, weight in edges if weight == top)
+            return max_weight_matching(vertices, edges, maxcardinality)
+
+        pairing.max_weight_matching = capture
+        try:
+            pairs, bye = pair_by_matching(states[201])
+            pair_by_matching(states[200])
+        finally:
+            pairing.max_weight_matching = max_weight_matching
+
+        self.assertGreaterEqual(heaviest[202], heaviest[200])
+        self.assertEqual(len(pairs), 100)
+        self.assertFalse(states[201].byes[bye])
+        for i, j in pairs:
+            self.assertFalse(states[201].have_played(i, j))
+        print "* Odd fields start matching from the best pairs."
+
+    def test_brackets_float_and_backtrack(self):
+        """Test bracket pairing swaps before it floats players down."""
+        entrants = [
+            (1, "Twilight Sparkle", 2, 2, False),
+            (2, "Fluttershy", 2, 2, False),
+            (3, "Applejack", 2, 2, False),
+            (4, "Pinkie Pie", 2, 2, False),
+            (5, "Rarity", 1, 2, False),
+            (6, "Brandy Ruby", 1, 2, False),
+            (7, "Spike", 0, 2, False)]
+        # Applejack and Pinkie Pie would be stranded by plain greedy
+        state = TournamentState(
+            None, entrants, [(1, 5), (1, 6), (2, 5), (2, 6), (3, 4)])
+        pairs, bye = pair_by_brackets(state)
+        self.assertEqual(state.ids[bye], 7)
+        self.assertEqual(
+            set(frozenset(state.ids[k] for k in pair) for pair in pairs),
+            set([frozenset([1, 3]), frozenset([2, 4]), frozenset([5, 6])]))
+
+        # An odd bracket floats its lowest player to the next one down
+        entrants[4] = (5, "Rarity", 2, 2, False)
+        state = TournamentState(None, entrants, [(3, 4)])
+        pairs, bye = pair_by_brackets(state)
+        self.assertEqual(state.pairings(pairs)[-1][::2], (5, 6))
+        print "* Bracket pairing swaps, then floats leftovers down."
+
+    def test_engines_over_many_rounds(self):
+        """Test engines never rematch or repeat a bye over an event."""
+        for engine in ('matching', 'brackets'):
+            entrants = [
+                [player, "Player %d" % player, 0, 0, False]
+                for player in range(1, 22)]
+            history = []
+            for _ in range(6):
+                state = TournamentState(None, entrants, history)
+                pairs, bye = ENGINES[engine](state)
+
+                paired = set([bye])
+                for i, j in pairs:
+                    self.assertFalse(state.have_played(i, j))
+                    paired.update((i, j))
+                    history.append((state.ids[i], state.ids[j]))
+                    entrants[min(i, j)][2] += 1
+                self.assertEqual(paired, set(range(len(entrants))))
+
+                self.assertFalse(entrants[bye][4])
+                entrants[bye][2] += 1
+                entrants[bye][4] = True
+        print "* Engines pair a whole event without rematches."
+
+    def test_pairing_engines(self):
+        """Test swiss_pairings can be run with either engine."""
+        tournament_id = tournament.register_tournament(
+            "Test Engines Tournament", 4)
+        player_names = (
+            "Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie")
+        for player_name in player_names:
+            tournament.register_player_in_tournament(
+                tournament.register_player(player_name), tournament_id)
+
+        for engine in ('greedy', 'matching', 'brackets', 'database'):
+            pairings = tournament.swiss_pairings(tournament_id, engine=engine)
+            self.assertEqual(len(pairings), 2)
+        with self.assertRaises(ValueError):
+            tournament.swiss_pairings(tournament_id, engine='lottery')
+        print "* Pairing engines can be selected."
+
+
+class TestTournamentSQLite(TestTournament):
+
+    """Functional tests for tournament.py on an in-memory SQLite database."""
+
+    backend = 'sqlite'
+
+
+class TestTournamentMemory(TestTournament):
+
+    """Functional tests for tournament.py on the memory backend."""
+
+    backend = 'memory'
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Functional testing of tournament_async.py using a tournament database.
+Requires Python 3.7+, aiopg and psql; the tests are skipped without them.
+The module itself parses on Python 2, so test discovery can import it.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+
+import tournament
+
+tournament_async = None
+if sys.version_info >= (3, 7):
+    try:
+        import asyncio
+        import tournament_async
+    except ImportError:
+        # aiopg is optional; these tests are skipped without it
+        pass
+
+SQL_FILE_PATH = os.path.realpath(
+    os.path.join(
+        os.path.abspath(__file__),
+        os.pardir, os.pardir, os.pardir,
+        os.pardir, 'tournament.sql'))
+
+
+def run(*coroutines):
+    """Run coroutines together on a new event loop, closing the pool after.
+    :returns: the result of a single coroutine, or a list of the results
+        of several
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(asyncio.gather(*coroutines))
+    finally:
+        loop.run_until_complete(tournament_async.close())
+        asyncio.set_event_loop(None)
+        loop.close()
+    return results[0] if len(coroutines) == 1 else results
+
+
+class TestTournamentAsync(unittest.TestCase):
+
+    """Functional tests for tournament_async.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Check the asyncio API and psql are available."""
+        if tournament_async is None:
+            raise unittest.SkipTest(
+                "The asyncio API needs Python 3.7+ and aiopg.")
+        if shutil.which('psql') is None:
+            raise unittest.SkipTest("psql is not installed.")
+
+    def setUp(self):
+        """Create a fresh tournament database."""
+        try:
+            subprocess.check_call(
+                ['psql', '-f', SQL_FILE_PATH],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as error:
+            raise RuntimeError(
+                "SQL file %s could not be executed: %s" % (
+                    SQL_FILE_PATH, error))
+
+    def tearDown(self):
+        """Destroy the tournament database."""
+        # Pooled connections would otherwise block the DROP
+        tournament.disconnect()
+        try:
+            # DROP cannot run in a transaction block, so use psql
+            subprocess.check_call(
+                ['psql', '-c', "DROP DATABASE tournament;"],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as error:
+            raise RuntimeError(
+                "The tournament database could not be dropped: %s" % (error))
+
+    def test_register_and_report(self):
+        """Test players can be registered and matches reported."""
+        tournament_id = run(
+            tournament_async.register_tournament("Test Async", 2))
+        player1_id, player2_id = run(
+            tournament_async.register_player("Twilight Sparkle"),
+            tournament_async.register_player("Fluttershy"))
+        run(tournament_async.register_player_in_tournament(
+                player1_id, tournament_id),
+            tournament_async.register_player_in_tournament(
+                player2_id, tournament_id))
+        run(tournament_async.report_match(
+            player1_id, player2_id, tournament_id))
+        standings = run(
+            tournament_async.player_standings_by_tournament(tournament_id))
+        self.assertEqual(standings, [
+            (player1_id, "Twilight Sparkle", 1, 1),
+            (player2_id, "Fluttershy", 0, 1)])
+        self.assertEqual(
+            tournament.player_standings_by_tournament(tournament_id),
+            standings)
+        self.assertEqual(run(tournament_async.count_players()), 2)
+        print("* Async players are registered and matches reported.")
+
+    def test_players_opponents(self):
+        """Test opponents of several players are fetched together."""
+        tournament_id = tournament.register_tournament("Test Opponents", 4)
+        player_ids = []
+        for name in ("Twilight Sparkle", "Fluttershy", "Applejack",
+                     "Pinkie Pie"):
+            player_id = tournament.register_player(name)
+            tournament.register_player_in_tournament(
+                player_id, tournament_id)
+            player_ids.append(player_id)
+        tournament.report_matches(tournament_id, [
+            (player_ids[0], player_ids[1]), (player_ids[2], player_ids[3])])
+
+        opponents = run(tournament_async.players_opponents(
+            player_ids, tournament_id))
+        self.assertEqual(opponents, {
+            player_ids[0]: [player_ids[1]], player_ids[1]: [player_ids[0]],
+            player_ids[2]: [player_ids[3]], player_ids[3]: [player_ids[2]]})
+        self.assertEqual(run(tournament_async.player_opponents_match_wins(
+            player_ids[1], tournament_id)), 1)
+        print("* Opponents of several players are fetched concurrently.")
+
+    def test_swiss_pairings(self):
+        """Test async pairing matches the sync API and reports the bye."""
+        tournament_id = tournament.register_tournament("Test Pairings", 5)
+        player_ids = []
+        for name in ("Twilight Sparkle", "Fluttershy", "Applejack",
+                     "Pinkie Pie", "Rarity"):
+            player_id = tournament.register_player(name)
+            tournament.register_player_in_tournament(
+                player_id, tournament_id)
+            player_ids.append(player_id)
+
+        pairings = run(tournament_async.swiss_pairings(tournament_id))
+        self.assertEqual(len(pairings), 2)
+        paired = set()
+        for id1, _, id2, _ in pairings:
+            paired.update((id1, id2))
+        bye, = set(player_ids) - paired
+        self.assertTrue(tournament.player_has_received_bye(
+            bye, tournament_id))
+
+        with self.assertRaises(ValueError):
+            run(tournament_async.swiss_pairings(tournament_id, 'random'))
+        print("* Async pairing pairs every player and reports the bye.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,274 @@
 """Implementation of a Swiss-system tournament."""
 
-import psycopg2
+import contextlib
+import csv
+import itertools
+import os
+import threading
+import time
+
+import backends
+import eventlog
+import queries
+from cache import StandingsCache
+from metrics import Metrics
+from pairing import ENGINES, TournamentState
+from pool import ConnectionPool
+from queries import BYE, LOSS, POINTS, TIE, WIN
+
+# Connection settings; override with configure() or the environment
+BACKEND = os.environ.get('TOURNAMENT_BACKEND', 'postgresql')
+DSN = os.environ.get('TOURNAMENT_DSN', "dbname=tournament")
+POOL_SIZE = int(os.environ.get('TOURNAMENT_POOL_SIZE', 10))
+CACHE_BYTES = int(os.environ.get('TOURNAMENT_CACHE_BYTES', 64 * 1024 * 1024))
+# Whether cached results are checked against the database before they are
+# served; off, results are served from memory until this process
+# invalidates them, so turn it on when other processes write to the
+# database (the cli.py daemon does)
+CACHE_VALIDATE = os.environ.get('TOURNAMENT_CACHE_VALIDATE', '0') != '0'
+# Rows fetched per round trip by stream_query
+FETCH_SIZE = int(os.environ.get('TOURNAMENT_FETCH_SIZE', 2000))
+
+_backend = None
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+# Standings, OMW, opponents and pairing snapshots per tournament
+cache = StandingsCache(max_bytes=CACHE_BYTES)
+
+# Query counts and latencies per function; off until metrics.enable()
+metrics = Metrics()
+
+# Entrants, results and byes as they are committed; off until opened with
+# configure(event_log=path)
+events = eventlog.EventLog()
+
+
+def get_backend():
+    """Get the storage backend, creating it on first use.
+    :returns: backend for the configured BACKEND and DSN
+    :rtype: backends.Backend
+    """
+    global _backend
 
-WIN = 1
-LOSS = 2
-TIE = 3
-BYE = 4
+    with _pool_lock:
+        if _backend is None:
+            if isinstance(BACKEND, backends.Backend):
+                _backend = BACKEND
+            else:
+                _backend = backends.create(BACKEND, DSN)
+        return _backend
 
 
 def connect():
-    """Connect to the PostgreSQL tournament database.
+    """Connect to the tournament database.
     :returns: tournament database connection
     :rtype: psycopg2.connection
     """
-    return psycopg2.connect("dbname=tournament")
+    connection = get_backend().connect()
+    if metrics.enabled:
+        metrics.record_connection()
+    return connection
+
+
+def configure(dsn=None, pool_size=None, cache_bytes=None, backend=None,
+              fetch_size=None, event_log=None, validate_cache=None):
+    """Configure the tournament database connection.
+    Any existing pool is closed; the next query opens a new one. Setting
+    the backend or DSN replaces the backend, so an SQLite :memory: or memory
+    backend starts empty.
+    :param str dsn: libpq connection string, e.g. "dbname=tournament"
+    :param int pool_size: maximum count of pooled connections
+    :param int cache_bytes: memory cap of the results cache; 0 disables it
+    :param backend: postgresql | sqlite | sqlite:<path> | memory, or a
+        backends.Backend
+    :param int fetch_size: count of rows stream_query fetches at a time
+    :param str event_log: path of an event log to append to; see
+        eventlog.py
+    :param bool validate_cache: whether cached results are checked against
+        the tournament's version in the database before they are served,
+        at the cost of a query per cached read; off by default, so only
+        writes made through this process are seen
+    """
+    global BACKEND, DSN, POOL_SIZE, FETCH_SIZE, CACHE_VALIDATE, _backend
+
+    with _pool_lock:
+        if backend is not None:
+            BACKEND = backend
+            _backend = None
+        if dsn is not None:
+            DSN = dsn
+            _backend = None
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if cache_bytes is not None:
+            cache.max_bytes = cache_bytes
+        if fetch_size is not None:
+            FETCH_SIZE = fetch_size
+        if validate_cache is not None:
+            CACHE_VALIDATE = validate_cache
+    if event_log is not None:
+        events.open(event_log)
+    disconnect()
+
+
+def disconnect():
+    """Close every pooled connection and drop all cached results."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+    cache.invalidate()
+
+
+def get_pool():
+    """Get the shared connection pool, creating it on first use.
+    :returns: connection pool for the configured DSN
+    :rtype: pool.ConnectionPool
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(connect, maxconn=POOL_SIZE)
+        return _pool
+
+
+def warm_up(connections=None):
+    """Open pooled connections and prepare every statement on them.
+    Call at process start so the first requests of the day neither connect
+    nor plan their queries.
+    :param int connections: count of connections to warm up; None fills
+        the pool
+    :returns: count of statements prepared
+    :rtype: int
+    """
+    pool = get_pool()
+    backend = get_backend()
+    count = POOL_SIZE if connections is None else min(connections, POOL_SIZE)
+
+    # Check the connections out together, so each one is a new connection
+    checked_out = []
+    try:
+        for _ in range(count):
+            checked_out.append(pool.getconn())
+        return sum(
+            backend.warm_up(connection) for connection in checked_out)
+    finally:
+        for connection in checked_out:
+            pool.putconn(connection)
+
+
+@contextlib.contextmanager
+def session():
+    """Share one pooled connection and transaction between queries.
+    Every run_query inside the block uses the same connection. The
+    transaction is committed when the outermost session exits and rolled
+    back if it exits with an exception. Sessions are per thread and nest.
+    :returns: pooled database connection
+    :rtype: psycopg2.connection
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        yield connection
+        return
+
+    pool = get_pool()
+    connection = pool.getconn()
+    _local.connection = connection
+    _local.invalidated = set()
+    _local.events = []
+    try:
+        yield connection
+        connection.commit()
+        committed = _local.events
+    finally:
+        _local.connection = None
+        # Returning the connection rolls back anything left uncommitted
+        pool.putconn(connection)
+        # Other threads may have cached results from before the commit
+        for tournament in _local.invalidated:
+            cache.invalidate(tournament)
+        _local.invalidated = set()
+        _local.events = []
+    if committed:
+        # Not ordered with other threads' commits, and lost if the process
+        # dies first: the log can trail the database (see eventlog.py)
+        events.append(committed)
+
+
+def invalidate(tournament=None):
+    """Bump a tournament's version, dropping its cached results.
+    Inside a session the tournament bypasses the cache until the session
+    ends, so uncommitted results are never cached.
+    :param int tournament: id of the tournament; None invalidates all
+    """
+    cache.invalidate(tournament)
+    if getattr(_local, 'connection', None) is not None:
+        _local.invalidated.add(tournament)
+
+
+def log_events(*logged):
+    """Log events once the transaction they belong to has committed.
+    :param logged: eventlog.Event tuples
+    """
+    if not events.enabled:
+        return
+    if getattr(_local, 'connection', None) is not None:
+        _local.events.extend(logged)
+    else:
+        events.append(logged)
+
+
+def _log_entrants(tournament, players):
+    """Log players entering a tournament, with their names."""
+    if not events.enabled or not players:
+        return
+    names = dict(run_query(
+        queries.PLAYER_NAMES, query_args=(list(players),))['result'])
+    log_events(*[
+        eventlog.entered_event(tournament, player, names[player])
+        for player in players if player in names])
+
+
+def cached(tournament, key, load):
+    """Get a tournament's cached result, loading it on a miss.
+    :param int tournament: id of the tournament the result belongs to
+    :param key: key of the result within the tournament
+    :param callable load: function loading the result from the database
+    :returns: cached or freshly loaded result
+    """
+    pending = getattr(_local, 'invalidated', ())
+    if None in pending or tournament in pending:
+        return load()
+    return cache.get(tournament, key, load, _database_version(tournament))
+
+
+def _database_version(tournament):
+    """Get a tournament's version in the database, for the cache.
+    Writes made by other processes bump it too, so results they changed
+    are not served from the cache.
+    :param int tournament: id of the tournament
+    :returns: version; None without validation or if the tournament is
+        missing
+    :rtype: int
+    """
+    if not CACHE_VALIDATE or not cache.max_bytes:
+        return None
+    version = run_query(
+        queries.TOURNAMENT_VERSION, query_args=(tournament,))['result']
+    return version[0][0] if version else None
 
 
 def run_query(query, query_args=(), query_type='SELECT'):
     """Run a query against the tournament database.
     The query result will depend on the query type, although the result will
-    always be contained in a dict or None. The scope of this project is small
-    enough that opening and closing connections per query is acceptable.
+    always be contained in a dict or None. Queries run on a pooled connection;
+    outside of a session() each query is committed on its own. While
+    metrics are enabled the query is counted against the calling functions.
     param str query: query string to run
     param tuple query_args: query args to pass to execute
     param query_type: query type to run (SELECT | UPDATE | DELETE | INSERT)
@@ -28,9 +276,12 @@ def run_query(query, query_args=(), query_type='SELECT'):
     :rtype: dict | None
     """
     query_type = query_type.upper()
+    recording = metrics.enabled
 
-    with connect() as connection:
+    with session() as connection:
         with connection.cursor() as cursor:
+            if recording:
+                start = time.time()
             cursor.execute(query, query_args)
 
             if query_type == 'SELECT':
@@ -39,7 +290,7 @@ def run_query(query, query_args=(), query_type='SELECT'):
                 try:
                     # Requires RETURNING be used
                     result, = cursor.fetchone()
-                except psycopg2.ProgrammingError:
+                except get_backend().ProgrammingError:
                     result = None
             elif query_type in ('UPDATE', 'DELETE', 'INSERT'):
                 result = cursor.rowcount
@@ -47,20 +298,88 @@ def run_query(query, query_args=(), query_type='SELECT'):
                 raise ValueError(
                     "Query type %s is not supported." % query_type)
 
+            if recording:
+                seconds = time.time() - start
+                if query_type == 'SELECT':
+                    rows = len(result)
+                else:
+                    rows = max(cursor.rowcount, 0)
+                metrics.record_query(
+                    query, seconds, rows,
+                    explain=lambda: get_backend().explain(
+                        cursor, query, query_args))
+
     return {'result': result}
 
 
+def stream_query(query, query_args=(), fetch_size=None):
+    """Run a SELECT and yield its rows without holding them all in memory.
+    On PostgreSQL rows are read through a server-side cursor, fetch_size at
+    a time; the SQLite and memory backends hold the result and hand it out
+    in the same batches. The pooled connection, and the session, are held
+    until the generator is exhausted or closed, so other queries this
+    thread runs meanwhile join its transaction.
+    :param str query: query string to run
+    :param tuple query_args: query args to pass to execute
+    :param int fetch_size: count of rows fetched per round trip; None uses
+        FETCH_SIZE
+    :returns: generator of rows
+    """
+    fetch_size = fetch_size or FETCH_SIZE
+    with session() as connection:
+        for row in get_backend().stream(
+                connection, query, query_args, fetch_size):
+            yield row
+
+
+def iter_player_standings(fetch_size=None):
+    """Stream every player's win record, as player_standings returns them.
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: generator of (id, name, wins, matches) tuples
+    """
+    return stream_query(queries.PLAYER_STANDINGS, fetch_size=fetch_size)
+
+
+def iter_standings_by_tournament(tournament, fetch_size=None):
+    """Stream a tournament's standings, by wins and then player id.
+    Unlike player_standings_by_tournament, results are not cached.
+    :param int tournament: id of tournament to get standings for
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: generator of (id, name, wins, matches) tuples
+    """
+    return stream_query(
+        queries.STANDINGS_BY_TOURNAMENT, query_args=(tournament,),
+        fetch_size=fetch_size)
+
+
+def iter_match_history(tournament=None, fetch_size=None):
+    """Stream every match played, one row per player, oldest first.
+    :param int tournament: id of a tournament to limit the history to
+    :param int fetch_size: count of rows fetched per round trip
+    :returns: generator of (match id, tournament id, player id, player name,
+        result name) tuples
+    """
+    if tournament is None:
+        return stream_query(queries.MATCH_HISTORY, fetch_size=fetch_size)
+    return stream_query(
+        queries.MATCH_HISTORY_BY_TOURNAMENT, query_args=(tournament,),
+        fetch_size=fetch_size)
+
+
+@metrics.instrument
 def delete_all_from_table(table):
     """Delete all rows from a table.
     :param str table: name of the table to delete all rows from
     :returns: count of rows deleted
     :rtype: int
     """
-    query = "DELETE FROM %s;" % table
+    query = queries.DELETE_ALL % table
     deleted = run_query(query, query_type='DELETE')
+    invalidate()
     return deleted['result']
 
 
+@metrics.instrument
 def delete_matches():
     """Delete all the match records from the database.
     :returns: count of rows deleted from match table
@@ -69,6 +388,7 @@ def delete_matches():
     return delete_all_from_table('match')
 
 
+@metrics.instrument
 def delete_players():
     """Delete all the player records from the database.
     :returns: count of rows deleted from player table
@@ -77,27 +397,29 @@ def delete_players():
     return delete_all_from_table('player')
 
 
+@metrics.instrument
 def count_players():
     """Count of all players currently registered.
     :returns: count of all registered players
     :rtype: int
     """
-    query = "SELECT count(id) FROM player;"
-    players = run_query(query)
+    players = run_query(queries.COUNT_PLAYERS)
     return players['result'][0][0]
 
 
+@metrics.instrument
 def register_player(name):
     """Add a player to the tournament database.
     :param str name: name of player to register
     :returns: id of the registered player
     :rtype: int
     """
-    query = "INSERT INTO player (name) VALUES (%s) RETURNING id;"
-    inserted = run_query(query, query_args=(name,), query_type='INSERT')
+    inserted = run_query(
+        queries.REGISTER_PLAYER, query_args=(name,), query_type='INSERT')
     return inserted['result']
 
 
+@metrics.instrument
 def register_tournament(name, players):
     """Add a tournament to the tournament database.
     :param str name: name of tournament to register
@@ -105,14 +427,13 @@ def register_tournament(name, players):
     :returns: id of the registered tournament
     :rtype: int
     """
-    query = ("INSERT INTO tournament (name, players) "
-             "VALUES (%s, %s) "
-             "RETURNING id;")
     inserted = run_query(
-        query, query_args=(name, players), query_type='INSERT')
+        queries.REGISTER_TOURNAMENT, query_args=(name, players),
+        query_type='INSERT')
     return inserted['result']
 
 
+@metrics.instrument
 def register_player_in_tournament(player, tournament):
     """Register a player in a tournament as an entrant.
     :param int player: id of the player to register
@@ -120,27 +441,121 @@ def register_player_in_tournament(player, tournament):
     :returns: rowcount of the player inserted, 0 | 1
     :rtype: int
     """
-    query = ("INSERT INTO entrant (player_id, tournament_id) "
-             "VALUES (%s, %s);")
-    inserted = run_query(
-        query, query_args=(player, tournament), query_type='INSERT')
+    with session():
+        inserted = run_query(
+            queries.REGISTER_ENTRANT, query_args=(player, tournament),
+            query_type='INSERT')
+        invalidate(tournament)
+        if inserted['result']:
+            _log_entrants(tournament, [player])
     return inserted['result']
 
 
+@metrics.instrument
+def register_players(names, by_name=False):
+    """Add many players to the tournament database in one statement.
+    Every name is registered as a new player unless by_name is set: then
+    a name that is already registered, or repeated in names, gets the id of
+    its first registration, so an interrupted check-in can simply be run
+    again. Only use by_name when no two players share a name.
+    :param iterable names: names of the players to register
+    :param bool by_name: reuse the ids of names already registered
+    :returns: ids of the players, in input order
+    :rtype: list
+    """
+    names = list(names)
+    if not names:
+        return []
+
+    query = queries.REGISTER_PLAYERS_BY_NAME if by_name else (
+        queries.REGISTER_PLAYERS)
+    registered = run_query(query, query_args={'names': names})
+    return [row[0] for row in registered['result']]
+
+
+@metrics.instrument
+def enroll_players(tournament, players):
+    """Register many players in a tournament in one statement.
+    Players that are already entrants, or repeated in players, are skipped.
+    :param int tournament: id of the tournament to register players in
+    :param iterable players: ids of the players to register
+    :returns: count of players newly registered in the tournament
+    :rtype: int
+    """
+    players = list(players)
+    if not players:
+        return 0
+
+    with session():
+        enrolled = run_query(
+            queries.ENROLL_PLAYERS,
+            query_args={'tournament': tournament, 'players': players},
+            query_type='INSERT')
+        invalidate(tournament)
+        # Players already entered are logged again; replaying skips them
+        _log_entrants(tournament, sorted(set(players)))
+    return enrolled['result']
+
+
+@metrics.instrument
+def import_players_csv(csv_file, tournament=None, batch_size=1000,
+                       by_name=False):
+    """Register the players listed in a CSV file.
+    The file needs a header row with a name column; other columns are
+    ignored. Rows are read and registered batch_size at a time, so a file
+    of any size is never held in memory. The whole file is imported in one
+    transaction: a failed import registers none of its players.
+    :param csv_file: path or open file of the CSV
+    :param int tournament: id of a tournament to also register the players
+        in
+    :param int batch_size: count of rows registered per statement
+    :param bool by_name: reuse the ids of names already registered, as
+        register_players does, so the file can be imported again
+    :returns: count of rows imported
+    :rtype: int
+    :raises ValueError: if the file has no name column
+    """
+    opened = not hasattr(csv_file, 'read')
+    if opened:
+        csv_file = open(csv_file)
+
+    try:
+        reader = csv.DictReader(csv_file)
+        if 'name' not in (reader.fieldnames or ()):
+            raise ValueError("CSV file has no name column.")
+
+        names = (row['name'] for row in reader)
+        imported = 0
+        with session():
+            while True:
+                batch = list(itertools.islice(names, batch_size))
+                if not batch:
+                    break
+                player_ids = register_players(batch, by_name)
+                if tournament is not None:
+                    enroll_players(tournament, player_ids)
+                imported += len(batch)
+        return imported
+    finally:
+        if opened:
+            csv_file.close()
+
+
+@metrics.instrument
 def player_standings():
     """Get a list of the players and their win records, sorted by wins.
+    Lifetime records add up the player's tournaments, so reporting a result
+    never writes to the player's row.
     :returns: list of players and win records
     :rtype: list
     Return format:
         [(15, 'Bruno Walton', 2, 0), (16, "Boots O'Neal", 1, 0), ...]
     """
-    query = ("SELECT id, name, wins, matches "
-             "FROM player "
-             "ORDER BY wins DESC;")
-    standings = run_query(query)
+    standings = run_query(queries.PLAYER_STANDINGS)
     return standings['result']
 
 
+@metrics.instrument
 def player_opponents(player, tournament):
     """Get a list of the played opponents for a player in a tournament.
     :param int player: id of the player to get played opponents for
@@ -148,62 +563,86 @@ def player_opponents(player, tournament):
     :returns: list of opponents that specified player has played
     :rtype: list
     """
-    subquery = ("(SELECT id "
-                "FROM match "
-                "WHERE player_id = %s "
-                "AND tournament_id = %s)")
-    query = ("SELECT player_id "
-             "FROM match "
-             "WHERE id IN (%s) "
-             "AND player_id != %s;") % (subquery, '%s')
-    opponents = run_query(
-        query, query_args=(player, tournament, player))
-    return [result[0] for result in opponents['result']]
+    def load():
+        opponents = run_query(
+            queries.PLAYER_OPPONENTS,
+            query_args=(player, tournament, player))
+        return [result[0] for result in opponents['result']]
 
+    return list(cached(tournament, ('opponents', player), load))
 
+
+@metrics.instrument
 def player_opponents_match_wins(player, tournament):
-    """Get a sum of the played opponents match wins.
+    """Get a sum of the played opponents match wins in a tournament.
     :param int player: id of the player
     :param int tournament: id of the tournament
     :returns: sum of opponent wins for a specified player
     :rtype: int
     """
-    opponents = player_opponents(player, tournament)
+    opponents_match_wins = run_query(
+        queries.PLAYER_OPPONENTS_MATCH_WINS,
+        query_args=(player, tournament))['result']
 
-    opponents_count = len(opponents)
-    if opponents_count == 0:
-        return 0
-    elif opponents_count == 1:
-        placeholder = "%s"
-    else:
-        placeholder = ("%s, " * opponents_count)[:-2]
+    return opponents_match_wins[0][0] if opponents_match_wins else 0
 
-    query = ("SELECT sum(wins) "
-             "FROM player "
-             "WHERE id IN (%s);") % placeholder
-    opponents_match_wins = run_query(
-        query, query_args=([o for o in opponents]))
 
-    return opponents_match_wins['result'][0][0]
+@metrics.instrument
+def opponents_match_wins(tournament):
+    """Get the sum of played opponents match wins for every entrant.
+    Opponent match wins are kept up to date as results are reported, so
+    this reads one row per entrant.
+    :param int tournament: id of the tournament
+    :returns: opponent match wins keyed by player id; 0 for players
+        without opponents
+    :rtype: dict
+    """
+    def load():
+        omw = run_query(
+            queries.OPPONENTS_MATCH_WINS, query_args=(tournament,))
+        return dict(omw['result'])
 
+    return dict(cached(tournament, 'omw', load))
 
+
+@metrics.instrument
+def opponents_match_win_percentages(tournament):
+    """Get the opponents match-win percentage of every entrant.
+    A player's match-win percentage is their points over three points a
+    match, floored at a third; their opponents match-win percentage is the
+    mean of their opponents' percentages.
+    :param int tournament: id of the tournament
+    :returns: opponents match-win percentage keyed by player id; 0.0 for
+        players without opponents
+    :rtype: dict
+    """
+    def load():
+        omwp = run_query(
+            queries.OPPONENTS_MATCH_WIN_PERCENTAGES, query_args=(tournament,))
+        return dict(omwp['result'])
+
+    return dict(cached(tournament, 'omwp', load))
+
+
+@metrics.instrument
 def player_standings_by_tournament(tournament):
     """Get a list of the players and their win records by tournament.
+    Records only count matches played in the tournament.
     :param int tournament: id of tournament to get standings for
     :returns: list of players and win records
     :rtype: list
     Return format:
         [(15, 'Bruno Walton', 2, 0), (16, "Boots O'Neal", 1, 0), ...]
     """
-    query = ("SELECT id, name, wins, matches "
-             "FROM player p, entrant e "
-             "WHERE p.id = e.player_id "
-             "AND tournament_id = %s "
-             "ORDER BY wins DESC;")
-    standings = run_query(query, query_args=(tournament,))
-    return standings['result']
+    def load():
+        standings = run_query(
+            queries.STANDINGS_BY_TOURNAMENT, query_args=(tournament,))
+        return standings['result']
+
+    return list(cached(tournament, 'standings', load))
 
 
+@metrics.instrument
 def player_has_received_bye(player, tournament):
     """Get whether or not a player has received a bye for a tournament.
     :param int player: id of the player to check
@@ -211,183 +650,284 @@ def player_has_received_bye(player, tournament):
     :returns: whether a player received a bye in a tournament; True | False
     :rtype: boolean
     """
-    query = ("SELECT bye "
-             "FROM entrant "
-             "WHERE player_id = %s "
-             "AND tournament_id = %s;")
-    bye = run_query(query, query_args=(player, tournament,))
+    bye = run_query(
+        queries.HAS_RECEIVED_BYE, query_args=(player, tournament))
 
     return bye['result'][0][0]
 
 
+@metrics.instrument
 def update_match_wins(player):
     """Update match wins in standings for a player.
     :param int player: id of the winning player
     :returns: count of the rows updated; 0 | 1
     :rtype: int
     """
-    query = ("UPDATE player "
-             "SET wins = wins + 1 "
-             "WHERE id = %s;")
-    updated = run_query(query, query_args=(player,), query_type='UPDATE')
+    updated = run_query(
+        queries.UPDATE_MATCH_WINS, query_args=(player,), query_type='UPDATE')
     return updated['result']
 
 
+@metrics.instrument
 def update_matches_played(players):
     """Update matches played in standings for a player or players.
     :param list players: id of the winning player(s)
     :returns: count of the row(s) updated
     :rtype: int
     """
-    players_count = len(players)
-    if players_count == 1:
-        placeholder = "%s"
-    else:
-        placeholder = ("%s, " * players_count)[:-2]
-
-    query = ("UPDATE player "
-             "SET matches = matches + 1 "
-             "WHERE id IN (%s);") % placeholder
     updated = run_query(
-        query, query_args=tuple(p for p in players), query_type='UPDATE')
+        queries.UPDATE_MATCHES_PLAYED, query_args=(list(players),),
+        query_type='UPDATE')
 
     return updated['result']
 
 
-def report_match(winner, loser, tournament, tie=False):
+@metrics.instrument
+def report_match(winner, loser, tournament, tie=False, key=None):
     """Report the outcome of a single match between two players.
     Both win-lose and tie matches are reported by report_match. In the event
-    of a tie both players are considered winners.
+    of a tie both players are considered winners. The match rows and
+    standings are written in a single statement, so a failed report leaves
+    nothing behind and can simply be retried. Reports to one tournament are
+    written one at a time, however many judges submit them at once.
+    A result submitted with a key already reported in the tournament is not
+    reported again, so a resubmission is safe.
     :param int winner: id of the winner
     :param int loser: id of the loser
     :param int tournament: id of the tournament the match was played in
     :param bool tie: whether match was a tie; True | False
-    :returns: id of the reported match
+    :param str key: idempotency key of the result, e.g. the round and table
+    :returns: id of the reported match, or of the match first reported
+        under key
     :rtype: int
+    :raises ValueError: if the tournament does not exist
     """
-    # Add winner or tie
-    result_type = TIE if tie else WIN
-    query = ("INSERT INTO match "
-             "(player_id, tournament_id, result_id) "
-             "VALUES (%s, %s, %s) "
-             "RETURNING id;")
-    inserted = run_query(
-        query,
-        query_args=(winner, tournament, result_type), query_type='INSERT')
-
-    match_id = inserted['result']
-
-    # Add loser or tie
-    result_type = TIE if tie else LOSS
-    query = ("INSERT INTO match "
-             "(id, player_id, tournament_id, result_id) "
-             "VALUES (%s, %s, %s, %s);")
-    run_query(
-        query,
-        query_args=(match_id, loser, tournament, result_type),
-        query_type='INSERT')
-
-    # Update matches played and wins
-    update_matches_played([winner, loser])
-    update_match_wins(winner)
-
-    # Ties count as wins
-    if tie:
-        update_match_wins(loser)
-
-    return match_id
-
-
+    reported = run_query(
+        queries.REPORT_MATCH,
+        query_args=queries.report_match_args(
+            winner, loser, tournament, tie, key))['result']
+    if reported:
+        invalidate(tournament)
+        log_events(eventlog.result_event(
+            tournament, reported[0][0], winner, loser, tie))
+    elif key is not None:
+        reported = run_query(
+            queries.SUBMITTED_MATCH, query_args=(tournament, key))['result']
+    if not reported:
+        raise ValueError("Tournament %s does not exist." % tournament)
+
+    return reported[0][0]
+
+
+@metrics.instrument
 def report_match_bye(player, tournament):
     """Report a bye for a player in a tournament.
+    The bye flag, bye match and standings are written in one statement.
     :param int player: id of the player to report a bye for
     :param int tournament: id of the tournament to report the bye in
     :returns: rowcount of the player updated; 0 | 1
     :rtype: int
     """
-    query = ("UPDATE entrant "
-             "SET bye = TRUE "
-             "WHERE player_id = %s "
-             "AND tournament_id = %s;")
     updated = run_query(
-        query, query_args=(player, tournament), query_type='UPDATE')
-
-    # Add bye match to match table
-    query = ("INSERT INTO match "
-             "(player_id, tournament_id, result_id) "
-             "VALUES (%s, %s, %s);")
-    run_query(
-        query, query_args=(player, tournament, BYE), query_type='INSERT')
-
-    # Update matches played and wins
-    update_matches_played([player])
-    update_match_wins(player)
+        queries.REPORT_MATCH_BYE,
+        query_args=queries.report_match_bye_args(player, tournament),
+        query_type='UPDATE')
+    invalidate(tournament)
+    if updated['result']:
+        log_events(eventlog.bye_event(tournament, player))
 
     return updated['result']
 
 
+@metrics.instrument
+def report_matches(tournament, results, byes=()):
+    """Report every result of a round in one statement.
+    All match rows are inserted and all standings updated in a single
+    transaction, so either the whole round is recorded or none of it is.
+    :param int tournament: id of the tournament the round was played in
+    :param iterable results: (winner, loser, tie) tuples; tie is optional
+        and defaults to False
+    :param iterable byes: ids of the players receiving a bye this round
+    :returns: ids of the reported matches, results first and then byes, in
+        input order
+    :rtype: list
+    :raises ValueError: if the tournament does not exist
+    """
+    query_args = queries.report_matches_args(tournament, results, byes)
+    if query_args is None:
+        return []
+
+    reported = run_query(queries.REPORT_MATCHES, query_args=query_args)
+    if not reported['result']:
+        raise ValueError("Tournament %s does not exist." % tournament)
+    invalidate(tournament)
+    match_ids = [row[0] for row in reported['result']]
+
+    if events.enabled:
+        log_events(*[
+            eventlog.result_event(tournament, match_id, winner, loser, tie)
+            if loser is not None else eventlog.bye_event(tournament, winner)
+            for match_id, winner, loser, tie in zip(
+                match_ids, query_args['winners'], query_args['losers'],
+                query_args['ties'])])
+    return match_ids
+
+
+@metrics.instrument
+def reconcile_player_records(repair=False):
+    """Check every player's lifetime record against their match rows.
+    Records drift when matches are deleted, or written by update_match_wins
+    and update_matches_played, which count results outside any tournament.
+    Corrections are recorded on the player's row. Both sides are
+    counted in one query however many players there are.
+    :param bool repair: whether to correct the records that disagree
+    :returns: (id, wins, matches, wins in match, matches in match) tuples
+        of the players whose records disagree, as found before any repair
+    :rtype: list
+    """
+    with session():
+        drift = run_query(
+            queries.PLAYER_RECORD_DRIFT, query_args=(LOSS,))['result']
+        if repair and drift:
+            run_query(
+                queries.REPAIR_PLAYER_RECORDS, query_args={
+                    'players': [row[0] for row in drift],
+                    'wins': [row[3] - row[1] for row in drift],
+                    'matches': [row[4] - row[2] for row in drift]},
+                query_type='UPDATE')
+    return drift
+
+
+@metrics.instrument
 def rank_by_opponent_match_wins(standings, tournament):
     """Rank like players using opponent match wins.
     Players that have equal match wins should be ranked according to the
     strength of the opponents beaten.
+    Remaining ties are broken by player id so the ranking is deterministic.
     :param list standings: standings for a tournament
-    :param int tournament: standings for a tournament
-    :returns: standings sorted by opponent match wins
+    :param int tournament: id of the tournament
+    :returns: standings sorted by match wins, then opponent match wins
     :rtype: list
+    :see: ranked_standings to rank every entrant in the database
     """
-    def omw_sort(player1, player2):
-        if player1[2] == player2[2]:
-            player1_omw = player_opponents_match_wins(player1[0], tournament)
-            player2_omw = player_opponents_match_wins(player2[0], tournament)
-            if player1_omw > player2_omw:
-                return -1
-        return 1
+    omw = opponents_match_wins(tournament)
 
-    return sorted(standings, cmp=omw_sort)
+    def omw_key(standing):
+        player, _, wins = standing[:3]
+        return -wins, -omw.get(player, 0), player
 
+    return sorted(standings, key=omw_key)
 
-def swiss_pairings(tournament):
+
+@metrics.instrument
+def ranked_standings(tournament):
+    """Get a tournament's standings ranked by wins and opponent match wins.
+    Ranks like rank_by_opponent_match_wins, as one indexed query.
+    :param int tournament: id of the tournament
+    :returns: list of players and win records, highest ranked first
+    :rtype: list
+    """
+    def load():
+        standings = run_query(
+            queries.RANKED_STANDINGS, query_args=(tournament,))
+        return standings['result']
+
+    return list(cached(tournament, 'ranked', load))
+
+
+@metrics.instrument
+def load_tournament_state(tournament):
+    """Load a tournament's entrants and match history into memory.
+    The snapshot is cached and shared, so it must not be modified.
+    :param int tournament: id of the tournament to load
+    :returns: snapshot of the tournament for ranking and pairing
+    :rtype: pairing.TournamentState
+    """
+    def load():
+        with session():
+            entrants = run_query(
+                queries.STATE_ENTRANTS, query_args=(tournament,))
+            opponents = run_query(
+                queries.STATE_OPPONENTS, query_args=(tournament,))
+        return TournamentState(
+            tournament, entrants['result'], opponents['result'])
+
+    return cached(tournament, 'state', load)
+
+
+@metrics.instrument
+def lock_tournament(tournament):
+    """Hold back writes to a tournament's results until the transaction ends.
+    Call inside a session to read a tournament and write to it with no
+    result reported in between; reports made meanwhile wait their turn.
+    The tournament bypasses the cache until the session ends.
+    :param int tournament: id of the tournament
+    :raises ValueError: if the tournament does not exist
+    """
+    locked = run_query(
+        queries.LOCK_TOURNAMENT, query_args={'tournament': tournament})
+    if not locked['result']:
+        raise ValueError("Tournament %s does not exist." % tournament)
+    # The lock bumps the version, so nothing read under it may be cached
+    invalidate(tournament)
+
+
+@metrics.instrument
+def pair_in_database(tournament):
+    """Pair the next round with the database's swiss_pairings function.
+    Players are paired greedily, as by the 'greedy' engine, and the bye is
+    recorded in the same statement, so nothing but the pairings leaves the
+    database however many players there are.
+    :param int tournament: id of the tournament to pair the next round for
+    :returns: tuples containing pairings in the format --
+        (id1, name1, id2, name2)
+    :rtype: list
+    """
+    pairings = run_query(
+        queries.SWISS_PAIRINGS, query_args=(tournament, POINTS[BYE]))
+    invalidate(tournament)
+
+    # The bye comes back first, without a second player
+    rows = pairings['result']
+    if rows and rows[0][2] is None:
+        log_events(eventlog.bye_event(tournament, rows[0][0]))
+        rows = rows[1:]
+    return rows
+
+
+@metrics.instrument
+def swiss_pairings(tournament, engine='matching'):
     """Pair players for the next round in a swiss-style tournament.
     Players are paired with an opponent with a equal or nearly-equal win
-    record. A player cannot play the same opponent twice.
+    record. A player cannot play the same opponent twice. The tournament is
+    loaded once and paired in memory; only a bye is written back.
+    The 'matching' engine pairs every player, preferring small win
+    differences within a ranking window; the 'brackets' engine pairs
+    large fields score group by score group in close to linear time; the
+    'greedy' engine is fast but may leave players unpaired late in an event.
+    The 'database' engine pairs like 'greedy' without loading the
+    tournament; see pair_in_database.
     :param int tournament: id of the tournament to pair the next round for
+    :param str engine: pairing engine to use (matching | brackets | greedy |
+        database)
     :returns: tuples containing pairings in the format --
         (id1, name1, id2, name2)
     :rtype: list
+    :raises ValueError: if no pairing without rematches exists
     """
-    standings = player_standings_by_tournament(tournament)
-    standings = rank_by_opponent_match_wins(standings, tournament)
-    standings = [standing[:2] for standing in standings]
+    if engine == 'database':
+        return pair_in_database(tournament)
+
+    try:
+        pair = ENGINES[engine]
+    except KeyError:
+        raise ValueError("Pairing engine %s is not supported." % engine)
+
+    state = load_tournament_state(tournament)
+    pairs, bye = pair(state)
 
     # Player receives a bye if odd number of players
-    if len(standings) % 2 != 0:
-        for standing in reversed(standings):
-            player, _ = standing
-            if not player_has_received_bye(player, tournament):
-                report_match_bye(player, tournament)
-                standings.pop(standings.index(standing))
-                break
-
-    players, opponents = [], []
-    while standings:
-        # Add the player we are going to find a match for
-        player = standings.pop(0)
-        players.append(player)
-
-        opponents_played = player_opponents(player[0], tournament)
-        # Iterate over the remaining opponents (standings after pop)
-        for index, opponent in enumerate(iter(standings)):
-            opponent_id, _ = opponent
-            # Never play the same opponent twice
-            if opponent_id not in opponents_played:
-                # Match found; move to next player in standings
-                opponents.append(standings.pop(index))
-                break
-
-    # Pair players with their respective opponents (determined above)
-    pairings = []
-    for matchup in zip(players, opponents):
-        player, opponent = matchup
-        pairings.append(player + opponent)
-
-    return pairings
\ No newline at end of file
+    if bye is not None:
+        report_match_bye(state.ids[bye], tournament)
+
+    return state.pairings(pairs)
@@ -8,20 +8,38 @@ CREATE DATABASE tournament;
 CREATE TABLE player (
     id serial PRIMARY KEY,
     name text NOT NULL,
+    -- Wins and matches recorded outside any tournament; lifetime records
+    -- add the player's entrant rows to them, so reports leave player alone
     wins integer NOT NULL DEFAULT 0,
     matches integer NOT NULL DEFAULT 0
 );
 
+-- Bulk registration looks players up by name
+CREATE INDEX player_name_idx ON player (name);
+
 CREATE TABLE tournament (
     id serial PRIMARY KEY,
     name text NOT NULL,
-    players integer NOT NULL
+    players integer NOT NULL,
+    -- Bumped by every write to the tournament's results, which locks the
+    -- row, so concurrent reports to one tournament queue up in turn;
+    -- cached results are checked against it before they are served
+    version integer NOT NULL DEFAULT 0
 );
 
 CREATE TABLE entrant (
     player_id integer REFERENCES player (id) ON DELETE CASCADE,
     tournament_id integer REFERENCES tournament (id) ON DELETE CASCADE,
     bye boolean NOT NULL DEFAULT FALSE,
+    -- Standings within the tournament, kept in sync with match
+    wins integer NOT NULL DEFAULT 0,
+    matches integer NOT NULL DEFAULT 0,
+    points integer NOT NULL DEFAULT 0,
+    -- Tiebreaks, kept in sync with match by update_tiebreaks: the sum of
+    -- the opponents' wins, and the mean of their match-win percentages
+    -- with each floored at a third
+    omw integer NOT NULL DEFAULT 0,
+    omwp double precision NOT NULL DEFAULT 0,
     PRIMARY KEY (player_id, tournament_id)
 );
 
@@ -37,4 +55,191 @@ CREATE TABLE match (
     FOREIGN KEY (player_id, tournament_id)
         REFERENCES entrant (player_id, tournament_id) ON DELETE CASCADE,
     PRIMARY KEY (id, player_id)
-);
\ No newline at end of file
+);
+
+-- Idempotency keys of reported results; a key is only ever reported once
+CREATE TABLE submission (
+    tournament_id integer REFERENCES tournament (id) ON DELETE CASCADE,
+    key text,
+    match_id integer NOT NULL,
+    PRIMARY KEY (tournament_id, key)
+);
+
+-- Lookups by tournament, covering the columns the hot queries read
+CREATE INDEX match_tournament_player_idx
+    ON match (tournament_id, player_id) INCLUDE (id, result_id);
+
+CREATE INDEX entrant_tournament_idx
+    ON entrant (tournament_id) INCLUDE (player_id, bye);
+
+-- Ranking within a tournament is a walk of this index
+CREATE INDEX entrant_rank_idx
+    ON entrant (tournament_id, wins DESC, omw DESC, player_id);
+
+-- Per-tournament standings with tiebreaks
+CREATE VIEW standings AS
+    SELECT e.tournament_id, e.player_id, p.name,
+           e.wins, e.matches, e.points, e.omw, e.omwp
+    FROM entrant e
+    JOIN player p ON p.id = e.player_id;
+
+-- Recompute the tiebreaks a statement's new matches change: those of the
+-- players who played, who have a new opponent, and of everyone they have
+-- played, whose opponent has a new result. Runs once the whole statement,
+-- standings updates included, has run.
+CREATE FUNCTION update_tiebreaks() RETURNS trigger AS $$
+BEGIN
+    WITH reported AS (
+        SELECT DISTINCT tournament_id, player_id FROM new_match
+    ), affected AS (
+        SELECT r.tournament_id, r.player_id
+        FROM reported r
+        UNION
+        SELECT o.tournament_id, o.player_id
+        FROM reported r
+        JOIN match m ON m.tournament_id = r.tournament_id
+        AND m.player_id = r.player_id
+        JOIN match o ON o.id = m.id AND o.player_id != m.player_id
+    ), opponents AS (
+        SELECT DISTINCT a.tournament_id, a.player_id,
+               o.player_id AS opponent_id
+        FROM affected a
+        JOIN match m ON m.tournament_id = a.tournament_id
+        AND m.player_id = a.player_id
+        JOIN match o ON o.id = m.id AND o.player_id != m.player_id
+    ), tiebreaks AS (
+        SELECT op.tournament_id, op.player_id, sum(e.wins) AS omw,
+               avg(greatest(e.points / (3.0 * e.matches), 1 / 3.0)) AS omwp
+        FROM opponents op
+        JOIN entrant e ON e.tournament_id = op.tournament_id
+        AND e.player_id = op.opponent_id
+        GROUP BY op.tournament_id, op.player_id
+    )
+    UPDATE entrant e
+    SET omw = t.omw, omwp = t.omwp
+    FROM tiebreaks t
+    WHERE e.tournament_id = t.tournament_id
+    AND e.player_id = t.player_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER match_tiebreaks
+    AFTER INSERT ON match
+    REFERENCING NEW TABLE AS new_match
+    FOR EACH STATEMENT EXECUTE FUNCTION update_tiebreaks();
+
+-- Entrants joining or leaving, and matches deleted, change a tournament's
+-- results without a report, so they bump its version too
+CREATE FUNCTION bump_tournament_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE tournament
+    SET version = version + 1
+    WHERE id IN (SELECT DISTINCT tournament_id FROM changed);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER entrant_inserted_version
+    AFTER INSERT ON entrant
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_tournament_version();
+
+CREATE TRIGGER entrant_deleted_version
+    AFTER DELETE ON entrant
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_tournament_version();
+
+CREATE TRIGGER match_deleted_version
+    AFTER DELETE ON match
+    REFERENCING OLD TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_tournament_version();
+
+-- Pair the next round like pairing.pair_greedy: down the ranking by wins,
+-- opponent match wins and id, each player takes the highest ranked player
+-- left that they have not played. In an odd field the lowest ranked player
+-- without a bye gets one, recorded in the same statement and returned
+-- ahead of the pairings.
+CREATE FUNCTION swiss_pairings(tournament integer, bye_points integer)
+RETURNS TABLE (id1 integer, name1 text, id2 integer, name2 text) AS $$
+DECLARE
+    ranked integer[];
+    names text[];
+    byes boolean[];
+    paired boolean[];
+    players integer;
+    bye_index integer;
+    i integer;
+    j integer;
+BEGIN
+    -- Results reported meanwhile wait for the round to be paired
+    UPDATE tournament t
+    SET version = t.version + 1
+    WHERE t.id = swiss_pairings.tournament;
+
+    SELECT coalesce(array_agg(e.player_id ORDER BY e.wins DESC, e.omw DESC,
+                                                   e.player_id), '{}'),
+           coalesce(array_agg(p.name ORDER BY e.wins DESC, e.omw DESC,
+                                              e.player_id), '{}'),
+           coalesce(array_agg(e.bye ORDER BY e.wins DESC, e.omw DESC,
+                                             e.player_id), '{}')
+    INTO ranked, names, byes
+    FROM entrant e
+    JOIN player p ON p.id = e.player_id
+    WHERE e.tournament_id = swiss_pairings.tournament;
+
+    players := coalesce(array_length(ranked, 1), 0);
+    paired := array_fill(FALSE, ARRAY[players]);
+
+    IF players % 2 = 1 THEN
+        FOR i IN REVERSE players..1 LOOP
+            IF NOT byes[i] THEN
+                bye_index := i;
+                EXIT;
+            END IF;
+        END LOOP;
+    END IF;
+
+    IF bye_index IS NOT NULL THEN
+        paired[bye_index] := TRUE;
+        UPDATE entrant e
+        SET bye = TRUE,
+            wins = e.wins + 1,
+            matches = e.matches + 1,
+            points = e.points + swiss_pairings.bye_points
+        WHERE e.player_id = ranked[bye_index]
+        AND e.tournament_id = swiss_pairings.tournament;
+        INSERT INTO match (player_id, tournament_id, result_id)
+        SELECT ranked[bye_index], swiss_pairings.tournament, r.id
+        FROM result r
+        WHERE r.name = 'Bye';
+        -- The bye comes first, as a row without a second player
+        id1 := ranked[bye_index];
+        name1 := names[bye_index];
+        RETURN NEXT;
+    END IF;
+
+    FOR i IN 1..players LOOP
+        CONTINUE WHEN paired[i];
+        paired[i] := TRUE;
+        FOR j IN i + 1..players LOOP
+            CONTINUE WHEN paired[j];
+            -- Never play the same opponent twice
+            CONTINUE WHEN EXISTS (
+                SELECT 1
+                FROM match m, match o
+                WHERE o.id = m.id
+                AND m.tournament_id = swiss_pairings.tournament
+                AND m.player_id = ranked[i]
+                AND o.player_id = ranked[j]);
+            paired[j] := TRUE;
+            id1 := ranked[i];
+            name1 := names[i];
+            id2 := ranked[j];
+            name2 := names[j];
+            RETURN NEXT;
+            EXIT;
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,476 @@
+"""Asyncio API of a Swiss-system tournament.
+Coroutines mirror tournament.py and run the same queries (see queries.py)
+over an aiopg connection pool, so an event loop is never blocked on the
+database. The DSN and pool size come from tournament.configure() and the
+results cache is shared with tournament.py.
+Requires Python 3.7+, aiopg and the PostgreSQL backend.
+"""
+
+import asyncio
+
+import aiopg
+import psycopg2
+
+import eventlog
+import queries
+import tournament as sync
+from pairing import ENGINES, TournamentState
+
+_pool = None
+_pool_lock = None
+
+# Loads in flight by (tournament, key, cache version)
+_loading = {}
+
+
+async def get_pool():
+    """Get the async connection pool, creating it on first use.
+    The pool belongs to the running event loop; close() it before the loop
+    is closed.
+    :returns: connection pool for the configured DSN
+    :rtype: aiopg.Pool
+    """
+    global _pool, _pool_lock
+
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await aiopg.create_pool(
+                sync.DSN, minsize=0, maxsize=sync.POOL_SIZE)
+        return _pool
+
+
+async def close():
+    """Close every pooled connection."""
+    global _pool, _pool_lock
+
+    pool, _pool, _pool_lock = _pool, None, None
+    _loading.clear()
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+async def run_query(query, query_args=(), query_type='SELECT'):
+    """Run a query against the tournament database.
+    Results are returned as by tournament.run_query. Connections are in
+    autocommit mode, so each query is committed on its own.
+    :param str query: query string to run
+    :param tuple query_args: query args to pass to execute
+    :param str query_type: query type to run (SELECT | UPDATE | DELETE |
+        INSERT)
+    :returns: query result; result type depends on query type
+    :rtype: dict
+    """
+    query_type = query_type.upper()
+
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(query, query_args)
+
+            if query_type == 'SELECT':
+                result = await cursor.fetchall()
+            elif query_type == 'INSERT' and 'RETURNING' in query:
+                try:
+                    # Requires RETURNING be used
+                    result, = await cursor.fetchone()
+                except psycopg2.ProgrammingError:
+                    result = None
+            elif query_type in ('UPDATE', 'DELETE', 'INSERT'):
+                result = cursor.rowcount
+            else:
+                raise ValueError(
+                    "Query type %s is not supported." % query_type)
+
+    return {'result': result}
+
+
+async def cached(tournament, key, load):
+    """Get a tournament's cached result, loading it on a miss.
+    Concurrent misses of the same result are coalesced into one load.
+    :param int tournament: id of the tournament the result belongs to
+    :param key: key of the result within the tournament
+    :param load: coroutine function loading the result from the database
+    :returns: cached or freshly loaded result
+    """
+    database_version = None
+    if sync.CACHE_VALIDATE and sync.cache.max_bytes:
+        # Writes made by other processes bump the version too
+        rows = (await run_query(
+            queries.TOURNAMENT_VERSION, query_args=(tournament,)))['result']
+        database_version = rows[0][0] if rows else None
+
+    found, value, version = sync.cache.lookup(
+        tournament, key, database_version)
+    if found:
+        return value
+
+    # Concurrent misses of the same version share a single load
+    flight = (tournament, key, version)
+    loading = _loading.get(flight)
+    if loading is not None:
+        # Only the load in flight stores its value
+        sync.cache.discard(tournament)
+    else:
+        async def load_and_store():
+            try:
+                value = await load()
+            except BaseException:
+                sync.cache.discard(tournament)
+                raise
+            sync.cache.store(tournament, key, value, version)
+            return value
+
+        loading = _loading[flight] = asyncio.ensure_future(load_and_store())
+        loading.add_done_callback(lambda _: _loading.pop(flight, None))
+    # A cancelled caller must not cancel the load other callers wait on
+    return await asyncio.shield(loading)
+
+
+async def delete_all_from_table(table):
+    """Delete all rows from a table.
+    :param str table: name of the table to delete all rows from
+    :returns: count of rows deleted
+    :rtype: int
+    """
+    deleted = await run_query(queries.DELETE_ALL % table, query_type='DELETE')
+    sync.cache.invalidate()
+    return deleted['result']
+
+
+async def delete_matches():
+    """Delete all the match records from the database.
+    :returns: count of rows deleted from match table
+    :rtype: int
+    """
+    return await delete_all_from_table('match')
+
+
+async def delete_players():
+    """Delete all the player records from the database.
+    :returns: count of rows deleted from player table
+    :rtype: int
+    """
+    return await delete_all_from_table('player')
+
+
+async def count_players():
+    """Count of all players currently registered.
+    :returns: count of all registered players
+    :rtype: int
+    """
+    players = await run_query(queries.COUNT_PLAYERS)
+    return players['result'][0][0]
+
+
+async def register_player(name):
+    """Add a player to the tournament database.
+    :param str name: name of player to register
+    :returns: id of the registered player
+    :rtype: int
+    """
+    inserted = await run_query(
+        queries.REGISTER_PLAYER, query_args=(name,), query_type='INSERT')
+    return inserted['result']
+
+
+async def register_tournament(name, players):
+    """Add a tournament to the tournament database.
+    :param str name: name of tournament to register
+    :param int players: number of tournament entrants
+    :returns: id of the registered tournament
+    :rtype: int
+    """
+    inserted = await run_query(
+        queries.REGISTER_TOURNAMENT, query_args=(name, players),
+        query_type='INSERT')
+    return inserted['result']
+
+
+async def register_player_in_tournament(player, tournament):
+    """Register a player in a tournament as an entrant.
+    :param int player: id of the player to register
+    :param int tournament: id of the tournament to register player in
+    :returns: rowcount of the player inserted, 0 | 1
+    :rtype: int
+    """
+    inserted = await run_query(
+        queries.REGISTER_ENTRANT, query_args=(player, tournament),
+        query_type='INSERT')
+    sync.cache.invalidate(tournament)
+    if inserted['result'] and sync.events.enabled:
+        names = await run_query(
+            queries.PLAYER_NAMES, query_args=([player],))
+        sync.log_events(*[
+            eventlog.entered_event(tournament, player, name)
+            for player, name in names['result']])
+    return inserted['result']
+
+
+async def player_standings():
+    """Get a list of the players and their win records, sorted by wins.
+    :returns: list of players and win records
+    :rtype: list
+    """
+    standings = await run_query(queries.PLAYER_STANDINGS)
+    return standings['result']
+
+
+async def player_opponents(player, tournament):
+    """Get a list of the played opponents for a player in a tournament.
+    :param int player: id of the player to get played opponents for
+    :param int tournament: id of the tournament
+    :returns: list of opponents that specified player has played
+    :rtype: list
+    """
+    async def load():
+        opponents = await run_query(
+            queries.PLAYER_OPPONENTS,
+            query_args=(player, tournament, player))
+        return [result[0] for result in opponents['result']]
+
+    return list(await cached(tournament, ('opponents', player), load))
+
+
+async def players_opponents(players, tournament):
+    """Get the played opponents of several players concurrently.
+    :param list players: ids of the players
+    :param int tournament: id of the tournament
+    :returns: lists of opponents keyed by player id
+    :rtype: dict
+    """
+    opponents = await asyncio.gather(
+        *[player_opponents(player, tournament) for player in players])
+    return dict(zip(players, opponents))
+
+
+async def player_opponents_match_wins(player, tournament):
+    """Get a sum of the played opponents match wins in a tournament.
+    :param int player: id of the player
+    :param int tournament: id of the tournament
+    :returns: sum of opponent wins for a specified player
+    :rtype: int
+    """
+    opponents_match_wins = (await run_query(
+        queries.PLAYER_OPPONENTS_MATCH_WINS,
+        query_args=(player, tournament)))['result']
+
+    return opponents_match_wins[0][0] if opponents_match_wins else 0
+
+
+async def opponents_match_wins(tournament):
+    """Get the sum of played opponents match wins for every entrant.
+    :param int tournament: id of the tournament
+    :returns: opponent match wins keyed by player id; 0 for players
+        without opponents
+    :rtype: dict
+    """
+    async def load():
+        omw = await run_query(
+            queries.OPPONENTS_MATCH_WINS, query_args=(tournament,))
+        return dict(omw['result'])
+
+    return dict(await cached(tournament, 'omw', load))
+
+
+async def player_standings_by_tournament(tournament):
+    """Get a list of the players and their win records by tournament.
+    :param int tournament: id of tournament to get standings for
+    :returns: list of players and win records
+    :rtype: list
+    """
+    async def load():
+        standings = await run_query(
+            queries.STANDINGS_BY_TOURNAMENT, query_args=(tournament,))
+        return standings['result']
+
+    return list(await cached(tournament, 'standings', load))
+
+
+async def player_has_received_bye(player, tournament):
+    """Get whether or not a player has received a bye for a tournament.
+    :param int player: id of the player to check
+    :param int tournament: id of tournament to check
+    :returns: whether a player received a bye in a tournament; True | False
+    :rtype: boolean
+    """
+    bye = await run_query(
+        queries.HAS_RECEIVED_BYE, query_args=(player, tournament))
+    return bye['result'][0][0]
+
+
+async def report_match(winner, loser, tournament, tie=False, key=None):
+    """Report the outcome of a single match between two players.
+    :param int winner: id of the winner
+    :param int loser: id of the loser
+    :param int tournament: id of the tournament the match was played in
+    :param bool tie: whether match was a tie; True | False
+    :param str key: idempotency key of the result; see tournament.report_match
+    :returns: id of the reported match, or of the match first reported
+        under key
+    :rtype: int
+    :raises ValueError: if the tournament does not exist
+    """
+    reported = await run_query(
+        queries.REPORT_MATCH,
+        query_args=queries.report_match_args(
+            winner, loser, tournament, tie, key))
+    reported = reported['result']
+    if reported:
+        sync.cache.invalidate(tournament)
+        sync.log_events(eventlog.result_event(
+            tournament, reported[0][0], winner, loser, tie))
+    elif key is not None:
+        submitted = await run_query(
+            queries.SUBMITTED_MATCH, query_args=(tournament, key))
+        reported = submitted['result']
+    if not reported:
+        raise ValueError("Tournament %s does not exist." % tournament)
+    return reported[0][0]
+
+
+async def report_match_bye(player, tournament):
+    """Report a bye for a player in a tournament.
+    :param int player: id of the player to report a bye for
+    :param int tournament: id of the tournament to report the bye in
+    :returns: rowcount of the player updated; 0 | 1
+    :rtype: int
+    """
+    updated = await run_query(
+        queries.REPORT_MATCH_BYE,
+        query_args=queries.report_match_bye_args(player, tournament),
+        query_type='UPDATE')
+    sync.cache.invalidate(tournament)
+    if updated['result']:
+        sync.log_events(eventlog.bye_event(tournament, player))
+    return updated['result']
+
+
+async def report_matches(tournament, results, byes=()):
+    """Report every result of a round in one statement.
+    :param int tournament: id of the tournament the round was played in
+    :param iterable results: (winner, loser, tie) tuples; tie is optional
+    :param iterable byes: ids of the players receiving a bye this round
+    :returns: ids of the reported matches, results first and then byes, in
+        input order
+    :rtype: list
+    :raises ValueError: if the tournament does not exist
+    """
+    query_args = queries.report_matches_args(tournament, results, byes)
+    if query_args is None:
+        return []
+
+    reported = await run_query(queries.REPORT_MATCHES, query_args=query_args)
+    if not reported['result']:
+        raise ValueError("Tournament %s does not exist." % tournament)
+    sync.cache.invalidate(tournament)
+    match_ids = [row[0] for row in reported['result']]
+    if sync.events.enabled:
+        sync.log_events(*[
+            eventlog.result_event(tournament, match_id, winner, loser, tie)
+            if loser is not None else eventlog.bye_event(tournament, winner)
+            for match_id, winner, loser, tie in zip(
+                match_ids, query_args['winners'], query_args['losers'],
+                query_args['ties'])])
+    return match_ids
+
+
+async def rank_by_opponent_match_wins(standings, tournament):
+    """Rank like players using opponent match wins.
+    :param list standings: standings for a tournament
+    :param int tournament: id of the tournament
+    :returns: standings sorted by match wins, then opponent match wins
+    :rtype: list
+    """
+    omw = await opponents_match_wins(tournament)
+
+    def omw_key(standing):
+        player, _, wins = standing[:3]
+        return -wins, -omw.get(player, 0), player
+
+    return sorted(standings, key=omw_key)
+
+
+async def ranked_standings(tournament):
+    """Get a tournament's standings ranked by wins and opponent match wins.
+    :param int tournament: id of the tournament
+    :returns: list of players and win records, highest ranked first
+    :rtype: list
+    """
+    async def load():
+        standings = await run_query(
+            queries.RANKED_STANDINGS, query_args=(tournament,))
+        return standings['result']
+
+    return list(await cached(tournament, 'ranked', load))
+
+
+async def load_tournament_state(tournament):
+    """Load a tournament's entrants and match history into memory.
+    Entrants and matches are fetched concurrently. The snapshot is cached
+    and shared with tournament.py, so it must not be modified.
+    :param int tournament: id of the tournament to load
+    :returns: snapshot of the tournament for ranking and pairing
+    :rtype: pairing.TournamentState
+    """
+    async def load():
+        entrants, opponents = await asyncio.gather(
+            run_query(queries.STATE_ENTRANTS, query_args=(tournament,)),
+            run_query(queries.STATE_OPPONENTS, query_args=(tournament,)))
+        return TournamentState(
+            tournament, entrants['result'], opponents['result'])
+
+    return await cached(tournament, 'state', load)
+
+
+async def pair_in_database(tournament):
+    """Pair the next round with the database's swiss_pairings function.
+    :param int tournament: id of the tournament to pair the next round for
+    :returns: tuples containing pairings in the format --
+        (id1, name1, id2, name2)
+    :rtype: list
+    """
+    bye_points = queries.POINTS[queries.BYE]
+    pairings = await run_query(
+        queries.SWISS_PAIRINGS, query_args=(tournament, bye_points))
+    sync.cache.invalidate(tournament)
+
+    # The bye comes back first, without a second player
+    rows = pairings['result']
+    if rows and rows[0][2] is None:
+        sync.log_events(eventlog.bye_event(tournament, rows[0][0]))
+        rows = rows[1:]
+    return rows
+
+
+async def swiss_pairings(tournament, engine='matching'):
+    """Pair players for the next round in a swiss-style tournament.
+    Pairing runs in the loop's default executor, so large fields do not
+    stall other coroutines; see tournament.swiss_pairings for the engines.
+    :param int tournament: id of the tournament to pair the next round for
+    :param str engine: pairing engine to use (matching | brackets | greedy |
+        database)
+    :returns: tuples containing pairings in the format --
+        (id1, name1, id2, name2)
+    :rtype: list
+    :raises ValueError: if no pairing without rematches exists
+    """
+    if engine == 'database':
+        return await pair_in_database(tournament)
+
+    try:
+        pair = ENGINES[engine]
+    except KeyError:
+        raise ValueError("Pairing engine %s is not supported." % engine)
+
+    state = await load_tournament_state(tournament)
+    loop = asyncio.get_running_loop()
+    pairs, bye = await loop.run_in_executor(None, pair, state)
+
+    # Player receives a bye if odd number of players
+    if bye is not None:
+        await report_match_bye(state.ids[bye], tournament)
+
+    return state.pairings(pairs)
@@ -0,0 +1,105 @@
+-- SQLite dialect of tournament.sql, applied by backends.SQLiteBackend.
+-- Keep the two schemas in step.
+
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS player (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    name text NOT NULL,
+    -- Wins and matches recorded outside any tournament; lifetime records
+    -- add the player's entrant rows to them
+    wins integer NOT NULL DEFAULT 0,
+    matches integer NOT NULL DEFAULT 0
+);
+
+-- Bulk registration looks players up by name
+CREATE INDEX IF NOT EXISTS player_name_idx ON player (name);
+
+CREATE TABLE IF NOT EXISTS tournament (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    name text NOT NULL,
+    players integer NOT NULL,
+    version integer NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS entrant (
+    player_id integer REFERENCES player (id) ON DELETE CASCADE,
+    tournament_id integer REFERENCES tournament (id) ON DELETE CASCADE,
+    bye boolean NOT NULL DEFAULT FALSE,
+    -- Standings within the tournament, kept in sync with match
+    wins integer NOT NULL DEFAULT 0,
+    matches integer NOT NULL DEFAULT 0,
+    points integer NOT NULL DEFAULT 0,
+    -- Tiebreaks, kept in sync with match by SQLiteBackend._report
+    omw integer NOT NULL DEFAULT 0,
+    omwp real NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, tournament_id)
+);
+
+CREATE TABLE IF NOT EXISTS result (
+    id integer PRIMARY KEY,
+    name text
+);
+
+INSERT OR IGNORE INTO result (id, name)
+    VALUES (1, 'Win'), (2, 'Loss'), (3, 'Tie'), (4, 'Bye');
+
+CREATE TABLE IF NOT EXISTS submission (
+    tournament_id integer REFERENCES tournament (id) ON DELETE CASCADE,
+    key text,
+    match_id integer NOT NULL,
+    PRIMARY KEY (tournament_id, key)
+);
+
+-- Stands in for the serial sequence of match.id
+CREATE TABLE IF NOT EXISTS match_sequence (
+    id integer PRIMARY KEY AUTOINCREMENT
+);
+
+CREATE TABLE IF NOT EXISTS match (
+    id integer,
+    player_id integer,
+    tournament_id integer,
+    result_id integer REFERENCES result (id),
+    FOREIGN KEY (player_id, tournament_id)
+        REFERENCES entrant (player_id, tournament_id) ON DELETE CASCADE,
+    PRIMARY KEY (id, player_id)
+);
+
+CREATE INDEX IF NOT EXISTS match_tournament_player_idx
+    ON match (tournament_id, player_id, id, result_id);
+
+CREATE INDEX IF NOT EXISTS entrant_tournament_idx
+    ON entrant (tournament_id, player_id, bye);
+
+CREATE INDEX IF NOT EXISTS entrant_rank_idx
+    ON entrant (tournament_id, wins DESC, omw DESC, player_id);
+
+-- Entrants joining or leaving, and matches deleted, bump the version too
+CREATE TRIGGER IF NOT EXISTS entrant_inserted_version
+    AFTER INSERT ON entrant
+BEGIN
+    UPDATE tournament SET version = version + 1
+    WHERE id = NEW.tournament_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS entrant_deleted_version
+    AFTER DELETE ON entrant
+BEGIN
+    UPDATE tournament SET version = version + 1
+    WHERE id = OLD.tournament_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS match_deleted_version
+    AFTER DELETE ON match
+BEGIN
+    UPDATE tournament SET version = version + 1
+    WHERE id = OLD.tournament_id;
+END;
+
+-- Per-tournament standings with tiebreaks
+CREATE VIEW IF NOT EXISTS standings AS
+    SELECT e.tournament_id, e.player_id, p.name,
+           e.wins, e.matches, e.points, e.omw, e.omwp
+    FROM entrant e
+    JOIN player p ON p.id = e.player_id;